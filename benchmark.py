@@ -0,0 +1,525 @@
+"""
+Benchmark das Funções de Acesso a Dados do Portal do Gerente Médico
+Cria um banco PostgreSQL temporário com o esquema do portal, carrega um volume
+sintético de dados e mede as consultas do portal (sem cache do Streamlit).
+
+Uso (na pasta do portal, para usar o mesmo .streamlit/secrets.toml):
+    python benchmark.py
+    python benchmark.py --gerentes 50 --estudos-por-gerente 4 --desvios-por-estudo 5000
+    python benchmark.py --saida antes.json
+    python benchmark.py --saida depois.json --comparar antes.json
+
+O banco temporário é criado no mesmo servidor da seção [postgres] (o usuário
+precisa de permissão CREATEDB) e removido no final, a menos que --manter seja
+usado. Para outro servidor, informe --host/--port/--user/--password.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg2
+import streamlit as st
+from streamlit import logger as streamlit_logger
+from psycopg2 import sql
+
+import externos
+from externos import (
+    SQL_LOGIN_GERENTE,
+    DiretorioGerentes,
+    PoolConexoes,
+    RoteadorLeitura,
+    carregar_detalhe_desvio,
+    carregar_estudos_do_gerente,
+    carregar_metricas_gerente,
+    carregar_pagina_desvios,
+    atualizar_snapshot,
+    carregar_snapshot_completo,
+    contar_desvios,
+    salvar_avaliacao,
+)
+from manutencao_banco import aplicar_migracao, garantir_tabela_migracoes, listar_migracoes
+
+FILTROS = ["Pendentes", "Todos", "Novo", "Modificado", "Avaliado"]
+
+
+# =========================
+# Banco Temporário
+# =========================
+
+# Tabelas mantidas pelo portal interno (as estruturas auxiliares vêm de sql/)
+SQL_ESQUEMA_BASE = """
+    CREATE TABLE gerentes_medicos (
+        id            SERIAL PRIMARY KEY,
+        nome          TEXT,
+        email         TEXT,
+        patrocinador  TEXT
+    );
+
+    CREATE TABLE estudos (
+        id      SERIAL PRIMARY KEY,
+        codigo  TEXT,
+        nome    TEXT,
+        status  TEXT DEFAULT 'ativo'
+    );
+
+    CREATE TABLE estudo_gerente_medico (
+        id                 SERIAL PRIMARY KEY,
+        estudo_id          INTEGER REFERENCES estudos,
+        gerente_medico_id  INTEGER REFERENCES gerentes_medicos
+    );
+
+    CREATE TABLE estudo_monitores (
+        id             SERIAL PRIMARY KEY,
+        estudo_id      INTEGER REFERENCES estudos,
+        monitor_email  TEXT
+    );
+
+    CREATE TABLE desvios (
+        id                        SERIAL PRIMARY KEY,
+        estudo_id                 INTEGER REFERENCES estudos,
+        numero_desvio_estudo      INTEGER,
+        status                    TEXT,
+        status_en                 TEXT,
+        formulario_status         TEXT,
+        formulario_status_en      TEXT,
+        importancia               TEXT,
+        importancia_en            TEXT,
+        recorrencia               TEXT,
+        recorrencia_en            TEXT,
+        escopo                    TEXT,
+        escopo_en                 TEXT,
+        atendeu_prazos_report     TEXT,
+        atendeu_prazos_report_en  TEXT,
+        formulario_arquivado      TEXT,
+        formulario_arquivado_en   TEXT,
+        identificacao_desvio      TEXT,
+        centro                    TEXT,
+        data_ocorrido             DATE,
+        participante              TEXT,
+        visita                    TEXT,
+        data_identificacao_texto  TEXT,
+        categoria                 TEXT,
+        subcategoria              TEXT,
+        codigo                    TEXT,
+        num_ocorrencia_previa     TEXT,
+        prazo_escalonamento       DATE,
+        data_escalonamento        DATE,
+        descricao_desvio          TEXT,
+        motivo                    TEXT,
+        causa_raiz                TEXT,
+        acao_corretiva            TEXT,
+        acao_preventiva           TEXT,
+        avaliacao_investigador    TEXT,
+        data_submissao_cep        DATE,
+        data_finalizacao          DATE,
+        observacao                TEXT,
+        avaliacao_gerente_medico  TEXT,
+        atualizado_por            TEXT,
+        data_atualizacao          TIMESTAMPTZ DEFAULT NOW(),
+        deleted_at                TIMESTAMPTZ
+    );
+
+    CREATE TABLE desvios_log (
+        id              SERIAL PRIMARY KEY,
+        desvio_id       INTEGER,
+        estudo_id       INTEGER,
+        usuario         TEXT,
+        campo           TEXT,
+        valor_antigo    TEXT,
+        valor_novo      TEXT,
+        data_alteracao  TIMESTAMPTZ DEFAULT NOW()
+    );
+"""
+
+# Volume sintético (%% = operador módulo): 40% Novo, 20% Modificado, 40% Avaliado; 2% excluídos (soft delete)
+SQL_CARGA = """
+    INSERT INTO gerentes_medicos (nome, email, patrocinador)
+    SELECT 'Gerente ' || g, 'gerente' || g || '@bench.local', 'Patrocinador ' || (g %% 7)
+    FROM generate_series(1, %(gerentes)s) g;
+
+    INSERT INTO estudos (codigo, nome, status)
+    SELECT 'EST-' || e, 'Estudo ' || e, CASE WHEN e %% 10 = 0 THEN 'encerrado' ELSE 'ativo' END
+    FROM generate_series(1, %(gerentes)s * %(estudos_por_gerente)s) e;
+
+    INSERT INTO estudo_gerente_medico (estudo_id, gerente_medico_id)
+    SELECT e, (e - 1) / %(estudos_por_gerente)s + 1
+    FROM generate_series(1, %(gerentes)s * %(estudos_por_gerente)s) e;
+
+    INSERT INTO estudo_monitores (estudo_id, monitor_email)
+    SELECT e, 'monitor' || m || '.estudo' || e || '@bench.local'
+    FROM generate_series(1, %(gerentes)s * %(estudos_por_gerente)s) e,
+         generate_series(1, %(monitores_por_estudo)s) m;
+
+    INSERT INTO desvios (
+        estudo_id, numero_desvio_estudo, status, status_en, importancia, importancia_en,
+        recorrencia, recorrencia_en, escopo, escopo_en, centro, participante, visita,
+        categoria, subcategoria, data_ocorrido, descricao_desvio, motivo, causa_raiz,
+        acao_corretiva, acao_preventiva, avaliacao_gerente_medico, data_atualizacao, deleted_at
+    )
+    SELECT
+        e,
+        n,
+        (ARRAY['Novo', 'Novo', 'Modificado', 'Avaliado', 'Avaliado'])[1 + (n * 7 + e) %% 5],
+        (ARRAY['New', 'New', 'Modified', 'Evaluated', 'Evaluated'])[1 + (n * 7 + e) %% 5],
+        (ARRAY['Maior', 'Menor'])[1 + n %% 2],
+        (ARRAY['Major', 'Minor'])[1 + n %% 2],
+        (ARRAY['Não', 'Sim'])[1 + n %% 2],
+        (ARRAY['No', 'Yes'])[1 + n %% 2],
+        (ARRAY['Participante', 'Centro'])[1 + n %% 2],
+        (ARRAY['Participant', 'Site'])[1 + n %% 2],
+        'Centro ' || (n %% 25),
+        'P-' || e || '-' || (n %% 400),
+        'V' || (n %% 12),
+        'Categoria ' || (n %% 9),
+        'Subcategoria ' || (n %% 31),
+        DATE '2020-01-01' + (n %% 1500),
+        repeat(md5(n::text || e::text), 1 + n %% 20),
+        repeat(md5(n::text), 1 + n %% 5),
+        repeat(md5(e::text), 1 + n %% 5),
+        repeat(md5((n + e)::text), 1 + n %% 5),
+        repeat(md5((n * e)::text), 1 + n %% 5),
+        CASE WHEN (n * 7 + e) %% 5 >= 3 THEN 'Avaliação ' || n END,
+        NOW() - (1 + n %% 900) * INTERVAL '1 day',
+        CASE WHEN n %% 50 = 0 THEN NOW() - (1 + n %% 900) * INTERVAL '1 day' END
+    FROM generate_series(1, %(gerentes)s * %(estudos_por_gerente)s) e,
+         generate_series(1, %(desvios_por_estudo)s) n;
+
+    INSERT INTO desvios_log (desvio_id, estudo_id, usuario, campo, valor_antigo, valor_novo, data_alteracao)
+    SELECT d.id, d.estudo_id, 'carga', c.campo, '', 'valor ' || d.id, NOW() - (d.id %% 900) * INTERVAL '1 day'
+    FROM desvios d,
+         (VALUES ('status'), ('descricao_desvio')) AS c(campo);
+"""
+
+
+def parametros_servidor(args) -> dict:
+    """Servidor onde o banco temporário é criado: [postgres] do secrets.toml, sobrescrito pelos argumentos"""
+    parametros = {}
+    try:
+        db = st.secrets["postgres"]
+        parametros = {
+            "host": db["host"],
+            "port": db["port"],
+            "dbname": db["database"],
+            "user": db["user"],
+            "password": db["password"],
+        }
+    except (FileNotFoundError, KeyError):
+        parametros = {"dbname": "postgres"}
+    for chave in ["host", "port", "user", "password"]:
+        valor = getattr(args, chave)
+        if valor is not None:
+            parametros[chave] = valor
+    return parametros
+
+
+def criar_banco(servidor: dict, nome: str):
+    conn = psycopg2.connect(**servidor)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(nome)))
+    finally:
+        conn.close()
+
+
+def remover_banco(servidor: dict, nome: str):
+    conn = psycopg2.connect(**servidor)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(nome)))
+    finally:
+        conn.close()
+
+
+def preparar_banco(parametros: dict, volume: dict):
+    """Cria o esquema base, aplica as migrações de sql/ e carrega o volume sintético"""
+    conn = psycopg2.connect(**parametros)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_ESQUEMA_BASE)
+        conn.commit()
+
+        garantir_tabela_migracoes(conn)
+        for versao, nome, caminho in listar_migracoes():
+            aplicar_migracao(conn, versao, nome, caminho)
+
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_CARGA, volume)
+        conn.commit()
+
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE")
+    finally:
+        conn.close()
+
+
+# =========================
+# Medições
+# =========================
+
+def medir(nome: str, funcao, iteracoes: int, aquecimento: int) -> dict:
+    """
+    Executa `funcao(i)` (que retorna a quantidade de linhas lidas/gravadas)
+    `aquecimento` + `iteracoes` vezes e resume os tempos das iterações medidas.
+    """
+    for i in range(aquecimento):
+        funcao(i)
+
+    tempos, linhas = [], 0
+    for i in range(aquecimento, aquecimento + iteracoes):
+        inicio = time.perf_counter()
+        linhas += funcao(i)
+        tempos.append(time.perf_counter() - inicio)
+
+    percentis = statistics.quantiles(tempos, n=100, method="inclusive") if len(tempos) > 1 else tempos * 99
+    total = sum(tempos)
+    resultado = {
+        "iteracoes": len(tempos),
+        "p50_ms": round(percentis[49] * 1000, 3),
+        "p95_ms": round(percentis[94] * 1000, 3),
+        "p99_ms": round(percentis[98] * 1000, 3),
+        "media_ms": round(total / len(tempos) * 1000, 3),
+        "max_ms": round(max(tempos) * 1000, 3),
+        "linhas": linhas,
+        "linhas_por_s": round(linhas / total, 1) if total else 0.0,
+    }
+    print(
+        f"  {nome:<52} p50 {resultado['p50_ms']:>9.2f} ms  p95 {resultado['p95_ms']:>9.2f} ms  "
+        f"p99 {resultado['p99_ms']:>9.2f} ms  {resultado['linhas_por_s']:>12.1f} linhas/s"
+    )
+    return resultado
+
+
+def executar_benchmarks(volume: dict, iteracoes: int, aquecimento: int, semente: int) -> dict:
+    """
+    Mede as funções de acesso a dados chamando as versões sem cache
+    (__wrapped__); filtros e páginas da lista são medidos sobre o snapshot
+    em cache, como a tela os executa.
+    """
+    aleatorio = random.Random(semente)
+    total_estudos = volume["gerentes"] * volume["estudos_por_gerente"]
+    n = iteracoes + aquecimento
+
+    gerentes = [aleatorio.randint(1, volume["gerentes"]) for _ in range(n)]
+    emails = [f"gerente{g}@bench.local" for g in gerentes]
+    estudos = [aleatorio.randint(1, total_estudos) for _ in range(n)]
+    meio = (volume["desvios_por_estudo"] // 2, 2 ** 31 - 1)
+
+    def login(i):
+        with externos.get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(SQL_LOGIN_GERENTE, (emails[i].upper(),))
+            return len(cursor.fetchall())
+
+    resultados = {}
+    print("Telas de login e seleção de estudo")
+    resultados["login"] = medir("login (LOWER(email))", login, iteracoes, aquecimento)
+    diretorio = DiretorioGerentes()
+    resultados["login_diretorio"] = medir(
+        "login (DiretorioGerentes)",
+        lambda i: 1 if diretorio.por_email(emails[i].upper()) else 0,
+        iteracoes, aquecimento,
+    )
+    resultados["carregar_estudos_do_gerente"] = medir(
+        "carregar_estudos_do_gerente",
+        lambda i: len(carregar_estudos_do_gerente.__wrapped__(gerentes[i])),
+        iteracoes, aquecimento,
+    )
+    resultados["carregar_metricas_gerente"] = medir(
+        "carregar_metricas_gerente",
+        lambda i: 1 if carregar_metricas_gerente.__wrapped__(gerentes[i]) else 0,
+        iteracoes, aquecimento,
+    )
+
+    print("Lista de desvios")
+    resultados["carregar_snapshot_completo"] = medir(
+        "carregar_snapshot_completo (banco)",
+        lambda i: len(carregar_snapshot_completo(estudos[i])["desvios"]),
+        iteracoes, aquecimento,
+    )
+    # Incremental: snapshots recém-lidos, então só as linhas da janela de sobreposição
+    snapshots = {e: carregar_snapshot_completo(e) for e in set(estudos)}
+    resultados["atualizar_snapshot"] = medir(
+        "atualizar_snapshot (delta)",
+        lambda i: len((atualizar_snapshot(snapshots[estudos[i]], estudos[i]) or {"desvios": []})["desvios"]),
+        iteracoes, aquecimento,
+    )
+    # Filtros, páginas e contagens saem do snapshot em cache (sem banco);
+    # o aquecimento carrega os snapshots sorteados
+    for filtro in FILTROS:
+        resultados[f"carregar_pagina_desvios[{filtro}]"] = medir(
+            f"carregar_pagina_desvios [{filtro}] 1ª página",
+            lambda i, f=filtro: len(carregar_pagina_desvios(estudos[i], f)["desvios"]),
+            iteracoes, aquecimento,
+        )
+        resultados[f"carregar_pagina_desvios[{filtro}]/meio"] = medir(
+            f"carregar_pagina_desvios [{filtro}] meio da lista",
+            lambda i, f=filtro: len(carregar_pagina_desvios(estudos[i], f, cursor=meio)["desvios"]),
+            iteracoes, aquecimento,
+        )
+        resultados[f"carregar_pagina_desvios[{filtro}]/todos"] = medir(
+            f"carregar_pagina_desvios [{filtro}] todos",
+            lambda i, f=filtro: len(carregar_pagina_desvios(estudos[i], f, 0)["desvios"]),
+            iteracoes, aquecimento,
+        )
+        resultados[f"contar_desvios[{filtro}]"] = medir(
+            f"contar_desvios [{filtro}]",
+            lambda i, f=filtro: 1 if contar_desvios(estudos[i], f) is not None else 0,
+            iteracoes, aquecimento,
+        )
+
+    # Desvios pendentes sorteados para a abertura de detalhe e para as avaliações
+    with externos.get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT id, estudo_id, numero_desvio_estudo, status, avaliacao_gerente_medico, xmin::text
+            FROM desvios
+            WHERE deleted_at IS NULL AND status != 'Avaliado'
+            ORDER BY random()
+            LIMIT %s
+            """,
+            (n,),
+        )
+        pendentes = cursor.fetchall()
+    if len(pendentes) < n:
+        raise RuntimeError(f"Volume insuficiente: {len(pendentes)} desvios pendentes para {n} avaliações")
+
+    print("Detalhe e avaliação")
+    resultados["carregar_detalhe_desvio"] = medir(
+        "carregar_detalhe_desvio",
+        lambda i: 1 if carregar_detalhe_desvio.__wrapped__(pendentes[i][0], pendentes[i][5]) else 0,
+        iteracoes, aquecimento,
+    )
+
+    st.session_state["gerente_nome"] = "Benchmark"
+    st.session_state["gerente_email"] = "benchmark@bench.local"
+
+    def avaliar(i):
+        desvio_id, estudo_id, numero, status, valor_antigo, row_version = pendentes[i]
+        ok, msg = salvar_avaliacao(
+            {"id": desvio_id, "numero_desvio_estudo": numero},
+            estudo_id, f"Avaliação de benchmark {i}", row_version, valor_antigo, status,
+        )
+        if not ok:
+            raise RuntimeError(f"salvar_avaliacao falhou para o desvio {desvio_id}: {msg}")
+        return 1
+
+    resultados["salvar_avaliacao"] = medir("salvar_avaliacao", avaliar, iteracoes, aquecimento)
+    return resultados
+
+
+def comparar(atual: dict, anterior: dict):
+    """Imprime a variação de p50/p95 em relação a um resultado anterior"""
+    print(f"\nComparação com {anterior.get('gerado_em')} (commit {anterior.get('commit') or '?'}):")
+    for nome, r in atual["resultados"].items():
+        base = anterior.get("resultados", {}).get(nome)
+        if not base:
+            print(f"  {nome:<52} (novo)")
+            continue
+        variacoes = []
+        for chave in ["p50_ms", "p95_ms"]:
+            if base[chave]:
+                variacoes.append(f"{chave[:3]} {(r[chave] / base[chave] - 1) * 100:+7.1f}%")
+        print(f"  {nome:<52} {'  '.join(variacoes)}")
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark das funções de acesso a dados do portal")
+    parser.add_argument("--gerentes", type=int, default=20)
+    parser.add_argument("--estudos-por-gerente", dest="estudos_por_gerente", type=int, default=5)
+    parser.add_argument("--desvios-por-estudo", dest="desvios_por_estudo", type=int, default=2000)
+    parser.add_argument("--monitores-por-estudo", dest="monitores_por_estudo", type=int, default=3)
+    parser.add_argument("--iteracoes", type=int, default=50, help="iterações medidas por função")
+    parser.add_argument("--aquecimento", type=int, default=5, help="iterações descartadas antes da medição")
+    parser.add_argument("--semente", type=int, default=42, help="semente do sorteio de gerentes/estudos")
+    parser.add_argument("--saida", help="arquivo JSON de resultado (padrão: benchmark_AAAAMMDD_HHMMSS.json)")
+    parser.add_argument("--comparar", help="resultado JSON anterior para comparação")
+    parser.add_argument("--manter", action="store_true", help="não remove o banco temporário no final")
+    parser.add_argument("--host")
+    parser.add_argument("--port")
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    # As funções do portal rodam fora do `streamlit run`: silencia os avisos de contexto
+    streamlit_logger.set_log_level("error")
+
+    volume = {
+        "gerentes": args.gerentes,
+        "estudos_por_gerente": args.estudos_por_gerente,
+        "desvios_por_estudo": args.desvios_por_estudo,
+        "monitores_por_estudo": args.monitores_por_estudo,
+    }
+    servidor = parametros_servidor(args)
+    nome_banco = f"portal_bench_{uuid.uuid4().hex[:8]}"
+    parametros = {**servidor, "dbname": nome_banco, "application_name": "portal_benchmark"}
+
+    print(f"Criando banco temporário {nome_banco}...")
+    criar_banco(servidor, nome_banco)
+    pool = None
+    try:
+        inicio = time.perf_counter()
+        preparar_banco(parametros, volume)
+        print(f"Carga de {args.gerentes * args.estudos_por_gerente * args.desvios_por_estudo} desvios "
+              f"em {time.perf_counter() - inicio:.1f}s")
+
+        # As funções do portal passam a usar o banco temporário
+        pool = PoolConexoes(parametros, minimo=1, maximo=4)
+        externos.get_pool = lambda: pool
+        # Sem réplicas: um [postgres_leitura] configurado não pode receber a carga do benchmark
+        roteador = RoteadorLeitura(pool)
+        externos.get_roteador_leitura = lambda: roteador
+
+        with pool.conexao() as conn, conn.cursor() as cursor:
+            cursor.execute("SHOW server_version")
+            versao_servidor = cursor.fetchone()[0]
+
+        resultado = {
+            "gerado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _commit_atual(),
+            "postgres": versao_servidor,
+            "python": sys.version.split()[0],
+            "volume": volume,
+            "iteracoes": args.iteracoes,
+            "aquecimento": args.aquecimento,
+            "semente": args.semente,
+            "resultados": executar_benchmarks(volume, args.iteracoes, args.aquecimento, args.semente),
+        }
+    finally:
+        if pool is not None:
+            pool.fechar()
+        if args.manter:
+            print(f"Banco temporário mantido: {nome_banco}")
+        else:
+            remover_banco(servidor, nome_banco)
+
+    saida = Path(args.saida or f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    saida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nResultado salvo em {saida}")
+
+    if args.comparar:
+        comparar(resultado, json.loads(Path(args.comparar).read_text(encoding="utf-8")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
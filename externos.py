@@ -6,11 +6,32 @@ Portal externo para avaliação de desvios de estudos clínicos
 import pandas as pd
 import streamlit as st
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from pandas.api.types import union_categoricals
+from psycopg2 import extensions, sql
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import functools
+import html
+import importlib.util
+import inspect
+import os
+import select
 import smtplib
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+import zipfile
+import zlib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 
 # =========================
@@ -73,6 +94,10 @@ TRANSLATIONS = {
         "pendência(s)": "pendência(s)",
         "Sem pendências": "Sem pendências",
         "Acessar": "Acessar",
+        "Buscar estudo por código ou nome": "Buscar estudo por código ou nome",
+        "Somente com pendências": "Somente com pendências",
+        "Nenhum estudo encontrado com o filtro informado.": "Nenhum estudo encontrado com o filtro informado.",
+        "estudo(s)": "estudo(s)",
         "Filtrar por status": "Filtrar por status",
         "Pendentes": "Pendentes",
         "Todos": "Todos",
@@ -80,6 +105,12 @@ TRANSLATIONS = {
         "Modificado": "Modificado",
         "Avaliado": "Avaliado",
         "Atualizar": "Atualizar",
+        "Por página": "Por página",
+        "por página": "por página",
+        "Anterior": "Anterior",
+        "Próxima": "Próxima",
+        "Página": "Página",
+        "de": "de",
         "Carregando desvios...": "Carregando desvios...",
         "Nenhum desvio pendente de avaliação!": "Nenhum desvio pendente de avaliação!",
         "Nenhum desvio encontrado com o filtro selecionado.": "Nenhum desvio encontrado com o filtro selecionado.",
@@ -98,6 +129,34 @@ TRANSLATIONS = {
         "Avaliação salva com sucesso!": "Avaliação salva com sucesso!",
         "Este desvio foi modificado por outra pessoa. Clique em 'Atualizar' para ver a versão mais recente.": "Este desvio foi modificado por outra pessoa. Clique em 'Atualizar' para ver a versão mais recente.",
         "Erro ao salvar": "Erro ao salvar",
+        "Este desvio não está mais disponível. Clique em 'Atualizar' para recarregar a lista.": "Este desvio não está mais disponível. Clique em 'Atualizar' para recarregar a lista.",
+        "Um desvio": "Um desvio",
+        "Em lote": "Em lote",
+        "Modo de avaliação": "Modo de avaliação",
+        "Avaliação em lote": "Avaliação em lote",
+        "Selecione os desvios pendentes e informe a avaliação de cada um ou uma avaliação comum.": "Selecione os desvios pendentes e informe a avaliação de cada um ou uma avaliação comum.",
+        "Nenhum desvio pendente nesta página.": "Nenhum desvio pendente nesta página.",
+        "Selecionar": "Selecionar",
+        "Avaliação individual (opcional)": "Avaliação individual (opcional)",
+        "Avaliação comum (usada nos selecionados sem avaliação individual)": "Avaliação comum (usada nos selecionados sem avaliação individual)",
+        "Salvar avaliações selecionadas": "Salvar avaliações selecionadas",
+        "Selecione ao menos um desvio.": "Selecione ao menos um desvio.",
+        "Desvios selecionados sem avaliação": "Desvios selecionados sem avaliação",
+        "avaliação(ões) salva(s) com sucesso!": "avaliação(ões) salva(s) com sucesso!",
+        "Modificados por outra pessoa e não salvos (clique em 'Atualizar')": "Modificados por outra pessoa e não salvos (clique em 'Atualizar')",
+        "Buscar nos textos dos desvios": "Buscar nos textos dos desvios",
+        "ex.: ECG não realizado na visita 4": "ex.: ECG não realizado na visita 4",
+        "Nenhum desvio contém esses termos.": "Nenhum desvio contém esses termos.",
+        "Muitos desvios contêm esses termos: a relevância foi calculada entre os mais recentes. Refine a busca para resultados melhores.": "Muitos desvios contêm esses termos: a relevância foi calculada entre os mais recentes. Refine a busca para resultados melhores.",
+        "Erro na busca": "Erro na busca",
+        "Exportar estudo": "Exportar estudo",
+        "Todos os desvios do estudo (com a avaliação do gerente médico) e o histórico de alterações, no idioma selecionado.": "Todos os desvios do estudo (com a avaliação do gerente médico) e o histórico de alterações, no idioma selecionado.",
+        "Formato": "Formato",
+        "Baixar": "Baixar",
+        "Parquet requer o pacote pyarrow no servidor.": "Parquet requer o pacote pyarrow no servidor.",
+        "Erro ao carregar os estudos": "Erro ao carregar os estudos",
+        "Erro ao carregar o desvio": "Erro ao carregar o desvio",
+        "Erro ao carregar os desvios": "Erro ao carregar os desvios",
         "Gerente Médico": "Gerente Médico",
         "Patrocinador": "Patrocinador",
         "Estudo Atual": "Estudo Atual",
@@ -161,6 +220,10 @@ TRANSLATIONS = {
         "pendência(s)": "pending item(s)",
         "Sem pendências": "No pending items",
         "Acessar": "Access",
+        "Buscar estudo por código ou nome": "Search study by code or name",
+        "Somente com pendências": "Pending only",
+        "Nenhum estudo encontrado com o filtro informado.": "No studies match the filter.",
+        "estudo(s)": "study(ies)",
         "Filtrar por status": "Filter by status",
         "Pendentes": "Pending",
         "Todos": "All",
@@ -168,6 +231,12 @@ TRANSLATIONS = {
         "Modificado": "Modified",
         "Avaliado": "Evaluated",
         "Atualizar": "Refresh",
+        "Por página": "Per page",
+        "por página": "per page",
+        "Anterior": "Previous",
+        "Próxima": "Next",
+        "Página": "Page",
+        "de": "of",
         "Carregando desvios...": "Loading deviations...",
         "Nenhum desvio pendente de avaliação!": "No deviations pending evaluation!",
         "Nenhum desvio encontrado com o filtro selecionado.": "No deviations found with the selected filter.",
@@ -186,6 +255,34 @@ TRANSLATIONS = {
         "Avaliação salva com sucesso!": "Evaluation saved successfully!",
         "Este desvio foi modificado por outra pessoa. Clique em 'Atualizar' para ver a versão mais recente.": "This deviation was modified by someone else. Click 'Refresh' to see the latest version.",
         "Erro ao salvar": "Error saving",
+        "Este desvio não está mais disponível. Clique em 'Atualizar' para recarregar a lista.": "This deviation is no longer available. Click 'Refresh' to reload the list.",
+        "Um desvio": "Single deviation",
+        "Em lote": "Bulk",
+        "Modo de avaliação": "Evaluation mode",
+        "Avaliação em lote": "Bulk evaluation",
+        "Selecione os desvios pendentes e informe a avaliação de cada um ou uma avaliação comum.": "Select pending deviations and enter an evaluation for each one or a common evaluation.",
+        "Nenhum desvio pendente nesta página.": "No pending deviations on this page.",
+        "Selecionar": "Select",
+        "Avaliação individual (opcional)": "Individual evaluation (optional)",
+        "Avaliação comum (usada nos selecionados sem avaliação individual)": "Common evaluation (used for selected rows without an individual one)",
+        "Salvar avaliações selecionadas": "Save selected evaluations",
+        "Selecione ao menos um desvio.": "Select at least one deviation.",
+        "Desvios selecionados sem avaliação": "Selected deviations without an evaluation",
+        "avaliação(ões) salva(s) com sucesso!": "evaluation(s) saved successfully!",
+        "Modificados por outra pessoa e não salvos (clique em 'Atualizar')": "Modified by someone else and not saved (click 'Refresh')",
+        "Buscar nos textos dos desvios": "Search deviation texts",
+        "ex.: ECG não realizado na visita 4": "e.g.: missed ECG at visit 4",
+        "Nenhum desvio contém esses termos.": "No deviation contains these terms.",
+        "Muitos desvios contêm esses termos: a relevância foi calculada entre os mais recentes. Refine a busca para resultados melhores.": "Many deviations contain these terms: relevance was computed among the most recent ones. Refine the search for better results.",
+        "Erro na busca": "Search error",
+        "Exportar estudo": "Export study",
+        "Todos os desvios do estudo (com a avaliação do gerente médico) e o histórico de alterações, no idioma selecionado.": "All deviations of the study (with the medical manager evaluation) and the change history, in the selected language.",
+        "Formato": "Format",
+        "Baixar": "Download",
+        "Parquet requer o pacote pyarrow no servidor.": "Parquet requires the pyarrow package on the server.",
+        "Erro ao carregar os estudos": "Error loading studies",
+        "Erro ao carregar o desvio": "Error loading the deviation",
+        "Erro ao carregar os desvios": "Error loading deviations",
         "Gerente Médico": "Medical Manager",
         "Patrocinador": "Sponsor",
         "Estudo Atual": "Current Study",
@@ -197,70 +294,1080 @@ TRANSLATIONS = {
 }
 
 
-def t(key: str) -> str:
-    """Retorna a tradução de uma chave baseado no idioma selecionado"""
-    lang = st.session_state.get("language", "pt")
+def t(key: str, lang: str = None) -> str:
+    """Retorna a tradução de uma chave baseado no idioma selecionado (ou em `lang`)"""
+    lang = lang or st.session_state.get("language", "pt")
     return TRANSLATIONS.get(lang, TRANSLATIONS["pt"]).get(key, key)
 
 
 # =========================
-# Config / Conexão com Banco
+# Métricas (formato Prometheus)
 # =========================
 
-def get_connection():
-    """Cria conexão com o banco PostgreSQL usando secrets.toml"""
-    db = st.secrets["postgres"]
-    return psycopg2.connect(
-        host=db["host"],
-        port=db["port"],
-        dbname=db["database"],
-        user=db["user"],
-        password=db["password"],
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DESCRICOES_METRICAS = {
+    "portal_consulta_segundos": ("histogram", "Duração das consultas ao banco por nome lógico"),
+    "portal_consulta_erros_total": ("counter", "Consultas ao banco que terminaram em erro"),
+    "portal_tela_segundos": ("histogram", "Duração da renderização de cada tela"),
+    "portal_cache_acertos_total": ("counter", "Chamadas atendidas pelo cache em memória"),
+    "portal_cache_falhas_total": ("counter", "Chamadas que executaram a função (cache vazio ou expirado)"),
+    "portal_cache_despejos_total": ("counter", "Entradas descartadas por LRU (limite da função ou orçamento de memória)"),
+    "portal_cache_bytes": ("gauge", "Memória estimada das entradas em cache, por função"),
+    "portal_cache_entradas": ("gauge", "Entradas em cache, por função"),
+    "portal_cache_orcamento_bytes": ("gauge", "Orçamento de memória do cache do processo"),
+    "portal_snapshot_recargas_total": ("counter", "Recargas do snapshot de desvios por tipo (completa, delta, completa_apos_delta)"),
+    "portal_snapshot_linhas_delta_total": ("counter", "Linhas lidas pelas atualizações incrementais do snapshot de desvios"),
+    "portal_leituras_total": ("counter", "Leituras por destino (réplica ou primário) e motivo da escolha"),
+    "portal_replica_atraso_segundos": ("gauge", "Atraso de replay medido em cada réplica (-1 = inacessível)"),
+    "portal_smtp_envio_segundos": ("histogram", "Duração do envio SMTP por etapa (sessao completa ou envio a um destinatário)"),
+    "portal_smtp_erros_total": ("counter", "Envios SMTP que terminaram em erro"),
+    "portal_notificacoes_avaliacoes_total": ("counter", "Avaliações notificadas aos monitores, por modo de envio"),
+    "portal_notificacoes_mensagens_total": ("counter", "Mensagens de email enviadas aos monitores, por modo de envio"),
+    "portal_notificacoes_mensagens_evitadas_total": ("counter", "Mensagens poupadas em relação a um email por avaliação e destinatário"),
+}
+
+
+class Metricas:
+    """
+    Registro de métricas do processo (histogramas, contadores e medidores com rótulos),
+    exportado em formato texto do Prometheus. Thread-safe: é compartilhado
+    por todas as sessões do Streamlit e pelas threads do worker.
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS_SEGUNDOS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._contadores = {}    # (nome, rótulos) -> valor (contadores e medidores)
+        self._histogramas = {}   # (nome, rótulos) -> [contagens por bucket, soma, total]
+
+    @staticmethod
+    def _chave(nome: str, rotulos: dict) -> tuple:
+        return nome, tuple(sorted(rotulos.items()))
+
+    def incrementar(self, nome: str, rotulos: dict, valor: float = 1):
+        chave = self._chave(nome, rotulos)
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def definir(self, nome: str, rotulos: dict, valor: float):
+        """Medidor (gauge): guarda o valor atual"""
+        chave = self._chave(nome, rotulos)
+        with self._lock:
+            self._contadores[chave] = valor
+
+    def observar(self, nome: str, rotulos: dict, valor: float):
+        chave = self._chave(nome, rotulos)
+        with self._lock:
+            histograma = self._histogramas.get(chave)
+            if histograma is None:
+                histograma = self._histogramas[chave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    histograma[0][i] += 1
+            histograma[1] += valor
+            histograma[2] += 1
+
+    @staticmethod
+    def _rotulos(rotulos: tuple, le: str = None) -> str:
+        pares = list(rotulos) + ([("le", le)] if le is not None else [])
+        if not pares:
+            return ""
+        escapar = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+    def texto(self) -> str:
+        """Todas as métricas no formato de exposição texto do Prometheus"""
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {k: (list(v[0]), v[1], v[2]) for k, v in self._histogramas.items()}
+
+        linhas = []
+        nomes = sorted({nome for nome, _ in contadores} | {nome for nome, _ in histogramas})
+        for nome in nomes:
+            tipo, descricao = DESCRICOES_METRICAS.get(nome, ("untyped", nome))
+            linhas.append(f"# HELP {nome} {descricao}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for (n, rotulos), valor in sorted(contadores.items()):
+                if n == nome:
+                    linhas.append(f"{nome}{self._rotulos(rotulos)} {valor}")
+            for (n, rotulos), (buckets, soma, total) in sorted(histogramas.items()):
+                if n != nome:
+                    continue
+                for limite, contagem in zip(self.buckets, buckets):
+                    linhas.append(f"{nome}_bucket{self._rotulos(rotulos, limite)} {contagem}")
+                linhas.append(f"{nome}_bucket{self._rotulos(rotulos, '+Inf')} {total}")
+                linhas.append(f"{nome}_sum{self._rotulos(rotulos)} {soma}")
+                linhas.append(f"{nome}_count{self._rotulos(rotulos)} {total}")
+        return "\n".join(linhas) + "\n"
+
+
+@st.cache_resource
+def get_metricas() -> Metricas:
+    """Registro único de métricas do processo"""
+    return Metricas()
+
+
+@contextmanager
+def medir_consulta(nome: str):
+    """Mede o bloco (execute + fetch) como a consulta `nome`; erros também são contados"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        get_metricas().incrementar("portal_consulta_erros_total", {"consulta": nome})
+        raise
+    finally:
+        get_metricas().observar("portal_consulta_segundos", {"consulta": nome}, time.perf_counter() - inicio)
+
+
+@contextmanager
+def medir_smtp(etapa: str):
+    """Mede uma etapa do envio SMTP: "sessao" (conexão, login e todos os envios) ou "envio" (um destinatário)"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        get_metricas().incrementar("portal_smtp_erros_total", {"etapa": etapa})
+        raise
+    finally:
+        get_metricas().observar("portal_smtp_envio_segundos", {"etapa": etapa}, time.perf_counter() - inicio)
+
+
+def medir_tela(nome: str):
+    """Decorador: mede a duração de uma função de tela (inclusive quando ela chama st.rerun)"""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def executar(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                get_metricas().observar("portal_tela_segundos", {"tela": nome}, time.perf_counter() - inicio)
+        return executar
+    return decorador
+
+
+class _HandlerMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        corpo = get_metricas().texto().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def exportar_metricas(porta: int = 0, host: str = "127.0.0.1", arquivo: str = None, intervalo: float = 15):
+    """
+    Publica get_metricas() em http://host:porta/metrics e/ou grava o texto em
+    `arquivo` a cada `intervalo` segundos (coletor textfile do node_exporter).
+    Roda em threads daemon; uma porta ocupada só gera um aviso.
+    """
+    if porta:
+        try:
+            servidor = ThreadingHTTPServer((host, int(porta)), _HandlerMetricas)
+            threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+        except OSError as e:
+            print(f"Métricas: não foi possível abrir {host}:{porta}: {e}")
+
+    if arquivo:
+        def gravar():
+            while True:
+                try:
+                    temporario = f"{arquivo}.tmp"
+                    with open(temporario, "w", encoding="utf-8") as f:
+                        f.write(get_metricas().texto())
+                    os.replace(temporario, arquivo)
+                except OSError as e:
+                    print(f"Métricas: erro ao gravar {arquivo}: {e}")
+                time.sleep(intervalo)
+
+        threading.Thread(target=gravar, name="metricas-arquivo", daemon=True).start()
+
+
+@st.cache_resource
+def iniciar_exportador_metricas() -> bool:
+    """
+    Exporta as métricas do portal conforme a seção [metricas] do secrets.toml:
+    porta (padrão 9464, 0 desliga), host (padrão 127.0.0.1), arquivo e
+    intervalo. Chamado uma vez por processo a partir de main().
+    """
+    config = st.secrets.get("metricas", {})
+    exportar_metricas(
+        porta=int(config.get("porta", 9464)),
+        host=config.get("host", "127.0.0.1"),
+        arquivo=config.get("arquivo"),
+        intervalo=float(config.get("intervalo", 15)),
     )
+    return True
 
 
 # =========================
-# Envio de Email
+# Cache em Memória (LRU com orçamento)
 # =========================
 
-def buscar_emails_monitores_do_estudo(estudo_id: int, excluir_email: str = None):
+MEMORIA_CACHE_MB = 256       # orçamento padrão de todas as funções em cache; [cache] memoria_mb no secrets.toml
+LIMITE_COMPRESSAO = 1024     # textos maiores que isso (em caracteres) são guardados com zlib
+COLUNAS_CATEGORICAS = ("status", "status_exibicao", "importancia", "centro", "visita")
+
+
+def tamanho_em_bytes(valor) -> int:
+    """Estimativa da memória ocupada por um valor em cache (DataFrames pelo pandas, o resto por sys.getsizeof)"""
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamanho_em_bytes(k) + tamanho_em_bytes(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(tamanho_em_bytes(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+class TextoComprimido:
+    """Texto longo guardado com zlib enquanto está no cache"""
+
+    __slots__ = ("dados",)
+
+    def __init__(self, texto: str):
+        self.dados = zlib.compress(texto.encode("utf-8"), 6)
+
+    def __str__(self) -> str:
+        return zlib.decompress(self.dados).decode("utf-8")
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sys.getsizeof(self.dados)
+
+
+def comprimir_texto(valor):
+    if isinstance(valor, str) and len(valor) > LIMITE_COMPRESSAO:
+        return TextoComprimido(valor)
+    return valor
+
+
+def expandir_texto(valor):
+    return str(valor) if isinstance(valor, TextoComprimido) else valor
+
+
+def compactar_registro(registro):
+    """Linha (dict) com os textos longos comprimidos; None continua None"""
+    if registro is None:
+        return None
+    return {campo: comprimir_texto(valor) for campo, valor in registro.items()}
+
+
+def expandir_registro(registro):
+    if registro is None:
+        return None
+    return {campo: expandir_texto(valor) for campo, valor in registro.items()}
+
+
+def compactar_desvios(desvios: pd.DataFrame) -> pd.DataFrame:
     """
-    Busca os emails dos monitores do estudo.
-    Opcionalmente exclui um email específico (ex: o gerente médico que fez a avaliação).
-    Retorna uma lista de emails únicos.
+    Forma colunar compacta da lista de desvios: colunas de poucos valores
+    distintos viram categorias (cada texto é guardado uma vez e as linhas
+    guardam só um código). Comparações e exibição continuam iguais.
     """
+    if desvios is None or desvios.empty:
+        return desvios
+    colunas = [c for c in COLUNAS_CATEGORICAS if c in desvios.columns]
+    return desvios.astype({c: "category" for c in colunas})
+
+
+def _copia(valor):
+    """Cópia rasa do valor em cache, para que quem o recebe não altere a entrada guardada"""
+    if isinstance(valor, pd.DataFrame):
+        return valor.copy(deep=False)
+    if isinstance(valor, dict):
+        return dict(valor)
+    if isinstance(valor, list):
+        return [dict(v) if isinstance(v, dict) else v for v in valor]
+    return valor
+
+
+class CacheMemoria:
+    """
+    Cache do processo para todas as funções decoradas com cache_com_metricas.
+    Uma única fila LRU atravessa as funções: quando a memória estimada passa
+    do orçamento, saem as entradas usadas há mais tempo, de qualquer função.
+    Cada função ainda tem seu `max_entries` e seu TTL.
+    """
+
+    def __init__(self, orcamento_bytes: int, metricas: Metricas = None):
+        self.orcamento_bytes = orcamento_bytes
+        self._metricas = metricas
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # (funcao, chave) -> (expira_em, valor, bytes)
+        self._por_funcao = {}           # funcao -> [entradas, bytes]
+        self.total_bytes = 0
+        if metricas is not None:
+            metricas.definir("portal_cache_orcamento_bytes", {}, orcamento_bytes)
+
+    def obter(self, funcao: str, chave):
+        """(True, valor) se houver entrada válida; (False, None) caso contrário"""
+        with self._lock:
+            entrada = self._entradas.get((funcao, chave))
+            if entrada is None:
+                return False, None
+            if entrada[0] is not None and entrada[0] < time.monotonic():
+                self._remover((funcao, chave))
+                self._publicar(funcao)
+                return False, None
+            self._entradas.move_to_end((funcao, chave))
+            return True, entrada[1]
+
+    def guardar(self, funcao: str, chave, valor, ttl: float = None, max_entries: int = None):
+        tamanho = tamanho_em_bytes(valor) + sys.getsizeof(chave)
+        if tamanho > self.orcamento_bytes:
+            return  # maior que o orçamento inteiro: não vale despejar tudo por ela
+        expira_em = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if (funcao, chave) in self._entradas:
+                self._remover((funcao, chave))
+            self._entradas[(funcao, chave)] = (expira_em, valor, tamanho)
+            uso = self._por_funcao.setdefault(funcao, [0, 0])
+            uso[0] += 1
+            uso[1] += tamanho
+            self.total_bytes += tamanho
+
+            despejadas = {}
+            if max_entries and uso[0] > max_entries:
+                for chave_antiga in [k for k in self._entradas if k[0] == funcao][: uso[0] - max_entries]:
+                    self._remover(chave_antiga)
+                    despejadas[funcao] = despejadas.get(funcao, 0) + 1
+            while self.total_bytes > self.orcamento_bytes and self._entradas:
+                chave_antiga = next(iter(self._entradas))
+                self._remover(chave_antiga)
+                despejadas[chave_antiga[0]] = despejadas.get(chave_antiga[0], 0) + 1
+
+            for nome in set(despejadas) | {funcao}:
+                self._publicar(nome)
+        if self._metricas is not None:
+            for nome, quantidade in despejadas.items():
+                self._metricas.incrementar("portal_cache_despejos_total", {"funcao": nome}, quantidade)
+
+    def limpar(self, funcao: str = None):
+        with self._lock:
+            for chave in [k for k in self._entradas if funcao is None or k[0] == funcao]:
+                self._remover(chave)
+            for nome in list(self._por_funcao) if funcao is None else [funcao]:
+                self._publicar(nome)
+
+    def relatorio(self) -> dict:
+        """Tamanho atual do cache: total, orçamento e {funcao: {"entradas", "bytes"}}"""
+        with self._lock:
+            return {
+                "total_bytes": self.total_bytes,
+                "orcamento_bytes": self.orcamento_bytes,
+                "funcoes": {
+                    nome: {"entradas": uso[0], "bytes": uso[1]}
+                    for nome, uso in sorted(self._por_funcao.items())
+                },
+            }
+
+    def _remover(self, chave):
+        _, _, tamanho = self._entradas.pop(chave)
+        uso = self._por_funcao[chave[0]]
+        uso[0] -= 1
+        uso[1] -= tamanho
+        self.total_bytes -= tamanho
+
+    def _publicar(self, funcao: str):
+        # Chamado com o lock do cache; o registro de métricas tem lock próprio
+        if self._metricas is not None:
+            entradas, tamanho = self._por_funcao.get(funcao, (0, 0))
+            self._metricas.definir("portal_cache_entradas", {"funcao": funcao}, entradas)
+            self._metricas.definir("portal_cache_bytes", {"funcao": funcao}, tamanho)
+
+
+@st.cache_resource(show_spinner=False)
+def get_cache_memoria() -> CacheMemoria:
+    """Cache único do processo; orçamento em [cache] memoria_mb no secrets.toml"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        memoria_mb = st.secrets.get("cache", {}).get("memoria_mb", MEMORIA_CACHE_MB)
+    except FileNotFoundError:
+        memoria_mb = MEMORIA_CACHE_MB
+    return CacheMemoria(int(float(memoria_mb) * 1024 * 1024), get_metricas())
 
-        # Busca apenas monitores do estudo
-        cursor.execute(
-            """
-            SELECT DISTINCT monitor_email
-            FROM estudo_monitores
-            WHERE estudo_id = %s AND monitor_email IS NOT NULL AND monitor_email != ''
-            """,
-            (estudo_id,),
-        )
-        monitores = [row['monitor_email'].lower() for row in cursor.fetchall() if row['monitor_email']]
 
-        # Remove o email a ser excluído (se fornecido)
-        if excluir_email:
-            excluir_email_lower = excluir_email.lower()
-            monitores = [e for e in monitores if e != excluir_email_lower]
+def relatorio_cache() -> dict:
+    return get_cache_memoria().relatorio()
 
-        return monitores
 
-    except Exception as e:
-        print(f"Erro ao buscar destinatários: {e}")
-        return []
-    finally:
+def cache_com_metricas(nome: str, ttl: float = None, max_entries: int = None, compactar=None, expandir=None, **_opcoes):
+    """
+    Cache das funções de acesso a dados, no lugar de @st.cache_data: as
+    entradas ficam no CacheMemoria do processo (LRU com orçamento de memória)
+    e acertos/falhas são contados por função. Como no st.cache_data,
+    parâmetros cujo nome começa com "_" não fazem parte da chave.
+
+    `compactar` transforma o resultado antes de guardá-lo e `expandir` o
+    devolve à forma original a cada acerto. `__wrapped__` continua apontando
+    para a função original (sem cache) e `clear()` limpa o cache da função.
+    Demais opções do st.cache_data (ex.: show_spinner) são aceitas e ignoradas.
+    """
+    def decorador(funcao):
+        assinatura = inspect.signature(funcao)
+
+        def chave_de(args, kwargs):
+            argumentos = assinatura.bind(*args, **kwargs)
+            argumentos.apply_defaults()
+            chave = tuple((k, v) for k, v in argumentos.arguments.items() if not k.startswith("_"))
+            try:
+                hash(chave)
+            except TypeError:
+                chave = repr(chave)
+            return chave
+
+        @functools.wraps(funcao)
+        def chamar(*args, **kwargs):
+            cache = get_cache_memoria()
+            chave = chave_de(args, kwargs)
+            encontrado, guardado = cache.obter(nome, chave)
+            if encontrado:
+                get_metricas().incrementar("portal_cache_acertos_total", {"funcao": nome})
+            else:
+                get_metricas().incrementar("portal_cache_falhas_total", {"funcao": nome})
+                guardado = funcao(*args, **kwargs)
+                if compactar is not None:
+                    guardado = compactar(guardado)
+                cache.guardar(nome, chave, guardado, ttl=ttl, max_entries=max_entries)
+            return expandir(guardado) if expandir is not None else _copia(guardado)
+
+        chamar.clear = lambda: get_cache_memoria().limpar(nome)
+        return chamar
+    return decorador
+
+
+# =========================
+# Config / Conexão com Banco
+# =========================
+
+class PoolEsgotado(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo limite de espera do pool"""
+
+
+class PoolConexoes:
+    """
+    Pool de conexões PostgreSQL compartilhado por todas as sessões do processo.
+
+    - Mantém entre `minimo` e `maximo` conexões abertas.
+    - No checkout, descarta conexões fechadas, quebradas ou mais velhas que
+      `idade_maxima` e testa com `SELECT 1` as que ficaram ociosas por mais de
+      `intervalo_verificacao` segundos.
+    - Na devolução, desfaz transações abertas para a conexão voltar limpa.
+    - Registra o tempo de espera no checkout e a saturação para dimensionamento.
+    """
+
+    def __init__(
+        self,
+        parametros: dict,
+        minimo: int = 1,
+        maximo: int = 10,
+        timeout: float = 10.0,
+        idade_maxima: float = 1800.0,
+        intervalo_verificacao: float = 30.0,
+    ):
+        if minimo < 0 or maximo < 1 or minimo > maximo:
+            raise ValueError("Tamanho do pool inválido: é preciso 0 <= minimo <= maximo e maximo >= 1")
+
+        self.parametros = parametros
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout = timeout
+        self.idade_maxima = idade_maxima
+        self.intervalo_verificacao = intervalo_verificacao
+
+        self._cond = threading.Condition()
+        self._livres = []  # pilha de (conexão, devolvida_em) - LIFO reaproveita as mais quentes
+        self._criada_em = {}  # conexão -> instante de abertura
+        self._em_uso = 0
+        self._abrindo = 0
+        self._aguardando = 0
+        self._fechado = False
+
+        # Estatísticas acumuladas
+        self._checkouts = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._timeouts = 0
+        self._criadas = 0
+        self._descartadas = 0
+        self._em_uso_max = 0
+
+        for _ in range(minimo):
+            conn = self._abrir()
+            self._livres.append((conn, time.monotonic()))
+
+    def _abrir(self):
+        conn = psycopg2.connect(**self.parametros)
+        with self._cond:
+            self._criada_em[conn] = time.monotonic()
+            self._criadas += 1
+        return conn
+
+    def _descartar(self, conn):
+        with self._cond:
+            self._criada_em.pop(conn, None)
+            self._descartadas += 1
         try:
-            cursor.close()
             conn.close()
         except Exception:
             pass
 
+    def _expirada(self, conn) -> bool:
+        criada_em = self._criada_em.get(conn, 0.0)
+        return self.idade_maxima > 0 and time.monotonic() - criada_em > self.idade_maxima
+
+    def _saudavel(self, conn, devolvida_em: float) -> bool:
+        """Verifica a conexão antes de entregá-la (só faz round trip se ficou ociosa)"""
+        if conn.closed or self._expirada(conn):
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - devolvida_em < self.intervalo_verificacao:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self):
+        """Retira uma conexão do pool, esperando até `timeout` segundos se estiver saturado"""
+        inicio = time.monotonic()
+        prazo = inicio + self.timeout
+
+        with self._cond:
+            while True:
+                if self._fechado:
+                    raise PoolEsgotado("Pool de conexões encerrado")
+                if self._livres:
+                    conn, devolvida_em = self._livres.pop()
+                    break
+                if len(self._criada_em) + self._abrindo < self.maximo:
+                    # Reserva a vaga; a conexão é aberta fora do lock
+                    conn, devolvida_em = None, None
+                    self._abrindo += 1
+                    break
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolEsgotado(
+                        f"Nenhuma conexão livre em {self.timeout:.1f}s ({self.maximo} em uso)"
+                    )
+                self._aguardando += 1
+                try:
+                    self._cond.wait(restante)
+                finally:
+                    self._aguardando -= 1
+
+            self._em_uso += 1
+            self._em_uso_max = max(self._em_uso_max, self._em_uso)
+            espera = time.monotonic() - inicio
+            self._checkouts += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+
+        try:
+            if conn is not None and not self._saudavel(conn, devolvida_em):
+                with self._cond:
+                    self._abrindo += 1
+                self._descartar(conn)
+                conn = None
+            if conn is None:
+                try:
+                    conn = self._abrir()
+                finally:
+                    with self._cond:
+                        self._abrindo -= 1
+        except Exception:
+            with self._cond:
+                self._em_uso -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def devolver(self, conn, descartar: bool = False):
+        """Devolve a conexão ao pool, encerrando transações pendentes"""
+        if not descartar and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                descartar = True
+
+        if descartar or conn.closed or self._expirada(conn) or self._fechado:
+            self._descartar(conn)
+        else:
+            with self._cond:
+                self._livres.append((conn, time.monotonic()))
+
+        with self._cond:
+            self._em_uso -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def conexao(self):
+        """Context manager: `with pool.conexao() as conn:` devolve a conexão ao final"""
+        conn = self.obter()
+        descartar = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Conexão possivelmente quebrada: não volta para o pool
+            descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar=descartar)
+
+    def estatisticas(self) -> dict:
+        """Retorna métricas de uso do pool (tempos em milissegundos)"""
+        with self._cond:
+            abertas = len(self._criada_em)
+            return {
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "abertas": abertas,
+                "em_uso": self._em_uso,
+                "em_uso_max": self._em_uso_max,
+                "livres": len(self._livres),
+                "aguardando": self._aguardando,
+                "saturacao": self._em_uso / self.maximo,
+                "checkouts": self._checkouts,
+                "espera_media_ms": (self._espera_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                "espera_max_ms": self._espera_max * 1000,
+                "espera_total_ms": self._espera_total * 1000,
+                "timeouts": self._timeouts,
+                "conexoes_criadas": self._criadas,
+                "conexoes_descartadas": self._descartadas,
+            }
+
+    def fechar(self):
+        """Fecha as conexões livres; as que estão em uso são fechadas na devolução"""
+        with self._cond:
+            self._fechado = True
+            livres, self._livres = self._livres, []
+            self._cond.notify_all()
+        for conn, _ in livres:
+            self._descartar(conn)
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool() -> PoolConexoes:
+    """
+    Pool único do processo, configurado pela seção [postgres] do secrets.toml.
+    Chaves opcionais: pool_min_size, pool_max_size, pool_timeout (s),
+    pool_max_lifetime (s), pool_health_check_interval (s), connect_timeout (s).
+    """
+    db = st.secrets["postgres"]
+    return PoolConexoes(
+        parametros=_parametros_conexao(db),
+        minimo=int(db.get("pool_min_size", 1)),
+        maximo=int(db.get("pool_max_size", 10)),
+        timeout=float(db.get("pool_timeout", 10)),
+        idade_maxima=float(db.get("pool_max_lifetime", 1800)),
+        intervalo_verificacao=float(db.get("pool_health_check_interval", 30)),
+    )
+
+
+# =========================
+# Leituras em Réplicas
+# =========================
+
+INTERVALO_REVERIFICACAO = 0.25  # s: réplica atrás do LSN exigido é consultada de novo após esse tempo
+
+
+def lsn_para_int(lsn) -> int:
+    """'16/B374D848' (pg_lsn em texto) -> posição numérica no WAL"""
+    if lsn is None:
+        return 0
+    if isinstance(lsn, int):
+        return lsn
+    alto, baixo = str(lsn).split("/")
+    return (int(alto, 16) << 32) + int(baixo, 16)
+
+
+class RoteadorLeitura:
+    """
+    Escolhe onde cada leitura é executada: em uma réplica em dia ou no primário.
+
+    - As réplicas são usadas em rodízio. Uma réplica com atraso de replay acima
+      de `atraso_maximo` segundos (ou inacessível) fica de fora até a próxima
+      verificação, feita a cada `intervalo_verificacao` segundos sob demanda.
+    - Uma réplica só atende depois de reproduzir `lsn_minimo`: a posição do WAL
+      após a última escrita deste processo ou o último aviso de alteração
+      recebido pelo OuvinteAlteracoes. O cache é compartilhado entre sessões,
+      então uma leitura feita logo após uma invalidação não pode repovoá-lo
+      com dados anteriores à alteração.
+    - Leituras `fixado=True` (sessão que acabou de gravar) e leituras sem
+      réplica elegível vão ao primário.
+    """
+
+    def __init__(
+        self,
+        primario: PoolConexoes,
+        replicas: dict = None,
+        atraso_maximo: float = 5.0,
+        intervalo_verificacao: float = 2.0,
+        janela_fixacao: float = 30.0,
+        metricas: "Metricas" = None,
+    ):
+        self.primario = primario
+        self.replicas = dict(replicas or {})  # nome -> PoolConexoes
+        self.atraso_maximo = atraso_maximo
+        self.intervalo_verificacao = intervalo_verificacao
+        self.janela_fixacao = janela_fixacao
+        self._metricas = metricas
+
+        self._lock = threading.Lock()
+        self._lsn_minimo = 0
+        self._rodizio = 0
+        self._estado = {
+            nome: {"atraso": None, "lsn": 0, "verificado_em": 0.0, "verificando": False, "erro": None}
+            for nome in self.replicas
+        }
+
+    def exigir_lsn(self, lsn):
+        """As próximas leituras em réplica precisam enxergar ao menos esta posição do WAL"""
+        valor = lsn_para_int(lsn)
+        with self._lock:
+            self._lsn_minimo = max(self._lsn_minimo, valor)
+
+    def registrar_escrita(self, conn):
+        """Chamar após o COMMIT de uma escrita, com a mesma conexão do primário"""
+        if not self.replicas:
+            return
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_current_wal_lsn()::text")
+            lsn = cursor.fetchone()[0]
+        conn.rollback()
+        self.exigir_lsn(lsn)
+
+    def _verificar(self, nome: str):
+        atraso, lsn, erro = None, 0, None
+        try:
+            with self.replicas[nome].conexao() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT
+                        CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+                             ELSE pg_current_wal_lsn() END::text,
+                        CASE WHEN NOT pg_is_in_recovery()
+                                  OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                             ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+                        END::float8
+                    """
+                )
+                texto_lsn, atraso = cursor.fetchone()
+                lsn = lsn_para_int(texto_lsn)
+                conn.rollback()
+        except Exception as e:
+            erro = str(e)
+
+        with self._lock:
+            estado = self._estado[nome]
+            estado.update(atraso=atraso, lsn=lsn, erro=erro, verificado_em=time.monotonic(), verificando=False)
+        if self._metricas is not None:
+            self._metricas.definir("portal_replica_atraso_segundos", {"replica": nome}, -1 if atraso is None else atraso)
+
+    def _elegivel(self, nome: str) -> bool:
+        agora = time.monotonic()
+        with self._lock:
+            estado = self._estado[nome]
+            idade = agora - estado["verificado_em"]
+            atrasada = estado["lsn"] < self._lsn_minimo
+            verificar = not estado["verificando"] and (
+                idade > self.intervalo_verificacao or (atrasada and idade > INTERVALO_REVERIFICACAO)
+            )
+            if verificar:
+                estado["verificando"] = True
+        if verificar:
+            self._verificar(nome)
+
+        with self._lock:
+            estado = self._estado[nome]
+            return (
+                estado["atraso"] is not None
+                and estado["atraso"] <= self.atraso_maximo
+                and estado["lsn"] >= self._lsn_minimo
+            )
+
+    def escolher(self, fixado: bool = False) -> tuple:
+        """(nome, pool) da próxima leitura e o motivo: replica, fixado, sem_replica ou atraso"""
+        if fixado:
+            return "primario", self.primario, "fixado"
+        if not self.replicas:
+            return "primario", self.primario, "sem_replica"
+
+        nomes = list(self.replicas)
+        with self._lock:
+            inicio = self._rodizio
+            self._rodizio = (self._rodizio + 1) % len(nomes)
+        for i in range(len(nomes)):
+            nome = nomes[(inicio + i) % len(nomes)]
+            if self._elegivel(nome):
+                return nome, self.replicas[nome], "replica"
+        return "primario", self.primario, "atraso"
+
+    @contextmanager
+    def conexao(self, fixado: bool = False):
+        """Context manager de leitura: conexão de uma réplica elegível ou do primário"""
+        nome, pool, motivo = self.escolher(fixado)
+        if self._metricas is not None:
+            self._metricas.incrementar("portal_leituras_total", {"destino": nome, "motivo": motivo})
+        with pool.conexao() as conn:
+            yield conn
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "lsn_minimo": self._lsn_minimo,
+                "replicas": {
+                    nome: {
+                        "atraso_s": e["atraso"],
+                        "lsn": e["lsn"],
+                        "erro": e["erro"],
+                        "pool": self.replicas[nome].estatisticas(),
+                    }
+                    for nome, e in self._estado.items()
+                },
+            }
+
+
+def _parametros_conexao(db, padrao=None) -> dict:
+    """Parâmetros do psycopg2 a partir de uma seção do secrets.toml (chaves ausentes vêm de `padrao`)"""
+    def valor(chave, parametro):
+        return db[chave] if padrao is None else db.get(chave, padrao.get(parametro))
+
+    padrao_opcionais = padrao or {}
+    return {
+        "host": valor("host", "host"),
+        "port": valor("port", "port"),
+        "dbname": valor("database", "dbname"),
+        "user": valor("user", "user"),
+        "password": valor("password", "password"),
+        "application_name": db.get(
+            "application_name", padrao_opcionais.get("application_name", "portal_gerente_medico")
+        ),
+        "connect_timeout": int(db.get("connect_timeout", padrao_opcionais.get("connect_timeout", 10))),
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def get_roteador_leitura() -> RoteadorLeitura:
+    """
+    Roteador único do processo. Sem a seção [postgres_leitura] no secrets.toml
+    todas as leituras vão ao primário ([postgres]). Chaves da seção:
+        hosts = ["replica1:5432", "replica2"]   # obrigatória
+        max_replication_lag (s, padrão 5), lag_check_interval (s, padrão 2),
+        read_your_writes_seconds (s, padrão 30: a sessão lê do primário
+        depois de gravar), pool_min_size, pool_max_size, pool_timeout,
+        pool_max_lifetime, pool_health_check_interval e, se diferentes do
+        primário, database, user, password, connect_timeout.
+    """
+    primario = get_pool()
+    try:
+        config = st.secrets.get("postgres_leitura")
+    except FileNotFoundError:  # inclui StreamlitSecretNotFoundError (sem secrets.toml)
+        config = None
+    if not config or not config.get("hosts"):
+        return RoteadorLeitura(primario, metricas=get_metricas())
+
+    replicas = {}
+    for endereco in config["hosts"]:
+        host, _, porta = str(endereco).partition(":")
+        parametros = _parametros_conexao(config, primario.parametros)
+        parametros.update(host=host, port=int(porta) if porta else primario.parametros["port"])
+        replicas[str(endereco)] = PoolConexoes(
+            parametros=parametros,
+            minimo=int(config.get("pool_min_size", 0)),
+            maximo=int(config.get("pool_max_size", primario.maximo)),
+            timeout=float(config.get("pool_timeout", primario.timeout)),
+            idade_maxima=float(config.get("pool_max_lifetime", primario.idade_maxima)),
+            intervalo_verificacao=float(config.get("pool_health_check_interval", primario.intervalo_verificacao)),
+        )
+    return RoteadorLeitura(
+        primario,
+        replicas,
+        atraso_maximo=float(config.get("max_replication_lag", 5)),
+        intervalo_verificacao=float(config.get("lag_check_interval", 2)),
+        janela_fixacao=float(config.get("read_your_writes_seconds", 30)),
+        metricas=get_metricas(),
+    )
+
+
+def _sessao_fixada_no_primario() -> bool:
+    try:
+        return st.session_state.get("ler_do_primario_ate", 0) > time.time()
+    except Exception:
+        return False  # fora de uma sessão (worker, scripts de manutenção)
+
+
+def get_connection(leitura: bool = False):
+    """
+    Retorna uma conexão do pool como context manager:
+
+        with get_connection() as conn:               # primário (escritas)
+            ...
+        with get_connection(leitura=True) as conn:   # réplica em dia ou primário
+            ...
+
+    A conexão volta para o pool ao sair do bloco (com rollback se houver
+    transação aberta) e é descartada se estiver quebrada. Leituras de uma
+    sessão que gravou há pouco (registrar_escrita) vão ao primário.
+    """
+    if not leitura:
+        return get_pool().conexao()
+    return get_roteador_leitura().conexao(fixado=_sessao_fixada_no_primario())
+
+
+def registrar_escrita(conn):
+    """
+    Chamar após o COMMIT de uma escrita do portal: fixa a sessão no primário
+    por read_your_writes_seconds e faz as réplicas só atenderem leituras
+    depois de reproduzirem essa escrita.
+    """
+    roteador = get_roteador_leitura()
+    if not roteador.replicas:
+        return
+    try:
+        roteador.registrar_escrita(conn)
+        st.session_state["ler_do_primario_ate"] = time.time() + roteador.janela_fixacao
+    except Exception as e:
+        # A escrita já foi confirmada; na pior hipótese a próxima leitura vem de uma réplica atrasada
+        print(f"Falha ao registrar escrita para o roteamento de leituras: {e}")
+
+
+# =========================
+# Consultas em Paralelo
+# =========================
+
+def executar_em_paralelo(tarefas: dict) -> dict:
+    """
+    Executa ao mesmo tempo as consultas independentes de uma tela:
+    {nome: (funcao, *args)} -> {nome: resultado}. Com o cache frio a tela
+    espera pela consulta mais lenta, não pela soma delas.
+
+    A primeira tarefa roda na thread da sessão e as demais em threads que
+    recebem o ScriptRunContext da sessão (st.session_state, st.secrets e a
+    fixação de leituras no primário funcionam nelas). As threads terminam com
+    a chamada. As tarefas só devem carregar dados: elementos de tela criados
+    fora da thread da sessão não aparecem. Se alguma tarefa falhar, a exceção
+    é propagada depois que todas terminarem.
+    """
+    itens = list(tarefas.items())
+    if len(itens) <= 1:
+        return {nome: funcao(*args) for nome, (funcao, *args) in itens}
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    contexto = {"initializer": add_script_run_ctx, "initargs": (None, ctx)} if ctx is not None else {}
+    with ThreadPoolExecutor(max_workers=len(itens) - 1, thread_name_prefix="consulta", **contexto) as executor:
+        futuros = {nome: executor.submit(funcao, *args) for nome, (funcao, *args) in itens[1:]}
+        nome, (funcao, *args) = itens[0]
+        resultados = {nome: funcao(*args)}
+        for nome, futuro in futuros.items():
+            resultados[nome] = futuro.result()
+    return {nome: resultados[nome] for nome in tarefas}
+
+
+# =========================
+# Leitura em Blocos (cursor server-side)
+# =========================
+
+TAMANHO_BLOCO = 2000
+
+
+def consultar_em_blocos(conn, query: str, params=None, tamanho_bloco: int = TAMANHO_BLOCO):
+    """
+    Executa a consulta em um cursor nomeado (server-side) e gera o resultado
+    em blocos de até `tamanho_bloco` linhas, como tuplas (colunas, linhas).
+    O servidor mantém o resultado; o cliente só guarda um bloco por vez.
+    O primeiro bloco é sempre gerado (mesmo vazio) para informar as colunas.
+    Precisa de uma transação aberta (conexões do pool não usam autocommit).
+    """
+    with conn.cursor(name=f"blocos_{uuid.uuid4().hex}") as cursor:
+        cursor.execute(query, params)
+        primeiro = True
+        while True:
+            linhas = cursor.fetchmany(tamanho_bloco)
+            if not linhas and not primeiro:
+                break
+            primeiro = False
+            yield [c.name for c in cursor.description], linhas
+            if len(linhas) < tamanho_bloco:
+                break
+
+
+def dataframe_em_blocos(conn, query: str, params=None, tamanho_bloco: int = TAMANHO_BLOCO,
+                        compactar=None) -> pd.DataFrame:
+    """
+    Monta um DataFrame convertendo cada bloco de consultar_em_blocos para
+    colunas assim que chega (sem a cópia intermediária de todas as linhas
+    como tuplas ou dicts). `compactar` (ex.: compactar_desvios) é aplicado a
+    cada bloco, e as categorias dos blocos são unidas no final.
+
+    Os blocos convertidos ficam guardados até a junção, então o pico de
+    memória é cerca de duas vezes o resultado (na forma compactada, se houver
+    `compactar`) mais um bloco de linhas cruas.
+    """
+    partes = []
+    for colunas, linhas in consultar_em_blocos(conn, query, params, tamanho_bloco):
+        parte = pd.DataFrame.from_records(linhas, columns=colunas)
+        del linhas
+        partes.append(compactar(parte) if compactar is not None else parte)
+
+    if len(partes) == 1:
+        return partes[0]
+    resultado = {}
+    for coluna in partes[0].columns:
+        if isinstance(partes[0][coluna].dtype, pd.CategoricalDtype):
+            resultado[coluna] = union_categoricals([p[coluna] for p in partes], ignore_order=True)
+        else:
+            resultado[coluna] = pd.concat([p[coluna] for p in partes], ignore_index=True)
+    del partes
+    return pd.DataFrame(resultado)
+
+
+# =========================
+# Envio de Email
+# =========================
+
+SQL_EMAILS_MONITORES = """
+    SELECT DISTINCT monitor_email
+    FROM estudo_monitores
+    WHERE estudo_id = %s AND monitor_email IS NOT NULL AND monitor_email != ''
+"""
+
+
+def buscar_emails_monitores_do_estudo(estudo_id: int, excluir_email: str = None):
+    """
+    Busca os emails dos monitores do estudo.
+    Opcionalmente exclui um email específico (ex: o gerente médico que fez a avaliação).
+    Retorna uma lista de emails únicos. Erros de banco são propagados: uma lista
+    vazia significa que o estudo realmente não tem monitores.
+    """
+    with get_connection(leitura=True) as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        # Busca apenas monitores do estudo
+        with medir_consulta("monitores"):
+            cursor.execute(SQL_EMAILS_MONITORES, (estudo_id,))
+            monitores = [row['monitor_email'].lower() for row in cursor.fetchall() if row['monitor_email']]
+
+    # Remove o email a ser excluído (se fornecido)
+    if excluir_email:
+        excluir_email_lower = excluir_email.lower()
+        monitores = [e for e in monitores if e != excluir_email_lower]
+
+    return monitores
+
 
 def enviar_email_avaliacao(
     estudo_id: int,
@@ -274,24 +1381,17 @@ def enviar_email_avaliacao(
     """
     Envia email notificando sobre a avaliação do gerente médico.
     Envia apenas para monitores do estudo (excluindo o gerente médico).
+
+    Chamado pelo worker_notificacoes.py a partir do outbox: erros de banco,
+    configuração ou SMTP são propagados para que a notificação seja
+    reenviada. Retorna a quantidade de destinatários.
     """
     try:
         # Buscar destinatários (apenas monitores, excluindo o gerente médico)
         destinatarios = buscar_emails_monitores_do_estudo(estudo_id, excluir_email=gerente_email)
         if not destinatarios:
             print("Nenhum destinatário encontrado para enviar email")
-            return True  # Não é erro, apenas não há destinatários
-
-        # Configurações de email
-        email_config = st.secrets.get("email", {})
-        smtp_server = email_config.get("smtp_server")
-        smtp_port = email_config.get("smtp_port", 587)
-        sender = email_config.get("sender")
-        password = email_config.get("password")
-
-        if not all([smtp_server, sender, password]):
-            print("Configurações de email incompletas no secrets.toml")
-            return False
+            return 0  # Não é erro, apenas não há destinatários
 
         # Formatar data/hora atual
         data_atual = datetime.now(timezone(timedelta(hours=-3))).strftime("%d/%m/%Y às %H:%M")
@@ -397,33 +1497,354 @@ def enviar_email_avaliacao(
         </html>
         """
 
-        # Enviar para cada destinatário
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender, password)
+        _enviar_email_html(destinatarios, assunto, html_body)
+
+        print(f"Email de avaliação GM enviado para {len(destinatarios)} destinatário(s)")
+        return len(destinatarios)
+
+    except Exception as e:
+        print(f"Erro ao enviar email: {e}")
+        raise
+
+
+def _enviar_email_html(destinatarios: list, assunto: str, html_body: str):
+    """Envia o mesmo email HTML a cada destinatário em uma única sessão SMTP (seção [email] do secrets.toml)"""
+    # Configurações de email
+    email_config = st.secrets.get("email", {})
+    smtp_server = email_config.get("smtp_server")
+    smtp_port = email_config.get("smtp_port", 587)
+    sender = email_config.get("sender")
+    password = email_config.get("password")
 
-            for destinatario in destinatarios:
-                msg = MIMEMultipart('alternative')
-                msg['Subject'] = assunto
-                msg['From'] = sender
-                msg['To'] = destinatario
+    if not all([smtp_server, sender, password]):
+        raise RuntimeError("Configurações de email incompletas no secrets.toml")
 
-                msg.attach(MIMEText(html_body, 'html'))
+    # Enviar para cada destinatário
+    with medir_smtp("sessao"), smtplib.SMTP(smtp_server, smtp_port) as server:
+        server.starttls()
+        server.login(sender, password)
 
+        for destinatario in destinatarios:
+            msg = MIMEMultipart('alternative')
+            msg['Subject'] = assunto
+            msg['From'] = sender
+            msg['To'] = destinatario
+
+            msg.attach(MIMEText(html_body, 'html'))
+
+            with medir_smtp("envio"):
                 server.sendmail(sender, destinatario, msg.as_string())
 
-        print(f"Email de avaliação GM enviado para {len(destinatarios)} destinatário(s)")
-        return True
 
-    except Exception as e:
-        print(f"Erro ao enviar email: {e}")
-        return False
+def enviar_email_avaliacoes_lote(
+    estudo_id: int,
+    estudo_codigo: str,
+    estudo_nome: str,
+    avaliacoes: list,
+    gerente_nome: str,
+    gerente_email: str
+):
+    """
+    Envia um único email aos monitores do estudo com todas as avaliações de
+    um lote (lista de {"numero_desvio", "avaliacao"}). Mesmo contrato de
+    enviar_email_avaliacao: erros são propagados e o retorno é a quantidade
+    de destinatários.
+    """
+    destinatarios = buscar_emails_monitores_do_estudo(estudo_id, excluir_email=gerente_email)
+    if not destinatarios:
+        print("Nenhum destinatário encontrado para enviar email")
+        return 0
+
+    assunto = f"[Avaliação GM] {estudo_codigo} - {len(avaliacoes)} desvio(s) avaliado(s)"
+    html_body = html_resumo_avaliacoes(estudo_codigo, estudo_nome, avaliacoes, gerente_nome)
+
+    _enviar_email_html(destinatarios, assunto, html_body)
+    print(f"Email de avaliações em lote enviado para {len(destinatarios)} destinatário(s)")
+    return len(destinatarios)
+
+
+def html_resumo_avaliacoes(estudo_codigo: str, estudo_nome: str, avaliacoes: list, gerente_nome: str = None) -> str:
+    """
+    Corpo HTML de um email com várias avaliações do mesmo estudo (lista de
+    {"numero_desvio", "avaliacao", "gerente_nome"}). Com `gerente_nome` o
+    avaliador aparece no cabeçalho; sem ele, em uma coluna por linha.
+    """
+    data_atual = datetime.now(timezone(timedelta(hours=-3))).strftime("%d/%m/%Y às %H:%M")
+
+    # Sem um gerente único (resumo de vários envios), cada linha mostra quem avaliou
+    estilo_th = "padding: 10px 12px; color: #666; font-size: 12px; text-transform: uppercase;"
+    estilo_td = "padding: 12px; border-bottom: 1px solid #eee; color: #333; font-size: 14px; vertical-align: top;"
+    coluna_gerente = gerente_nome is None
+    cabecalho_gerente = f'<th align="left" style="{estilo_th}">Avaliado por</th>' if coluna_gerente else ""
+    linha_gerente = (
+        ""
+        if coluna_gerente
+        else f'<p style="margin: 0 0 8px; color: #333; font-size: 14px;">🩺 Avaliado por: <strong>{html.escape(gerente_nome or "")}</strong></p>'
+    )
+
+    linhas = "".join(
+        f"""
+                                    <tr>
+                                        <td style="{estilo_td} color: #1976D2; font-size: 16px; font-weight: 700; white-space: nowrap;">{html.escape(str(a.get("numero_desvio", "")))}</td>
+                                        <td style="{estilo_td} line-height: 1.6; white-space: pre-wrap;">{html.escape(a.get("avaliacao") or "-")}</td>"""
+        + (f"""
+                                        <td style="{estilo_td}">{html.escape(a.get("gerente_nome") or "-")}</td>""" if coluna_gerente else "")
+        + """
+                                    </tr>"""
+        for a in avaliacoes
+    )
+
+    html_body = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+    </head>
+    <body style="margin: 0; padding: 0; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f5f5f5;">
+        <table width="100%" cellpadding="0" cellspacing="0" style="background-color: #f5f5f5; padding: 30px 0;">
+            <tr>
+                <td align="center">
+                    <table width="600" cellpadding="0" cellspacing="0" style="background-color: #ffffff; border-radius: 12px; box-shadow: 0 4px 20px rgba(0,0,0,0.1); overflow: hidden;">
+                        <tr>
+                            <td style="background: linear-gradient(135deg, #1976D2 0%, #1565C0 100%); padding: 30px 40px; text-align: center;">
+                                <h1 style="margin: 0; color: #ffffff; font-size: 24px; font-weight: 600;">
+                                    🩺 Avaliações do Gerente Médico
+                                </h1>
+                                <p style="margin: 10px 0 0; color: rgba(255,255,255,0.9); font-size: 14px;">
+                                    {html.escape(estudo_codigo or "")} - {html.escape(estudo_nome or "")}
+                                </p>
+                            </td>
+                        </tr>
+                        <tr>
+                            <td style="padding: 40px;">
+                                {linha_gerente}
+                                <p style="margin: 0 0 25px; color: #333; font-size: 14px;">📅 Data/Hora: <strong>{data_atual}</strong></p>
+                                <table width="100%" cellpadding="0" cellspacing="0" style="border-top: 2px solid #1976D2;">
+                                    <tr>
+                                        <th align="left" style="padding: 10px 12px; color: #666; font-size: 12px; text-transform: uppercase;">Desvio ID</th>
+                                        <th align="left" style="padding: 10px 12px; color: #666; font-size: 12px; text-transform: uppercase;">Avaliação</th>
+                                        {cabecalho_gerente}
+                                    </tr>{linhas}
+                                </table>
+                            </td>
+                        </tr>
+                        <tr>
+                            <td style="background-color: #f8f9fa; padding: 25px 40px; text-align: center; border-top: 1px solid #eee;">
+                                <p style="margin: 0; color: #999; font-size: 12px;">
+                                    Este é um email automático do sistema Portal Pesquisa Clínica.<br>
+                                    Por favor, não responda a este email.
+                                </p>
+                                <p style="margin: 15px 0 0; color: #1976D2; font-size: 11px; font-weight: 600;">
+                                    © {datetime.now().year} Synvia
+                                </p>
+                            </td>
+                        </tr>
+                    </table>
+                </td>
+            </tr>
+        </table>
+    </body>
+    </html>
+    """
+    return html_body
+
+
+def enviar_resumo_avaliacoes(estudo_id: int, estudo_codigo: str, estudo_nome: str, avaliacoes: list) -> dict:
+    """
+    Envia o resumo de várias avaliações de um estudo: cada monitor recebe uma
+    única mensagem com as avaliações que lhe seriam enviadas uma a uma (as
+    feitas pelo próprio destinatário ficam de fora, como no envio imediato).
+    Destinatários com o mesmo conteúdo compartilham a sessão SMTP.
+
+    Retorna {"mensagens": enviadas, "linha_base": mensagens que o envio por
+    avaliação teria gerado}. Erros são propagados.
+    """
+    destinatarios = buscar_emails_monitores_do_estudo(estudo_id)
+    if not destinatarios:
+        print("Nenhum destinatário encontrado para enviar email")
+        return {"mensagens": 0, "linha_base": 0}
+
+    # Agrupa os destinatários pelo conjunto de avaliações que cada um recebe
+    grupos = {}
+    for destinatario in destinatarios:
+        indices = tuple(
+            i for i, a in enumerate(avaliacoes)
+            if (a.get("gerente_email") or "").lower() != destinatario
+        )
+        if indices:
+            grupos.setdefault(indices, []).append(destinatario)
+
+    mensagens = linha_base = 0
+    for indices, grupo in grupos.items():
+        itens = [avaliacoes[i] for i in indices]
+        gerentes = {a.get("gerente_nome") for a in itens}
+        assunto = f"[Avaliação GM] {estudo_codigo} - resumo de {len(itens)} desvio(s) avaliado(s)"
+        html_body = html_resumo_avaliacoes(
+            estudo_codigo, estudo_nome, itens, gerentes.pop() if len(gerentes) == 1 else None
+        )
+        _enviar_email_html(grupo, assunto, html_body)
+        mensagens += len(grupo)
+        linha_base += len(grupo) * len(itens)
+
+    print(f"Resumo de {len(avaliacoes)} avaliação(ões) enviado em {mensagens} mensagem(ns)")
+    return {"mensagens": mensagens, "linha_base": linha_base}
+
+
+# =========================
+# Outbox de Notificações
+# =========================
+
+NOTIFICACAO_AVALIACAO = "avaliacao_gm"
+NOTIFICACAO_AVALIACAO_LOTE = "avaliacao_gm_lote"  # um email por estudo com todas as avaliações do lote
+
+# Avaliações de desvios com esta importância nunca esperam o resumo do worker
+IMPORTANCIAS_PRIORITARIAS = ("major", "maior")
+
+
+def importancia_prioritaria(importancia) -> bool:
+    return isinstance(importancia, str) and importancia.strip().lower() in IMPORTANCIAS_PRIORITARIAS
+
+
+def enfileirar_notificacao(cursor, tipo: str, estudo_id: int, desvio_id: int, payload: dict):
+    """
+    Grava uma notificação no outbox usando o cursor (e a transação) do chamador.
+    Se a transação for desfeita, a notificação também é; se for confirmada,
+    o worker_notificacoes.py garante o envio mesmo após quedas do processo.
+    """
+    with medir_consulta("outbox"):
+        cursor.execute(
+            """
+            INSERT INTO notificacoes_outbox (tipo, estudo_id, desvio_id, payload)
+            VALUES (%s, %s, %s, %s)
+            """,
+            (tipo, estudo_id, desvio_id, Json(payload)),
+        )
+
+
+# =========================
+# Diretório de Gerentes
+# =========================
+
+SQL_LOGIN_GERENTE = """
+    SELECT id, nome, email, patrocinador
+    FROM gerentes_medicos
+    WHERE LOWER(email) = LOWER(%s)
+"""
+
+SQL_DIRETORIO_GERENTES = """
+    SELECT id, nome, email, patrocinador
+    FROM gerentes_medicos
+"""
+
+INTERVALO_DIRETORIO = 10 * 60  # segundos entre recargas completas (os avisos cobrem o intervalo)
+CANAL_GERENTES = "gerentes_alterados"  # publicado pelos triggers de sql/005_notificacao_gerentes.sql
+
+
+def normalizar_email(email) -> str:
+    return (email or "").strip().lower()
+
+
+class DiretorioGerentes:
+    """
+    Cadastro de gerentes médicos em memória, indexado pelo email normalizado.
+    É carregado uma vez por processo e recarregado por inteiro a cada
+    INTERVALO_DIRETORIO; entre recargas, o OuvinteAlteracoes atualiza apenas
+    os gerentes avisados no canal CANAL_GERENTES.
+    """
+
+    def __init__(self, intervalo: float = INTERVALO_DIRETORIO):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._por_email = {}  # email normalizado -> gerente
+        self._por_id = {}     # id -> gerente
+        self._carregado_em = None
+
+    def _consultar(self, ids=None) -> list:
+        query = SQL_DIRETORIO_GERENTES + (" WHERE id = ANY(%s)" if ids is not None else "") + " ORDER BY id"
+        with get_connection(leitura=True) as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            with medir_consulta("diretorio_gerentes"):
+                cursor.execute(query, (list(ids),) if ids is not None else None)
+                return [dict(row) for row in cursor.fetchall()]
+
+    def _indexar(self, gerente: dict):
+        self._por_id[gerente["id"]] = gerente
+        email = normalizar_email(gerente["email"])
+        # Emails repetidos: vale o gerente de menor id, como na ordem da carga
+        if email and (email not in self._por_email or self._por_email[email]["id"] > gerente["id"]):
+            self._por_email[email] = gerente
+
+    def _remover(self, gerente_id: int):
+        gerente = self._por_id.pop(gerente_id, None)
+        if gerente is not None:
+            email = normalizar_email(gerente["email"])
+            if self._por_email.get(email) is gerente:
+                del self._por_email[email]
+                # Outro gerente com o mesmo email passa a responder por ele
+                for outro in sorted(self._por_id.values(), key=lambda g: g["id"]):
+                    if normalizar_email(outro["email"]) == email:
+                        self._por_email[email] = outro
+                        break
+
+    def recarregar(self):
+        """Carga completa (inicial, periódica ou após perda de avisos)"""
+        gerentes = self._consultar()
+        with self._lock:
+            self._por_email, self._por_id = {}, {}
+            for gerente in gerentes:
+                self._indexar(gerente)
+            self._carregado_em = time.monotonic()
+
+    def atualizar(self, ids):
+        """Recarrega apenas os gerentes informados (incluídos, alterados ou excluídos)"""
+        ids = set(ids)
+        gerentes = self._consultar(ids)
+        with self._lock:
+            for gerente_id in ids:
+                self._remover(gerente_id)
+            for gerente in gerentes:
+                self._indexar(gerente)
+
+    def _garantir_carga(self):
+        carregado_em = self._carregado_em
+        if carregado_em is None or time.monotonic() - carregado_em > self.intervalo:
+            self.recarregar()
+
+    def por_email(self, email: str):
+        """Gerente do email (sem diferenciar maiúsculas) ou None"""
+        self._garantir_carga()
+        email = normalizar_email(email)
+        with self._lock:
+            gerente = self._por_email.get(email)
+        if gerente is None and email:
+            # Cadastro recente cujo aviso ainda não chegou: confirma no primário
+            with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                with medir_consulta("login"):
+                    cursor.execute(SQL_LOGIN_GERENTE, (email,))
+                    gerente = cursor.fetchone()
+            if gerente is not None:
+                gerente = dict(gerente)
+                with self._lock:
+                    self._indexar(gerente)
+        return gerente
+
+    def por_id(self, gerente_id: int):
+        self._garantir_carga()
+        with self._lock:
+            return self._por_id.get(gerente_id)
+
+
+@st.cache_resource(show_spinner=False)
+def get_diretorio_gerentes() -> DiretorioGerentes:
+    """Diretório compartilhado por todas as sessões do processo"""
+    return DiretorioGerentes()
 
 
 # =========================
 # Autenticação do Gerente Médico
 # =========================
 
+
+@medir_tela("login_screen")
 def login_screen():
     """Tela de login - verifica email na tabela gerentes_medicos"""
     # Seletor de idioma na tela de login
@@ -455,133 +1876,332 @@ def login_screen():
 
         with st.spinner(t("Verificando credenciais...")):
             try:
-                conn = get_connection()
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                # Busca por e-mail no diretório de gerentes (case-insensitive)
+                gerente = get_diretorio_gerentes().por_email(email)
 
-                # Busca por e-mail na tabela gerentes_medicos (case-insensitive)
-                cursor.execute(
-                    """
-                    SELECT id, nome, email, patrocinador
-                    FROM gerentes_medicos
-                    WHERE LOWER(email) = LOWER(%s)
-                    """,
-                    (email.strip(),),
-                )
-                gerente = cursor.fetchone()
+            except Exception as e:
+                st.error(f"{t('Erro ao autenticar')}: {e}")
+                return
 
-                if not gerente:
-                    st.error(t("E-mail não cadastrado como Gerente Médico. Entre em contato com o administrador."))
-                    return
+        if not gerente:
+            st.error(t("E-mail não cadastrado como Gerente Médico. Entre em contato com o administrador."))
+            return
 
-                # Guarda informações na sessão
-                st.session_state["is_authenticated"] = True
-                st.session_state["gerente_id"] = gerente["id"]
-                st.session_state["gerente_nome"] = gerente["nome"]
-                st.session_state["gerente_email"] = gerente["email"]
-                st.session_state["gerente_patrocinador"] = gerente["patrocinador"]
+        # Guarda informações na sessão
+        st.session_state["is_authenticated"] = True
+        st.session_state["gerente_id"] = gerente["id"]
+        st.session_state["gerente_nome"] = gerente["nome"]
+        st.session_state["gerente_email"] = gerente["email"]
+        st.session_state["gerente_patrocinador"] = gerente["patrocinador"]
 
-                st.success(f"{t('Bem-vindo(a)')}, {gerente['nome']}!")
-                st.rerun()
+        st.success(f"{t('Bem-vindo(a)')}, {gerente['nome']}!")
+        st.rerun()
+
+
+# =========================
+# Versões do Cache
+# =========================
+
+class VersoesCache:
+    """
+    Carimbos de versão por estudo e por gerente, usados como parte da chave
+    das funções em cache (cache_com_metricas). Invalidar um escopo é só incrementar sua
+    versão: as próximas leituras caem em chaves novas e apenas as consultas
+    daquele estudo/gerente vão ao banco (as entradas antigas expiram pelo TTL).
+    """
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versoes = {}
+        self._epoca = 0  # soma-se a todas as versões; incrementada por invalidar_tudo()
+        self._estudos_por_gerente = {}  # gerente_id -> ids dos estudos exibidos para ele
+
+    def versao(self, escopo: str, chave) -> int:
+        # Versão e época só crescem, então a soma nunca repete uma chave já usada
+        with self._lock:
+            return self._epoca + self._versoes.get((escopo, chave), 0)
+
+    def _incrementar(self, escopo: str, chave):
+        self._versoes[(escopo, chave)] = self._versoes.get((escopo, chave), 0) + 1
+
+    def registrar_estudos_do_gerente(self, gerente_id: int, estudo_ids):
+        """Guarda quais estudos aparecem na lista do gerente (para invalidar suas contagens)"""
+        with self._lock:
+            self._estudos_por_gerente[gerente_id] = set(estudo_ids)
+
+    def invalidar_estudo(self, estudo_id: int):
+        """Invalida os desvios do estudo e a lista/métricas dos gerentes que o exibem"""
+        with self._lock:
+            self._incrementar("estudo", estudo_id)
+            for gerente_id, estudos in self._estudos_por_gerente.items():
+                if estudo_id in estudos:
+                    self._incrementar("gerente", gerente_id)
+
+    def invalidar_gerente(self, gerente_id: int):
+        with self._lock:
+            self._incrementar("gerente", gerente_id)
+
+    def invalidar_tudo(self):
+        """Invalida todos os escopos (ex.: avisos de alteração podem ter sido perdidos)"""
+        with self._lock:
+            self._epoca += 1
+
+
+@st.cache_resource(show_spinner=False)
+def get_versoes_cache() -> VersoesCache:
+    """Versões compartilhadas por todas as sessões do processo"""
+    return VersoesCache()
+
+
+def versao_estudo(estudo_id: int) -> int:
+    return get_versoes_cache().versao("estudo", estudo_id)
+
+
+def versao_gerente(gerente_id: int) -> int:
+    return get_versoes_cache().versao("gerente", gerente_id)
+
+
+def invalidar_estudo(estudo_id: int):
+    """Descarta do cache apenas as consultas afetadas por escrita no estudo"""
+    get_versoes_cache().invalidar_estudo(estudo_id)
+
+
+def invalidar_gerente(gerente_id: int):
+    get_versoes_cache().invalidar_gerente(gerente_id)
+
+
+# =========================
+# Invalidação entre Processos (LISTEN/NOTIFY)
+# =========================
+
+# Com o ouvinte ativo, escritas de qualquer processo (ou do portal interno)
+# invalidam o cache na hora; o TTL é só uma rede de segurança.
+TTL_CACHE = 60 * 60
+
+CANAL_ALTERACOES = "desvios_alterados"  # publicado pelos triggers de sql/003_notificacao_alteracoes.sql
+
+
+class OuvinteAlteracoes(threading.Thread):
+    """
+    Thread que escuta o canal NOTIFY de alterações em desvios/desvios_log e
+    invalida no cache local apenas o estudo recebido no payload. Com um
+    `diretorio`, escuta também CANAL_GERENTES e recarrega só o gerente avisado
+    (e a lista de estudos dele).
+
+    Com um `roteador` com réplicas, antes de invalidar exige das réplicas a
+    posição atual do WAL do primário: o aviso chega no COMMIT, e a leitura que
+    repovoa o cache não pode vir de uma réplica que ainda não reproduziu a
+    alteração.
+
+    Usa uma conexão própria (fora do pool) em autocommit. Se a conexão cair,
+    reconecta com backoff, invalida todos os estudos e recarrega o diretório,
+    pois os avisos enviados durante a queda se perderam.
+    """
+
+    def __init__(
+        self,
+        parametros: dict,
+        versoes: VersoesCache,
+        canal: str = CANAL_ALTERACOES,
+        diretorio: "DiretorioGerentes" = None,
+        canal_gerentes: str = CANAL_GERENTES,
+        roteador: RoteadorLeitura = None,
+    ):
+        super().__init__(name="ouvinte-alteracoes", daemon=True)
+        self._parametros = parametros
+        self._versoes = versoes
+        self._diretorio = diretorio
+        self._roteador = roteador
+        self.canal = canal
+        self.canal_gerentes = canal_gerentes
+        self.conectado = False
+        self.avisos_recebidos = 0
+        self.reconexoes = 0
+
+    def run(self):
+        espera = 1
+        perdeu_avisos = False
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._parametros)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.canal)))
+                    if self._diretorio is not None:
+                        cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.canal_gerentes)))
+
+                if perdeu_avisos:
+                    self._exigir_lsn_atual(conn)
+                    self._versoes.invalidar_tudo()
+                    if self._diretorio is not None:
+                        self._diretorio.recarregar()
+                    self.reconexoes += 1
+                self.conectado = True
+                espera = 1
+                self._escutar(conn)
             except Exception as e:
-                st.error(f"{t('Erro ao autenticar')}: {e}")
+                print(f"Ouvinte de alterações desconectado: {e}")
             finally:
+                self.conectado = False
+                perdeu_avisos = True
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            time.sleep(espera)
+            espera = min(espera * 2, 60)
+
+    def _exigir_lsn_atual(self, conn):
+        if self._roteador is not None and self._roteador.replicas:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_current_wal_lsn()::text")
+                self._roteador.exigir_lsn(cursor.fetchone()[0])
+
+    def _escutar(self, conn):
+        while True:
+            if select.select([conn], [], [], 30) == ([], [], []):
+                # Sem avisos: round trip curto para detectar conexão morta
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                continue
+
+            conn.poll()
+            estudos, gerentes = set(), set()
+            while conn.notifies:
+                aviso = conn.notifies.pop(0)
+                self.avisos_recebidos += 1
                 try:
-                    cursor.close()
-                    conn.close()
-                except Exception:
-                    pass
+                    ids = gerentes if aviso.channel == self.canal_gerentes else estudos
+                    ids.add(int(aviso.payload))
+                except ValueError:
+                    continue
+
+            if estudos or gerentes:
+                self._exigir_lsn_atual(conn)
+
+            for estudo_id in estudos:
+                self._versoes.invalidar_estudo(estudo_id)
+            if gerentes and self._diretorio is not None:
+                self._diretorio.atualizar(gerentes)
+                for gerente_id in gerentes:
+                    self._versoes.invalidar_gerente(gerente_id)
+
+
+@st.cache_resource(show_spinner=False)
+def iniciar_ouvinte_alteracoes() -> OuvinteAlteracoes:
+    """Inicia (uma vez por processo) a thread que escuta alterações de outros processos"""
+    ouvinte = OuvinteAlteracoes(
+        get_pool().parametros,
+        get_versoes_cache(),
+        diretorio=get_diretorio_gerentes(),
+        roteador=get_roteador_leitura(),
+    )
+    ouvinte.start()
+    return ouvinte
 
 
 # =========================
 # Seleção de Estudo
 # =========================
 
-@st.cache_data(ttl=300, show_spinner=False)
-def carregar_estudos_do_gerente(_email: str):
-    """Carrega lista de estudos ativos alocados ao gerente médico logado com contagem de pendências"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+SQL_ESTUDOS_DO_GERENTE = """
+    SELECT
+        e.id,
+        e.codigo,
+        e.nome,
+        COALESCE(SUM(c.total) FILTER (WHERE c.status != 'Avaliado'), 0)::int AS pendentes
+    FROM estudos e
+    INNER JOIN estudo_gerente_medico egm ON e.id = egm.estudo_id
+    LEFT JOIN desvios_contagem c ON c.estudo_id = e.id
+    WHERE egm.gerente_medico_id = %s
+      AND e.status = 'ativo'
+    GROUP BY e.id, e.codigo, e.nome
+    ORDER BY pendentes DESC, e.nome
+"""
+
+SQL_METRICAS_GERENTE = """
+    SELECT
+        COUNT(DISTINCT e.id) AS total_estudos,
+        COALESCE(SUM(c.total) FILTER (WHERE c.status != 'Avaliado'), 0)::int AS total_pendentes,
+        COUNT(DISTINCT e.id) FILTER (WHERE c.status != 'Avaliado' AND c.total > 0) AS estudos_com_pendencia
+    FROM estudos e
+    INNER JOIN estudo_gerente_medico egm ON e.id = egm.estudo_id
+    LEFT JOIN desvios_contagem c ON c.estudo_id = e.id
+    WHERE egm.gerente_medico_id = %s
+      AND e.status = 'ativo'
+"""
+
 
+@cache_com_metricas("carregar_estudos_do_gerente", ttl=TTL_CACHE, max_entries=1000, show_spinner=False)
+def carregar_estudos_do_gerente(gerente_id: int, versao: int = 0):
+    """
+    Carrega lista de estudos ativos alocados ao gerente médico logado com contagem de pendências.
+    O gerente vem pelo id (resolvido no DiretorioGerentes), sem join por email.
+    As pendências vêm de desvios_contagem (mantida por trigger), então o custo
+    não cresce com o histórico de desvios de cada estudo. `versao` faz parte
+    da chave do cache (ver VersoesCache). Erros de banco se propagam (e não
+    ficam no cache); a tela exibe a mensagem.
+    """
+    with get_connection(leitura=True) as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
         # Carrega estudos com contagem de desvios pendentes
-        cursor.execute(
-            """
-            SELECT
-                e.id,
-                e.codigo,
-                e.nome,
-                COUNT(CASE WHEN d.status != 'Avaliado' THEN 1 END) AS pendentes
-            FROM estudos e
-            INNER JOIN estudo_gerente_medico egm ON e.id = egm.estudo_id
-            INNER JOIN gerentes_medicos gm ON gm.id = egm.gerente_medico_id
-            LEFT JOIN desvios d ON d.estudo_id = e.id AND d.deleted_at IS NULL
-            WHERE LOWER(gm.email) = LOWER(%s)
-              AND e.status = 'ativo'
-            GROUP BY e.id, e.codigo, e.nome
-            ORDER BY pendentes DESC, e.nome
-            """,
-            (_email,),
-        )
-        estudos = cursor.fetchall()
-        return estudos
+        with medir_consulta("estudos"):
+            cursor.execute(SQL_ESTUDOS_DO_GERENTE, (gerente_id,))
+            return cursor.fetchall()
 
-    except Exception as e:
-        return []
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-        except Exception:
-            pass
 
+@cache_com_metricas("carregar_metricas_gerente", ttl=TTL_CACHE, max_entries=1000, show_spinner=False)
+def carregar_metricas_gerente(gerente_id: int, versao: int = 0):
+    """Carrega métricas gerais do gerente médico (a partir de desvios_contagem); erros se propagam"""
+    with get_connection(leitura=True) as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with medir_consulta("metricas"):
+            cursor.execute(SQL_METRICAS_GERENTE, (gerente_id,))
+            return cursor.fetchone()
 
-@st.cache_data(ttl=300, show_spinner=False)
-def carregar_metricas_gerente(_email: str):
-    """Carrega métricas gerais do gerente médico"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        cursor.execute(
-            """
-            SELECT
-                COUNT(DISTINCT e.id) AS total_estudos,
-                COUNT(CASE WHEN d.status != 'Avaliado' THEN 1 END) AS total_pendentes,
-                COUNT(DISTINCT CASE WHEN d.status != 'Avaliado' THEN e.id END) AS estudos_com_pendencia
-            FROM estudos e
-            INNER JOIN estudo_gerente_medico egm ON e.id = egm.estudo_id
-            INNER JOIN gerentes_medicos gm ON gm.id = egm.gerente_medico_id
-            LEFT JOIN desvios d ON d.estudo_id = e.id AND d.deleted_at IS NULL
-            WHERE LOWER(gm.email) = LOWER(%s)
-              AND e.status = 'ativo'
-            """,
-            (_email,),
-        )
-        metricas = cursor.fetchone()
-        return metricas
+ESTUDOS_POR_PAGINA = 12  # cards por página (4 linhas de 3)
+
+
+def _normalizar_busca(texto: str) -> str:
+    """Minúsculas e sem acentos, para a busca de estudos"""
+    texto = unicodedata.normalize("NFKD", str(texto or "")).casefold()
+    return "".join(c for c in texto if not unicodedata.combining(c))
 
-    except Exception as e:
-        return {"total_estudos": 0, "total_pendentes": 0, "estudos_com_pendencia": 0}
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-        except Exception:
-            pass
+
+def filtrar_estudos(estudos: list, busca: str = "", somente_pendentes: bool = False) -> list:
+    """Filtra a lista de estudos por código/nome e pendências (antes de criar qualquer widget)"""
+    termo = _normalizar_busca(busca).strip()
+    return [
+        e for e in estudos
+        if (not somente_pendentes or e["pendentes"] > 0)
+        and (not termo or termo in _normalizar_busca(f"{e['codigo']} {e['nome']}"))
+    ]
 
 
+@medir_tela("selecao_estudo_screen")
 def selecao_estudo_screen():
     """Tela de seleção de estudo com cards em grid e métricas"""
     st.title(f"📚 {t('Meus Estudos')}")
     st.caption(t("Selecione um estudo para avaliar os desvios"))
 
-    email = st.session_state["gerente_email"]
+    gerente_id = st.session_state["gerente_id"]
 
-    # Carregar dados (com cache e spinner)
+    # Carregar dados (com cache e spinner); as duas consultas são independentes
     with st.spinner(t("Carregando estudos...")):
-        estudos = carregar_estudos_do_gerente(email)
-        metricas = carregar_metricas_gerente(email)
+        versao = versao_gerente(gerente_id)
+        try:
+            dados = executar_em_paralelo({
+                "estudos": (carregar_estudos_do_gerente, gerente_id, versao),
+                "metricas": (carregar_metricas_gerente, gerente_id, versao),
+            })
+        except Exception as e:
+            st.error(f"{t('Erro ao carregar os estudos')}: {e}")
+            return
+        estudos, metricas = dados["estudos"], dados["metricas"]
+
+    get_versoes_cache().registrar_estudos_do_gerente(gerente_id, [e["id"] for e in estudos])
 
     if not estudos:
         st.warning(t("Você não está alocado em nenhum estudo ativo."))
@@ -613,17 +2233,47 @@ def selecao_estudo_screen():
             )
 
     st.markdown("")
-    st.markdown("")
-    st.markdown("")
 
-    # Grid de cards (3 colunas)
+    # Busca e filtro (aplicados na lista antes de montar os cards)
+    col_busca, col_pendentes = st.columns([3, 1])
+
+    with col_busca:
+        busca = st.text_input(
+            t("Buscar estudo por código ou nome"),
+            placeholder=t("Buscar estudo por código ou nome"),
+            label_visibility="collapsed",
+            key="busca_estudos",
+        )
+
+    with col_pendentes:
+        somente_pendentes = st.checkbox(t("Somente com pendências"), key="estudos_somente_pendentes")
+
+    filtrados = filtrar_estudos(estudos, busca, somente_pendentes)
+    if not filtrados:
+        st.info(t("Nenhum estudo encontrado com o filtro informado."))
+        return
+
+    # Página atual (volta à primeira ao mudar a busca ou o filtro)
+    total_paginas = -(-len(filtrados) // ESTUDOS_POR_PAGINA)
+    chave_grid = (busca, somente_pendentes)
+    pagina = st.session_state.get("pagina_estudos")
+    if not pagina or pagina["chave"] != chave_grid:
+        pagina = {"chave": chave_grid, "numero": 1}
+        st.session_state["pagina_estudos"] = pagina
+    pagina["numero"] = min(pagina["numero"], total_paginas)
+
+    inicio = (pagina["numero"] - 1) * ESTUDOS_POR_PAGINA
+    estudos_pagina = filtrados[inicio:inicio + ESTUDOS_POR_PAGINA]
+
+    st.caption(f"{len(filtrados)} {t('estudo(s)')}")
+
+    # Grid de cards (3 colunas), só com os estudos da página
     cols_per_row = 3
-    df = pd.DataFrame(estudos)
-    rows = [df.iloc[i:i + cols_per_row] for i in range(0, len(df), cols_per_row)]
+    rows = [estudos_pagina[i:i + cols_per_row] for i in range(0, len(estudos_pagina), cols_per_row)]
 
     for row_data in rows:
         cols = st.columns(cols_per_row)
-        for idx, (_, estudo) in enumerate(row_data.iterrows()):
+        for idx, estudo in enumerate(row_data):
             with cols[idx]:
                 with st.container(border=True):
                     pendentes = estudo['pendentes']
@@ -632,175 +2282,874 @@ def selecao_estudo_screen():
                     st.subheader(estudo['codigo'])
                     st.caption(estudo['nome'])
 
-                    # Indicador de status com emoji
-                    if pendentes > 0:
-                        st.write(f"🔴 {pendentes} {t('pendência(s)')}")
-                    else:
-                        st.write(f"🟢 {t('Sem pendências')}")
+                    # Indicador de status com emoji
+                    if pendentes > 0:
+                        st.write(f"🔴 {pendentes} {t('pendência(s)')}")
+                    else:
+                        st.write(f"🟢 {t('Sem pendências')}")
+
+                    if st.button(
+                        t("Acessar"),
+                        key=f"entrar_{estudo['id']}",
+                        use_container_width=True,
+                        type="primary" if pendentes > 0 else "secondary"
+                    ):
+                        st.session_state["estudo_id"] = estudo['id']
+                        st.session_state["estudo_codigo"] = estudo['codigo']
+                        st.session_state["estudo_nome"] = estudo['nome']
+                        st.rerun()
+
+    # Navegação entre páginas
+    if total_paginas > 1:
+        col_anterior, col_pagina, col_proxima = st.columns([1, 3, 1])
+
+        with col_anterior:
+            if st.button(f"◀ {t('Anterior')}", key="estudos_anterior", disabled=pagina["numero"] <= 1, use_container_width=True):
+                pagina["numero"] -= 1
+                st.rerun()
+
+        with col_pagina:
+            st.caption(f"{t('Página')} {pagina['numero']} {t('de')} {total_paginas}")
+
+        with col_proxima:
+            if st.button(f"{t('Próxima')} ▶", key="estudos_proxima", disabled=pagina["numero"] >= total_paginas, use_container_width=True):
+                pagina["numero"] += 1
+                st.rerun()
+
+
+# =========================
+# Lista de Desvios
+# =========================
+
+TAMANHOS_PAGINA = [25, 50, 100, 200, 0]  # 0 = todos os desvios do filtro em uma página
+TAMANHO_PAGINA_PADRAO = 50
+
+
+# Campos com versão em inglês (coluna <campo>_en). O valor no idioma ativo é
+# resolvido no SQL, então cada linha traz um só valor por campo e o idioma
+# faz parte da chave do cache.
+CAMPOS_TRADUZIDOS = (
+    "status",
+    "formulario_status",
+    "importancia",
+    "recorrencia",
+    "escopo",
+    "atendeu_prazos_report",
+    "formulario_arquivado",
+)
+
+
+def coluna_traduzida(campo: str, lang: str, alias: str = None) -> str:
+    """Expressão SELECT de um campo de CAMPOS_TRADUZIDOS no idioma `lang`, com fallback para o português"""
+    alias = alias or campo
+    if lang == "en":
+        return f"COALESCE(NULLIF({campo}_en, ''), {campo}) AS {alias}"
+    return campo if alias == campo else f"{campo} AS {alias}"
+
+
+SOBREPOSICAO_DELTA = timedelta(minutes=5)  # margem para transações que confirmaram depois da leitura anterior
+
+SQL_MARCA_DAGUA_DESVIOS = """
+    SELECT GREATEST(
+        (SELECT MAX(data_atualizacao) FROM desvios WHERE estudo_id = %(estudo_id)s),
+        (SELECT MAX(deleted_at) FROM desvios WHERE estudo_id = %(estudo_id)s AND deleted_at IS NOT NULL)
+    )
+"""
+
+SQL_CONTAGEM_DO_ESTUDO = """
+    SELECT status, total
+    FROM desvios_contagem
+    WHERE estudo_id = %s AND total > 0
+"""
+
+
+def montar_consulta_snapshot(estudo_id: int, lang: str = "pt", desde: datetime = None):
+    """
+    Monta a consulta (e os parâmetros) do snapshot da lista de desvios do
+    estudo: todos os desvios não excluídos, na ordem de exibição. Status
+    (status_exibicao) e importância vêm no idioma `lang`; `status` traz o
+    valor original, usado nos filtros e nas regras (ex.: avaliação em lote).
+
+    Com `desde`, é a consulta incremental: as linhas alteradas ou excluídas
+    (deleted_at) a partir daquele instante, com data_atualizacao e deleted_at.
+    Também usada por manutencao_banco.py para conferir os planos de execução.
+    """
+    # Colunas da tabela. A descrição vem com 61 caracteres: o suficiente
+    # para a tabela saber se deve truncar em 60.
+    query = f"""
+        SELECT
+            id,
+            numero_desvio_estudo,
+            status,
+            {coluna_traduzida("status", lang, "status_exibicao")},
+            participante,
+            centro,
+            visita,
+            {coluna_traduzida("importancia", lang)},
+            LEFT(descricao_desvio, 61) AS descricao_desvio,
+            xmin AS row_version
+    """
+    if desde is not None:
+        query += """,
+            data_atualizacao,
+            deleted_at
+        FROM desvios
+        WHERE estudo_id = %s
+          AND (data_atualizacao >= %s OR deleted_at >= %s)
+        """
+        return query, [estudo_id, desde, desde]
+
+    # Snapshot completo (exclui soft deleted)
+    query += """
+        FROM desvios
+        WHERE estudo_id = %s
+          AND deleted_at IS NULL
+        ORDER BY numero_desvio_estudo DESC, id DESC
+    """
+    return query, [estudo_id]
+
+
+def _ordenar_snapshot(desvios: pd.DataFrame) -> pd.DataFrame:
+    # Mesma ordem do ORDER BY (NULLs de numero_desvio_estudo primeiro, como no DESC do PostgreSQL)
+    return desvios.sort_values(
+        ["numero_desvio_estudo", "id"], ascending=False, na_position="first", ignore_index=True
+    )
+
+
+def _juntar_compactos(compacto: pd.DataFrame, linhas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Junta linhas novas ao snapshot compacto sem descompactá-lo: as categorias
+    de cada coluna ganham os valores novos e as colunas continuam categóricas.
+    """
+    if compacto.empty:
+        return linhas.reset_index(drop=True)
+    if linhas.empty:
+        return compacto
+    compacto, linhas = compacto.copy(deep=False), linhas.copy()
+    for coluna in compacto.columns:
+        if isinstance(compacto[coluna].dtype, pd.CategoricalDtype):
+            novos = pd.Index(linhas[coluna].dropna().unique()).difference(compacto[coluna].cat.categories)
+            if len(novos):
+                compacto[coluna] = compacto[coluna].cat.add_categories(novos)
+            linhas[coluna] = pd.Categorical(linhas[coluna], categories=compacto[coluna].cat.categories)
+    return pd.concat([compacto, linhas], ignore_index=True)
+
+
+def carregar_snapshot_completo(estudo_id: int, lang: str = "pt") -> dict:
+    """
+    Lê a lista inteira do estudo em blocos (cursor server-side), junto com a
+    marca d'água (maior data_atualizacao/deleted_at) lida antes dela.
+    Retorna {"desvios": DataFrame, "marca_dagua": datetime | None}.
+    """
+    query, params = montar_consulta_snapshot(estudo_id, lang)
+    with get_connection(leitura=True) as conn, medir_consulta("lista_desvios"):
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_MARCA_DAGUA_DESVIOS, {"estudo_id": estudo_id})
+            marca_dagua = cursor.fetchone()[0]
+        desvios = dataframe_em_blocos(conn, query, params, compactar=compactar_desvios)
+    return {"desvios": desvios, "marca_dagua": marca_dagua}
+
+
+def atualizar_snapshot(snapshot: dict, estudo_id: int, lang: str = "pt"):
+    """
+    Aplica ao snapshot só as linhas alteradas desde a marca d'água (menos
+    SOBREPOSICAO_DELTA): alteradas substituem a versão anterior, excluídas
+    saem. O custo depende do número de alterações, não do tamanho do estudo.
+
+    Exclusões físicas e desvios que mudaram de estudo não aparecem na consulta
+    incremental; por isso o resultado é conferido com desvios_contagem e, se
+    não bater, retorna None (o chamador recarrega o snapshot completo).
+    """
+    if snapshot["marca_dagua"] is None:
+        return None
+
+    query, params = montar_consulta_snapshot(estudo_id, lang, snapshot["marca_dagua"] - SOBREPOSICAO_DELTA)
+    with get_connection(leitura=True) as conn, conn.cursor() as cursor:
+        with medir_consulta("lista_desvios_delta"):
+            cursor.execute(query, params)
+            alteradas = pd.DataFrame.from_records(cursor.fetchall(), columns=[c.name for c in cursor.description])
+        with medir_consulta("contagem_desvios"):
+            cursor.execute(SQL_CONTAGEM_DO_ESTUDO, (estudo_id,))
+            contagem = dict(cursor.fetchall())
+
+    get_metricas().incrementar("portal_snapshot_linhas_delta_total", {}, len(alteradas))
+    desvios = snapshot["desvios"]
+    marca_dagua = snapshot["marca_dagua"]
+    if not alteradas.empty:
+        marcas = [alteradas["data_atualizacao"].max(), alteradas["deleted_at"].max()]
+        marca_dagua = max([marca_dagua] + [pd.Timestamp(m).to_pydatetime() for m in marcas if pd.notna(m)])
+        # A sobreposição relê linhas já conhecidas: só entra o que mudou de versão ou foi excluído
+        if not desvios.empty:
+            atuais = desvios.loc[desvios["id"].isin(alteradas["id"]), ["id", "row_version"]]
+            versoes = dict(zip(atuais["id"], atuais["row_version"].astype(str)))
+            novas = [
+                (i in versoes) if pd.notna(d) else versoes.get(i) != str(v)
+                for i, v, d in zip(alteradas["id"], alteradas["row_version"], alteradas["deleted_at"])
+            ]
+            alteradas = alteradas[novas]
+
+    if not alteradas.empty:
+        ativas = alteradas[alteradas["deleted_at"].isna()].drop(columns=["data_atualizacao", "deleted_at"])
+        mantidas = desvios[~desvios["id"].isin(alteradas["id"])] if not desvios.empty else desvios
+        desvios = _ordenar_snapshot(_juntar_compactos(mantidas, ativas))
+
+    status = desvios["status"].dropna().value_counts() if not desvios.empty else pd.Series(dtype=int)
+    if {k: int(v) for k, v in status.items() if v} != {k: int(v) for k, v in contagem.items()}:
+        return None
+    return {"desvios": desvios, "marca_dagua": marca_dagua}
+
+
+def carregar_snapshot_desvios(estudo_id: int, versao: int = 0, lang: str = "pt") -> pd.DataFrame:
+    """
+    A lista de desvios do estudo (colunas da tabela, já ordenadas), mantida
+    no CacheMemoria por (estudo, idioma). É a única consulta da lista:
+    filtros, páginas e contagens são derivados deste DataFrame em memória.
+
+    Quando a `versao` do estudo muda (escrita no portal, aviso NOTIFY ou o
+    botão Atualizar), o snapshot guardado é atualizado de forma incremental
+    (atualizar_snapshot); a leitura completa só acontece na primeira vez,
+    após expirar/ser despejado ou se a conferência incremental falhar. Erros
+    de banco se propagam: uma lista vazia significaria "nada pendente".
+    """
+    cache = get_cache_memoria()
+    chave = (estudo_id, lang)
+    encontrado, snapshot = cache.obter("carregar_snapshot_desvios", chave)
+    if encontrado and snapshot["versao"] == versao:
+        get_metricas().incrementar("portal_cache_acertos_total", {"funcao": "carregar_snapshot_desvios"})
+        return snapshot["desvios"].copy(deep=False)
+
+    get_metricas().incrementar("portal_cache_falhas_total", {"funcao": "carregar_snapshot_desvios"})
+    novo = None
+    if encontrado:
+        novo = atualizar_snapshot(snapshot, estudo_id, lang)
+        tipo = "delta" if novo is not None else "completa_apos_delta"
+    if novo is None:
+        if not encontrado:
+            tipo = "completa"
+        novo = carregar_snapshot_completo(estudo_id, lang)
+
+    get_metricas().incrementar("portal_snapshot_recargas_total", {"tipo": tipo})
+    novo["desvios"] = compactar_desvios(novo["desvios"])
+    novo["versao"] = versao
+    cache.guardar("carregar_snapshot_desvios", chave, novo, ttl=TTL_CACHE, max_entries=200)
+    return novo["desvios"].copy(deep=False)
+
+
+def filtrar_desvios(desvios: pd.DataFrame, filtro_status: str = "Pendentes") -> pd.DataFrame:
+    """Visão do snapshot para um filtro de status (Pendentes, Todos ou um status específico)"""
+    if desvios.empty or filtro_status == "Todos":
+        return desvios
+    if filtro_status == "Pendentes":
+        return desvios[desvios["status"] != "Avaliado"]
+    return desvios[desvios["status"] == filtro_status]
+
+
+# Posição de um numero_desvio_estudo NULL na paginação: acima de qualquer
+# número (int4), como no ORDER BY ... DESC do PostgreSQL e em _ordenar_snapshot
+NUMERO_SEM_VALOR = 2 ** 31
+
+
+def cursor_pagina(linha) -> tuple:
+    """Cursor (numero_desvio_estudo, id) de uma linha da lista, para carregar_pagina_desvios"""
+    numero = linha["numero_desvio_estudo"]
+    return (NUMERO_SEM_VALOR if pd.isna(numero) else int(numero), int(linha["id"]))
+
+
+def carregar_pagina_desvios(
+    estudo_id: int,
+    filtro_status: str = "Pendentes",
+    tamanho: int = TAMANHO_PAGINA_PADRAO,
+    cursor: tuple = None,
+    direcao: str = "proxima",
+    versao: int = 0,
+    lang: str = "pt",
+):
+    """
+    Uma página da lista de desvios do estudo, ordenada por
+    numero_desvio_estudo DESC, recortada do snapshot em cache: trocar de
+    filtro ou de página não vai ao banco. Traz só as colunas exibidas na
+    tabela; o registro completo é buscado por carregar_detalhe_desvio.
+
+    `cursor` é o (numero_desvio_estudo, id) da borda da página atual (ver
+    cursor_pagina): direcao "proxima" traz as linhas depois dele e
+    "anterior" as de antes.
+    Com `tamanho` 0 traz todos os desvios do filtro.
+
+    Retorna {"desvios": DataFrame, "tem_anterior": bool, "tem_proxima": bool}.
+    """
+    desvios = filtrar_desvios(carregar_snapshot_desvios(estudo_id, versao, lang), filtro_status)
+
+    if not tamanho or desvios.empty:
+        return {"desvios": desvios.reset_index(drop=True), "tem_anterior": False, "tem_proxima": False}
+
+    if cursor is not None:
+        numero, desvio_id = cursor
+        numeros, ids = desvios["numero_desvio_estudo"].fillna(NUMERO_SEM_VALOR), desvios["id"]
+        if direcao == "proxima":
+            desvios = desvios[(numeros < numero) | ((numeros == numero) & (ids < desvio_id))]
+        else:
+            desvios = desvios[(numeros > numero) | ((numeros == numero) & (ids > desvio_id))]
+
+    mais = len(desvios) > tamanho
+    if direcao == "anterior":
+        desvios = desvios.iloc[-tamanho:].reset_index(drop=True)
+        return {"desvios": desvios, "tem_anterior": mais, "tem_proxima": True}
+    desvios = desvios.iloc[:tamanho].reset_index(drop=True)
+    return {"desvios": desvios, "tem_anterior": cursor is not None, "tem_proxima": mais}
+
+
+def contar_desvios(estudo_id: int, filtro_status: str = "Pendentes", versao: int = 0, lang: str = "pt") -> int:
+    """Total exato de desvios do filtro, contado no snapshot em cache"""
+    return len(filtrar_desvios(carregar_snapshot_desvios(estudo_id, versao, lang), filtro_status))
+
+
+# Busca textual (sql/009 e 010): vetores em português e inglês dos campos narrativos
+LIMITE_BUSCA = 50
+LIMITE_CANDIDATOS = 1000  # termos muito comuns: ranqueia só os desvios mais recentes que os contêm
+MARCA_INICIO, MARCA_FIM = "\x01", "\x02"  # trechos encontrados; trocados por <mark> depois do html.escape
+CAMPOS_BUSCA = ("descricao_desvio", "motivo", "causa_raiz", "acao_corretiva", "acao_preventiva", "observacao")
+
+
+def montar_consulta_busca(estudo_id: int, termo: str, lang: str = "pt", limite: int = LIMITE_BUSCA):
+    """
+    Monta a consulta (e os parâmetros) da busca textual nos desvios do estudo.
+    `termo` aceita a sintaxe de buscador (websearch_to_tsquery): aspas para
+    frases, OR e -palavra. Os dois vetores são consultados (os índices GIN se
+    combinam em BitmapOr) e a relevância é a maior das duas.
+
+    O custo fica limitado em termos muito comuns: só os LIMITE_CANDIDATOS
+    desvios mais recentes que contêm o termo são ranqueados, e o destaque
+    (ts_headline) só é calculado para os `limite` mais relevantes. A coluna
+    `candidatos` informa quantos foram ranqueados.
+    """
+    textos = ", ".join(CAMPOS_BUSCA)
+    query = f"""
+        WITH candidatos AS (
+            SELECT
+                id,
+                numero_desvio_estudo,
+                status,
+                {coluna_traduzida("status", lang, "status_exibicao")},
+                participante,
+                visita,
+                {textos},
+                busca_pt,
+                busca_en
+            FROM desvios
+            WHERE estudo_id = %(estudo_id)s
+              AND deleted_at IS NULL
+              AND (busca_pt @@ websearch_to_tsquery('portuguese', %(termo)s)
+                   OR busca_en @@ websearch_to_tsquery('english', %(termo)s))
+            ORDER BY numero_desvio_estudo DESC, id DESC
+            LIMIT %(candidatos)s
+        ),
+        ranqueados AS (
+            SELECT
+                *,
+                ts_rank_cd(busca_pt, websearch_to_tsquery('portuguese', %(termo)s)) AS relevancia_pt,
+                ts_rank_cd(busca_en, websearch_to_tsquery('english', %(termo)s)) AS relevancia_en
+            FROM candidatos
+        ),
+        encontrados AS (
+            SELECT *, GREATEST(relevancia_pt, relevancia_en) AS relevancia
+            FROM ranqueados
+            ORDER BY relevancia DESC, numero_desvio_estudo DESC, id DESC
+            LIMIT %(limite)s
+        )
+        SELECT
+            id,
+            numero_desvio_estudo,
+            status,
+            status_exibicao,
+            participante,
+            visita,
+            relevancia,
+            CASE WHEN relevancia_en > relevancia_pt
+                THEN ts_headline('english', concat_ws(' … ', {textos}),
+                                 websearch_to_tsquery('english', %(termo)s), %(opcoes)s)
+                ELSE ts_headline('portuguese', concat_ws(' … ', {textos}),
+                                 websearch_to_tsquery('portuguese', %(termo)s), %(opcoes)s)
+            END AS trecho,
+            (SELECT COUNT(*) FROM candidatos) AS candidatos
+        FROM encontrados
+        ORDER BY relevancia DESC, numero_desvio_estudo DESC, id DESC
+    """
+    params = {
+        "estudo_id": estudo_id,
+        "termo": termo,
+        "limite": limite,
+        "candidatos": LIMITE_CANDIDATOS,
+        "opcoes": (
+            f'StartSel="{MARCA_INICIO}", StopSel="{MARCA_FIM}", '
+            'MaxFragments=2, MinWords=6, MaxWords=20, FragmentDelimiter=" … "'
+        ),
+    }
+    return query, params
+
 
-                    if st.button(
-                        t("Acessar"),
-                        key=f"entrar_{estudo['id']}",
-                        use_container_width=True,
-                        type="primary" if pendentes > 0 else "secondary"
-                    ):
-                        st.session_state["estudo_id"] = estudo['id']
-                        st.session_state["estudo_codigo"] = estudo['codigo']
-                        st.session_state["estudo_nome"] = estudo['nome']
-                        st.rerun()
+@cache_com_metricas("buscar_desvios", ttl=TTL_CACHE, max_entries=200, show_spinner=False)
+def buscar_desvios(estudo_id: int, termo: str, versao: int = 0, lang: str = "pt") -> pd.DataFrame:
+    """
+    Desvios do estudo que contêm `termo` nos campos narrativos, do mais ao
+    menos relevante (até LIMITE_BUSCA), com o trecho encontrado destacado
+    entre MARCA_INICIO e MARCA_FIM. Erros de banco são propagados.
+    """
+    query, params = montar_consulta_busca(estudo_id, termo, lang)
+    with get_connection(leitura=True) as conn, conn.cursor() as cursor:
+        with medir_consulta("busca_desvios"):
+            cursor.execute(query, params)
+            return pd.DataFrame.from_records(cursor.fetchall(), columns=[c.name for c in cursor.description])
+
+
+def html_trecho_busca(trecho: str) -> str:
+    """Trecho do ts_headline em HTML seguro, com os termos encontrados em <mark>"""
+    return html.escape(trecho or "").replace(MARCA_INICIO, "<mark>").replace(MARCA_FIM, "</mark>")
+
+
+# Colunas do detalhe sem tradução (as de CAMPOS_TRADUZIDOS são adicionadas no idioma da sessão)
+COLUNAS_DETALHE = (
+    "id",
+    "estudo_id",
+    "numero_desvio_estudo",
+    "status",
+    "identificacao_desvio",
+    "centro",
+    "data_ocorrido",
+    "participante",
+    "visita",
+    "data_identificacao_texto",
+    "categoria",
+    "subcategoria",
+    "codigo",
+    "num_ocorrencia_previa",
+    "prazo_escalonamento",
+    "data_escalonamento",
+    "descricao_desvio",
+    "motivo",
+    "causa_raiz",
+    "acao_corretiva",
+    "acao_preventiva",
+    "avaliacao_investigador",
+    "data_submissao_cep",
+    "data_finalizacao",
+    "observacao",
+    "avaliacao_gerente_medico",
+    "data_atualizacao",
+)
+
+
+@cache_com_metricas("carregar_detalhe_desvio", ttl=TTL_CACHE, max_entries=200, show_spinner=False,
+                    compactar=compactar_registro, expandir=expandir_registro)
+def carregar_detalhe_desvio(desvio_id: int, row_version: str, lang: str = "pt"):
+    """
+    Carrega todos os campos de um desvio. A chave do cache é (id, xmin, idioma),
+    então uma nova versão da linha nunca reaproveita o detalhe da versão anterior.
+    Os campos de CAMPOS_TRADUZIDOS vêm já no idioma `lang`; `status` continua
+    com o valor original (usado nas regras) e status_exibicao com o traduzido.
+    Retorna None se o desvio não existir mais (ou tiver sido excluído); erros
+    de banco se propagam, para uma falha não ficar no cache como "excluído".
+    """
+    colunas = ", ".join(
+        list(COLUNAS_DETALHE)
+        + [coluna_traduzida("status", lang, "status_exibicao")]
+        + [coluna_traduzida(campo, lang) for campo in CAMPOS_TRADUZIDOS if campo != "status"]
+    )
+    with get_connection(leitura=True) as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with medir_consulta("detalhe_desvio"):
+            cursor.execute(
+                f"""
+                SELECT
+                    {colunas},
+                    xmin AS row_version
+                FROM desvios
+                WHERE id = %s
+                  AND deleted_at IS NULL
+                """,
+                (desvio_id,),
+            )
+            return cursor.fetchone()
 
 
 # =========================
-# Lista de Desvios
+# Exportação do Estudo
 # =========================
 
-@st.cache_data(ttl=300, show_spinner=False)
-def carregar_desvios_do_estudo(estudo_id: int, filtro_status: str = "Pendentes"):
-    """Carrega desvios do estudo selecionado"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+TAMANHO_BLOCO_EXPORTACAO = 10_000  # linhas por bloco do cursor server-side (Parquet)
+FORMATOS_EXPORTACAO = ("csv", "parquet")
+
+# Tipos do PostgreSQL (oid) -> tipo da coluna Parquet; os demais viram texto
+TIPOS_PARQUET = {
+    16: "bool",
+    20: "int64",
+    21: "int64",
+    23: "int64",
+    700: "float64",
+    701: "float64",
+    1082: "date32",
+    1114: "timestamp",
+    1184: "timestamptz",
+}
 
-        # Query base - todos os campos do formulário (exclui soft deleted)
-        query = """
-            SELECT
-                *,
-                xmin AS row_version
+
+def parquet_disponivel() -> bool:
+    """A exportação Parquet usa o pyarrow (requirements.txt); instalações antigas sem ele ficam só com CSV"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def montar_consultas_exportacao(estudo_id: int, lang: str = "pt") -> dict:
+    """
+    Consultas da exportação do estudo: {nome do arquivo: (query, params)}.
+    - desvios: todos os campos dos desvios não excluídos, com os campos de
+      CAMPOS_TRADUZIDOS (inclusive status) no idioma `lang`;
+    - historico: as alterações de desvios_log do estudo em ordem cronológica
+      (meses arquivados com 'manutencao_banco.py log arquivar' não entram).
+    """
+    colunas = ", ".join(
+        [coluna for coluna in COLUNAS_DETALHE if coluna != "status"]
+        + [coluna_traduzida(campo, lang) for campo in CAMPOS_TRADUZIDOS]
+        + ["atualizado_por"]
+    )
+    return {
+        "desvios": (
+            f"""
+            SELECT {colunas}
             FROM desvios
             WHERE estudo_id = %s
               AND deleted_at IS NULL
-        """
-
-        params = [estudo_id]
-
-        # Aplicar filtro de status
-        if filtro_status == "Pendentes":
-            query += " AND status != 'Avaliado'"
-        elif filtro_status != "Todos":
-            query += " AND status = %s"
-            params.append(filtro_status)
+            ORDER BY numero_desvio_estudo, id
+            """,
+            (estudo_id,),
+        ),
+        "historico": (
+            """
+            SELECT
+                l.id,
+                l.desvio_id,
+                d.numero_desvio_estudo,
+                l.usuario,
+                l.campo,
+                l.valor_antigo,
+                l.valor_novo,
+                l.data_alteracao
+            FROM desvios_log l
+            LEFT JOIN desvios d ON d.id = l.desvio_id
+            WHERE l.estudo_id = %s
+            ORDER BY l.data_alteracao, l.id
+            """,
+            (estudo_id,),
+        ),
+    }
 
-        query += " ORDER BY numero_desvio_estudo DESC"
 
-        cursor.execute(query, params)
-        desvios = cursor.fetchall()
-        return desvios
+def _exportar_csv(conn, query: str, params, arquivo) -> int:
+    """COPY ... TO STDOUT direto para `arquivo`: o servidor envia em pedaços e nada é acumulado"""
+    with conn.cursor() as cursor:
+        consulta = cursor.mogrify(query, params).decode(extensions.encodings[conn.encoding])
+        cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER)", arquivo)
+        return cursor.rowcount
 
-    except Exception:
-        return []
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-        except Exception:
-            pass
 
+def _exportar_parquet(conn, query: str, params, arquivo, tamanho_bloco: int) -> int:
+    """Cursor server-side -> um row group Parquet por bloco de `tamanho_bloco` linhas"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
 
-def limpar_cache():
-    """Limpa o cache de todas as consultas"""
-    carregar_estudos_do_gerente.clear()
-    carregar_metricas_gerente.clear()
-    carregar_desvios_do_estudo.clear()
+    tipos = {
+        "bool": pa.bool_(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "date32": pa.date32(),
+        "timestamp": pa.timestamp("us"),
+        "timestamptz": pa.timestamp("us", tz="UTC"),
+    }
+    total = 0
+    escritor = None
+    with conn.cursor(name=f"exportacao_{uuid.uuid4().hex}") as cursor:
+        cursor.execute(query, params)
+        while True:
+            linhas = cursor.fetchmany(tamanho_bloco)
+            if escritor is None:
+                esquema = pa.schema([
+                    (c.name, tipos.get(TIPOS_PARQUET.get(c.type_code), pa.string()))
+                    for c in cursor.description
+                ])
+                escritor = pq.ParquetWriter(arquivo, esquema, compression="zstd")
+            if linhas:
+                colunas = []
+                for i, campo in enumerate(esquema):
+                    valores = [linha[i] for linha in linhas]
+                    if campo.type == pa.string():
+                        valores = [None if v is None else str(v) for v in valores]
+                    colunas.append(pa.array(valores, type=campo.type))
+                escritor.write_table(pa.Table.from_arrays(colunas, schema=esquema))
+                total += len(linhas)
+            if len(linhas) < tamanho_bloco:
+                break
+    escritor.close()
+    return total
+
+
+def exportar_estudo(destino, estudo_id: int, formato: str = "csv", lang: str = "pt",
+                    tamanho_bloco: int = TAMANHO_BLOCO_EXPORTACAO) -> dict:
+    """
+    Grava em `destino` (caminho ou arquivo binário) um ZIP com desvios.<formato>
+    e historico.<formato> do estudo. As linhas vão do banco para o arquivo em
+    fluxo (COPY no CSV, cursor server-side em blocos no Parquet), então a
+    memória não cresce com o tamanho do estudo (o download pela tela mantém o
+    ZIP pronto em memória: ver gerar_exportacao_estudo). As duas consultas usam a mesma
+    transação somente leitura (REPEATABLE READ), que não bloqueia as escritas
+    do portal. Retorna {nome do arquivo: linhas}.
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato de exportação inválido: {formato}")
+    if formato == "parquet" and not parquet_disponivel():
+        raise RuntimeError("A exportação Parquet requer o pacote pyarrow")
+
+    linhas = {}
+    with zipfile.ZipFile(destino, "w", allowZip64=True) as pacote, get_connection(leitura=True) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        for nome, (query, params) in montar_consultas_exportacao(estudo_id, lang).items():
+            entrada = zipfile.ZipInfo(f"{nome}.{formato}", date_time=time.localtime()[:6])
+            # Parquet já vem comprimido (zstd); o CSV é comprimido no ZIP
+            entrada.compress_type = zipfile.ZIP_DEFLATED if formato == "csv" else zipfile.ZIP_STORED
+            with medir_consulta(f"exportacao_{nome}"), pacote.open(entrada, "w", force_zip64=True) as arquivo:
+                if formato == "csv":
+                    linhas[nome] = _exportar_csv(conn, query, params, arquivo)
+                else:
+                    linhas[nome] = _exportar_parquet(conn, query, params, arquivo, tamanho_bloco)
+        conn.rollback()
+    return linhas
+
+
+def gerar_exportacao_estudo(estudo_id: int, formato: str, lang: str) -> bytes:
+    """
+    Conteúdo do botão de download: chamado pelo Streamlit só no clique, em uma
+    thread separada (não trava a tela). O ZIP é montado em arquivo temporário
+    em disco (apagado ao fechar), mas o Streamlit serve o download a partir de
+    bytes: o ZIP inteiro fica uma vez na memória do servidor. Para estudos
+    grandes, usar 'python manutencao_banco.py exportar', que grava direto no
+    arquivo de saída.
+    """
+    with tempfile.TemporaryFile() as arquivo:
+        exportar_estudo(arquivo, estudo_id, formato, lang)
+        arquivo.seek(0)
+        return arquivo.read()
 
 
 def salvar_avaliacao(desvio: dict, estudo_id: int, avaliacao: str, row_version, valor_antigo: str, status_antigo: str):
     """
     Salva a avaliação do gerente médico e atualiza o status para 'Avaliado'.
-    Registra as alterações no log e envia email de notificação.
+    Registra as alterações no log e enfileira a notificação por email no
+    outbox, tudo na mesma transação. O envio é feito pelo worker_notificacoes.py.
     """
     gerente_nome = st.session_state["gerente_nome"]
     desvio_id = desvio["id"]
 
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # 1. Atualizar o desvio com controle de concorrência (xmin)
-        cursor.execute(
-            """
-            UPDATE desvios
-            SET
-                avaliacao_gerente_medico = %s,
-                status = 'Avaliado',
-                atualizado_por = %s,
-                data_atualizacao = NOW()
-            WHERE id = %s
-              AND xmin = %s::xid
-            """,
-            (avaliacao, gerente_nome, desvio_id, row_version),
-        )
+        with get_connection() as conn, conn.cursor() as cursor:
+            # 1. Atualizar o desvio com controle de concorrência (xmin)
+            with medir_consulta("salvar"):
+                cursor.execute(
+                    """
+                    UPDATE desvios
+                    SET
+                        avaliacao_gerente_medico = %s,
+                        status = 'Avaliado',
+                        atualizado_por = %s,
+                        data_atualizacao = NOW()
+                    WHERE id = %s
+                      AND xmin = %s::xid
+                    RETURNING importancia
+                    """,
+                    (avaliacao, gerente_nome, desvio_id, row_version),
+                )
 
-        if cursor.rowcount == 0:
-            conn.rollback()
-            return False, "conflito"
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return False, "conflito"
+            importancia = cursor.fetchone()[0]
 
-        # 2. Registrar no log - alteração da avaliação
-        cursor.execute(
-            """
-            INSERT INTO desvios_log (desvio_id, estudo_id, usuario, campo, valor_antigo, valor_novo, data_alteracao)
-            VALUES (%s, %s, %s, 'avaliacao_gerente_medico', %s, %s, NOW())
-            """,
-            (desvio_id, estudo_id, gerente_nome, valor_antigo or '', avaliacao),
-        )
+            # 2. Registrar no log - alteração da avaliação
+            with medir_consulta("log_insert"):
+                cursor.execute(
+                    """
+                    INSERT INTO desvios_log (desvio_id, estudo_id, usuario, campo, valor_antigo, valor_novo, data_alteracao)
+                    VALUES (%s, %s, %s, 'avaliacao_gerente_medico', %s, %s, NOW())
+                    """,
+                    (desvio_id, estudo_id, gerente_nome, valor_antigo or '', avaliacao),
+                )
 
-        # 3. Registrar no log - alteração do status (se mudou)
-        if status_antigo != 'Avaliado':
-            cursor.execute(
-                """
-                INSERT INTO desvios_log (desvio_id, estudo_id, usuario, campo, valor_antigo, valor_novo, data_alteracao)
-                VALUES (%s, %s, %s, 'status', %s, 'Avaliado', NOW())
-                """,
-                (desvio_id, estudo_id, gerente_nome, status_antigo),
+            # 3. Registrar no log - alteração do status (se mudou)
+            if status_antigo != 'Avaliado':
+                with medir_consulta("log_insert"):
+                    cursor.execute(
+                        """
+                        INSERT INTO desvios_log (desvio_id, estudo_id, usuario, campo, valor_antigo, valor_novo, data_alteracao)
+                        VALUES (%s, %s, %s, 'status', %s, 'Avaliado', NOW())
+                        """,
+                        (desvio_id, estudo_id, gerente_nome, status_antigo),
+                    )
+
+            # 4. Enfileirar notificação aos monitores (enviada pelo worker)
+            enfileirar_notificacao(
+                cursor,
+                tipo=NOTIFICACAO_AVALIACAO,
+                estudo_id=estudo_id,
+                desvio_id=desvio_id,
+                payload={
+                    "estudo_id": estudo_id,
+                    "estudo_codigo": st.session_state.get("estudo_codigo", ""),
+                    "estudo_nome": st.session_state.get("estudo_nome", ""),
+                    "numero_desvio": desvio.get("numero_desvio_estudo", 0),
+                    "avaliacao": avaliacao,
+                    "importancia": importancia,
+                    "prioritaria": importancia_prioritaria(importancia),
+                    "gerente_nome": gerente_nome,
+                    "gerente_email": st.session_state.get("gerente_email", ""),
+                },
             )
 
-        conn.commit()
+            conn.commit()
+            registrar_escrita(conn)
 
-        # Limpar cache após salvar com sucesso
-        limpar_cache()
+    except Exception as e:
+        return False, str(e)
 
-        # 4. Enviar email de notificação (em background, não bloqueia)
-        try:
-            enviar_email_avaliacao(
+    # Invalida só o cache do estudo (desvios e contagens dos gerentes que o exibem)
+    invalidar_estudo(estudo_id)
+
+    return True, "sucesso"
+
+
+def salvar_avaliacoes_em_lote(itens: list, estudo_id: int) -> dict:
+    """
+    Salva várias avaliações do mesmo estudo em uma única transação.
+    `itens`: lista de {"id", "row_version", "avaliacao"}.
+
+    Cada desvio só é atualizado se ainda estiver na versão lida (xmin); os
+    que mudaram são devolvidos em "conflitos" sem desfazer os demais. Os
+    valores antigos para o log vêm do próprio UPDATE, os logs entram em um
+    único INSERT e o lote gera uma só notificação e uma só invalidação de cache.
+
+    Retorna {"salvos": [numero_desvio_estudo...], "conflitos": [id...], "erro": str | None}.
+    """
+    gerente_nome = st.session_state["gerente_nome"]
+    resultado = {"salvos": [], "conflitos": [], "erro": None}
+    if not itens:
+        return resultado
+
+    try:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            # 1. Atualiza apenas as linhas que ainda estão na versão lida. Estudo
+            # e gerente vão como valores de cada linha: texto no template do
+            # execute_values (ex.: um "%" no nome) quebraria os placeholders.
+            with medir_consulta("salvar_lote"):
+                atualizados = execute_values(
+                    cursor,
+                    """
+                    WITH v (id, row_version, avaliacao, estudo_id, atualizado_por) AS (VALUES %s),
+                    atuais AS (
+                        SELECT d.id, d.status, d.avaliacao_gerente_medico
+                        FROM desvios d
+                        JOIN v ON v.id = d.id AND d.xmin = v.row_version::xid
+                        WHERE d.estudo_id = v.estudo_id
+                          AND d.deleted_at IS NULL
+                        FOR UPDATE OF d
+                    )
+                    UPDATE desvios d
+                    SET
+                        avaliacao_gerente_medico = v.avaliacao,
+                        status = 'Avaliado',
+                        atualizado_por = v.atualizado_por,
+                        data_atualizacao = NOW()
+                    FROM atuais a
+                    JOIN v ON v.id = a.id
+                    WHERE d.id = a.id
+                    RETURNING
+                        d.id,
+                        d.numero_desvio_estudo,
+                        v.avaliacao,
+                        d.importancia,
+                        a.status AS status_antigo,
+                        a.avaliacao_gerente_medico AS valor_antigo
+                    """,
+                    [(int(i["id"]), str(i["row_version"]), i["avaliacao"], int(estudo_id), gerente_nome) for i in itens],
+                    template="(%s::int, %s::text, %s::text, %s::int, %s::text)",
+                    page_size=len(itens),
+                    fetch=True,
+                )
+
+            salvos = {row["id"]: row for row in atualizados}
+            resultado["conflitos"] = [int(i["id"]) for i in itens if int(i["id"]) not in salvos]
+            if not salvos:
+                conn.rollback()
+                return resultado
+
+            # 2. Log das alterações (avaliação e, quando mudou, status) em um único INSERT
+            logs = []
+            for row in salvos.values():
+                logs.append((row["id"], estudo_id, gerente_nome, "avaliacao_gerente_medico", row["valor_antigo"] or "", row["avaliacao"]))
+                if row["status_antigo"] != "Avaliado":
+                    logs.append((row["id"], estudo_id, gerente_nome, "status", row["status_antigo"], "Avaliado"))
+            with medir_consulta("log_insert"):
+                execute_values(
+                    cursor,
+                    """
+                    INSERT INTO desvios_log (desvio_id, estudo_id, usuario, campo, valor_antigo, valor_novo, data_alteracao)
+                    VALUES %s
+                    """,
+                    logs,
+                    template="(%s, %s, %s, %s, %s, %s, NOW())",
+                    page_size=len(logs),
+                )
+
+            # 3. Uma notificação para o estudo com todas as avaliações do lote
+            ordenados = sorted(salvos.values(), key=lambda row: row["numero_desvio_estudo"] or 0)
+            enfileirar_notificacao(
+                cursor,
+                tipo=NOTIFICACAO_AVALIACAO_LOTE,
                 estudo_id=estudo_id,
-                estudo_codigo=st.session_state.get("estudo_codigo", ""),
-                estudo_nome=st.session_state.get("estudo_nome", ""),
-                numero_desvio=desvio.get("numero_desvio_estudo", 0),
-                avaliacao=avaliacao,
-                gerente_nome=gerente_nome,
-                gerente_email=st.session_state.get("gerente_email", "")
+                desvio_id=None,
+                payload={
+                    "estudo_id": estudo_id,
+                    "estudo_codigo": st.session_state.get("estudo_codigo", ""),
+                    "estudo_nome": st.session_state.get("estudo_nome", ""),
+                    "avaliacoes": [
+                        {
+                            "numero_desvio": row["numero_desvio_estudo"],
+                            "avaliacao": row["avaliacao"],
+                            "importancia": row["importancia"],
+                        }
+                        for row in ordenados
+                    ],
+                    "prioritaria": any(importancia_prioritaria(row["importancia"]) for row in ordenados),
+                    "gerente_nome": gerente_nome,
+                    "gerente_email": st.session_state.get("gerente_email", ""),
+                },
             )
-        except Exception as email_error:
-            # Não falha a operação se o email não for enviado
-            print(f"Aviso: Email não enviado - {email_error}")
 
-        return True, "sucesso"
+            conn.commit()
+            registrar_escrita(conn)
+            resultado["salvos"] = [row["numero_desvio_estudo"] for row in ordenados]
 
     except Exception as e:
-        return False, str(e)
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-        except Exception:
-            pass
+        resultado["erro"] = str(e)
+        return resultado
+
+    # Uma invalidação para o lote inteiro
+    invalidar_estudo(estudo_id)
+
+    return resultado
 
 
 def get_campo_traduzido(desvio: dict, campo: str) -> str:
     """
-    Retorna o valor do campo traduzido baseado no idioma selecionado.
-    Para campos de selectbox que possuem versão _en, usa a coluna apropriada.
-
-    Campos com tradução: status, formulario_status, importancia, recorrencia,
-                         escopo, atendeu_prazos_report, formulario_arquivado
+    Retorna o valor de exibição de um campo de CAMPOS_TRADUZIDOS.
+    A tradução já vem resolvida do banco (carregar_detalhe_desvio com o idioma
+    da sessão); para o status o valor traduzido fica em status_exibicao.
     """
-    lang = st.session_state.get("language", "pt")
-
-    if lang == "en":
-        campo_en = f"{campo}_en"
-        if campo_en in desvio and desvio.get(campo_en):
-            return desvio.get(campo_en) or '-'
-
-    return desvio.get(campo) or '-'
+    return desvio.get(f"{campo}_exibicao") or desvio.get(campo) or '-'
 
 
 def formatar_data(data_raw):
@@ -822,261 +3171,153 @@ def formatar_data(data_raw):
     return str(data_raw)
 
 
-def exibir_detalhes_desvio(desvio):
-    """Exibe os detalhes do desvio em formato somente leitura - TODOS os campos"""
-    desvio_id = desvio['id']  # Para keys únicas
-
-    # === SEÇÃO 1: Informações Básicas ===
-    col1, col2, col3, col4 = st.columns(4)
-
-    with col1:
-        with st.container(border=True):
-            st.caption(t("ID do Desvio"))
-            st.markdown(f"**#{desvio['numero_desvio_estudo']}**")
-
-    with col2:
-        with st.container(border=True):
-            st.caption(t("Status"))
-            status = get_campo_traduzido(desvio, 'status')
-            if status.lower() in ['avaliado', 'evaluated']:
-                st.success(status)
-            else:
-                st.markdown(f"**{status}**")
-
-    with col3:
-        with st.container(border=True):
-            st.caption(t("Formulário"))
-            st.markdown(f"**{get_campo_traduzido(desvio, 'formulario_status')}**")
-
-    with col4:
-        with st.container(border=True):
-            st.caption(t("Importância"))
-            importancia = get_campo_traduzido(desvio, 'importancia')
-            if importancia.lower() in ['major', 'maior']:
-                st.error(importancia)
-            else:
-                st.markdown(f"**{importancia}**")
-
-    st.write("")
-
-    # === SEÇÃO 2: Identificação ===
-    col5, col6, col7 = st.columns(3)
-
-    with col5:
-        with st.container(border=True):
-            st.caption(t("Identificação do Desvio"))
-            st.markdown(f"**{desvio.get('identificacao_desvio') or '-'}**")
-
-    with col6:
-        with st.container(border=True):
-            st.caption(t("Centro"))
-            st.markdown(f"**{desvio.get('centro') or '-'}**")
-
-    with col7:
-        with st.container(border=True):
-            st.caption(t("Data do ocorrido"))
-            st.markdown(f"**{formatar_data(desvio.get('data_ocorrido'))}**")
-
-    st.write("")
-
-    # === SEÇÃO 3: Participante e Visita ===
-    col8, col9, col10 = st.columns(3)
-
-    with col8:
-        with st.container(border=True):
-            st.caption(t("Participante"))
-            st.markdown(f"**{desvio.get('participante') or '-'}**")
-
-    with col9:
-        with st.container(border=True):
-            st.caption(t("Visita"))
-            st.markdown(f"**{desvio.get('visita') or '-'}**")
-
-    with col10:
-        with st.container(border=True):
-            st.caption(t("Data de identificação"))
-            st.markdown(f"**{desvio.get('data_identificacao_texto') or '-'}**")
-
-    st.write("")
-
-    # === SEÇÃO 4: Categoria e Código ===
-    col11, col12, col13 = st.columns(3)
-
-    with col11:
-        with st.container(border=True):
-            st.caption(t("Categoria"))
-            st.markdown(f"**{desvio.get('categoria') or '-'}**")
-
-    with col12:
-        with st.container(border=True):
-            st.caption(t("Subcategoria"))
-            st.markdown(f"**{desvio.get('subcategoria') or '-'}**")
-
-    with col13:
-        with st.container(border=True):
-            st.caption(t("Código"))
-            st.markdown(f"**{desvio.get('codigo') or '-'}**")
-
-    st.write("")
-
-    # === SEÇÃO 5: Recorrência e Escopo ===
-    col14, col15, col16 = st.columns(3)
-
-    with col14:
-        with st.container(border=True):
-            st.caption(t("Recorrência"))
-            st.markdown(f"**{get_campo_traduzido(desvio, 'recorrencia')}**")
-
-    with col15:
-        with st.container(border=True):
-            st.caption(t("N° Desvio Ocorrência Prévia"))
-            st.markdown(f"**{desvio.get('num_ocorrencia_previa') or '-'}**")
-
-    with col16:
-        with st.container(border=True):
-            st.caption(t("Escopo"))
-            st.markdown(f"**{get_campo_traduzido(desvio, 'escopo')}**")
-
-    st.write("")
-
-    # === SEÇÃO 6: Escalonamento ===
-    col17, col18, col19 = st.columns(3)
-
-    with col17:
-        with st.container(border=True):
-            st.caption(t("Prazo de Escalonamento"))
-            st.markdown(f"**{formatar_data(desvio.get('prazo_escalonamento'))}**")
-
-    with col18:
-        with st.container(border=True):
-            st.caption(t("Data de escalonamento"))
-            st.markdown(f"**{formatar_data(desvio.get('data_escalonamento'))}**")
-
-    with col19:
-        with st.container(border=True):
-            st.caption(t("Atendeu os prazos de reporte?"))
-            st.markdown(f"**{get_campo_traduzido(desvio, 'atendeu_prazos_report')}**")
-
-    st.divider()
-
-    # === SEÇÃO 7: Descrição do Desvio ===
-    st.markdown(f"**{t('Descrição do desvio')}**")
-    st.text_area(
-        t("Descrição do desvio"),
-        value=desvio.get('descricao_desvio') or '-',
-        disabled=True,
-        height=100,
-        key=f"desc_readonly_{desvio_id}",
-        label_visibility="collapsed"
-    )
-
-    st.write("")
-
-    # === SEÇÃO 8: Motivo (novo campo) ===
-    st.markdown(f"**{t('Motivo')}**")
-    st.text_area(
-        t("Motivo"),
-        value=desvio.get('motivo') or '-',
-        disabled=True,
-        height=100,
-        key=f"motivo_readonly_{desvio_id}",
-        label_visibility="collapsed"
-    )
-
-    st.write("")
-
-    # === SEÇÃO 9: Causa Raiz e Ações ===
-    col_causa, col_corr = st.columns(2)
+# Painel de detalhes em um único bloco HTML (cacheado por id, versão e idioma).
+
+CSS_DETALHE = (
+    ".dv-grid{display:grid;gap:1rem;margin-bottom:1rem}"
+    ".dv-c2{grid-template-columns:repeat(2,minmax(0,1fr))}"
+    ".dv-c3{grid-template-columns:repeat(3,minmax(0,1fr))}"
+    ".dv-c4{grid-template-columns:repeat(4,minmax(0,1fr))}"
+    ".dv-card{border:1px solid rgba(128,128,128,.3);border-radius:.5rem;padding:.75rem 1rem}"
+    ".dv-rotulo{font-size:.875rem;opacity:.6;margin-bottom:.25rem}"
+    ".dv-valor{font-weight:600;overflow-wrap:anywhere}"
+    ".dv-sucesso,.dv-erro{padding:.5rem .75rem;border-radius:.5rem}"
+    ".dv-sucesso{background:rgba(33,195,84,.1);color:rgb(23,114,51)}"
+    ".dv-erro{background:rgba(255,43,43,.09);color:rgb(125,53,59)}"
+    ".dv-titulo{font-weight:600;margin-bottom:.5rem}"
+    ".dv-texto{white-space:pre-wrap;overflow-wrap:anywhere;max-height:150px;overflow-y:auto;"
+    "border:1px solid rgba(128,128,128,.3);border-radius:.5rem;padding:.5rem .75rem;"
+    "background:rgba(128,128,128,.08);margin-bottom:1rem}"
+    ".dv-hr{border:none;border-top:1px solid rgba(128,128,128,.3);margin:1.5rem 0}"
+    "@media (max-width:640px){.dv-c2,.dv-c3,.dv-c4{grid-template-columns:1fr}}"
+)
+
+
+@cache_com_metricas("html_detalhes_desvio", ttl=TTL_CACHE, max_entries=200, show_spinner=False,
+                    compactar=comprimir_texto, expandir=expandir_texto)
+def html_detalhes_desvio(desvio_id: int, row_version: str, lang: str, _desvio: dict) -> str:
+    """
+    Monta o painel somente leitura do desvio como um bloco HTML único.
+    A chave do cache é (id, row_version, idioma): as reruns do fragment (a cada
+    tecla na avaliação) só reemitem o texto, sem recriar a árvore de widgets.
+    Os textos ficam em uma única linha (quebras viram &#10;) para o markdown
+    do Streamlit tratar tudo como um bloco HTML.
+    """
+    desvio = _desvio
 
-    with col_causa:
-        st.markdown(f"**{t('Causa Raiz')}**")
-        st.text_area(
-            t("Causa Raiz"),
-            value=desvio.get('causa_raiz') or '-',
-            disabled=True,
-            height=100,
-            key=f"causa_readonly_{desvio_id}",
-            label_visibility="collapsed"
-        )
+    def texto(valor) -> str:
+        return html.escape(str(valor)).replace("\r\n", "\n").replace("\n", "&#10;")
 
-    with col_corr:
-        st.markdown(f"**{t('Ação Corretiva')}**")
-        st.text_area(
-            t("Ação Corretiva"),
-            value=desvio.get('acao_corretiva') or '-',
-            disabled=True,
-            height=100,
-            key=f"corr_readonly_{desvio_id}",
-            label_visibility="collapsed"
+    def card(rotulo: str, valor, classe: str = "dv-valor") -> str:
+        return (
+            f'<div class="dv-card"><div class="dv-rotulo">{texto(t(rotulo, lang))}</div>'
+            f'<div class="{classe}">{texto(valor)}</div></div>'
         )
 
-    st.write("")
-
-    # === SEÇÃO 10: Ação Preventiva ===
-    st.markdown(f"**{t('Ação Preventiva')}**")
-    st.text_area(
-        t("Ação Preventiva"),
-        value=desvio.get('acao_preventiva') or '-',
-        disabled=True,
-        height=100,
-        key=f"prev_readonly_{desvio_id}",
-        label_visibility="collapsed"
-    )
-
-    st.divider()
-
-    # === SEÇÃO 11: Avaliações ===
-    st.markdown(f"**{t('Avaliação do Investigador Principal')}**")
-    st.text_area(
-        t("Avaliação do Investigador Principal"),
-        value=desvio.get('avaliacao_investigador') or '-',
-        disabled=True,
-        height=100,
-        key=f"aval_inv_readonly_{desvio_id}",
-        label_visibility="collapsed"
-    )
-
-    st.write("")
+    def linha(*cards) -> str:
+        return f'<div class="dv-grid dv-c{len(cards)}">{"".join(cards)}</div>'
 
-    # === SEÇÃO 12: Arquivamento e Submissão ===
-    col20, col21, col22 = st.columns(3)
+    def bloco(rotulo: str, campo: str) -> str:
+        return (
+            f'<div><div class="dv-titulo">{texto(t(rotulo, lang))}</div>'
+            f'<div class="dv-texto">{texto(desvio.get(campo) or "-")}</div></div>'
+        )
 
-    with col20:
-        with st.container(border=True):
-            st.caption(t("Formulário Arquivado (ISF e TMF)?"))
-            st.markdown(f"**{get_campo_traduzido(desvio, 'formulario_arquivado')}**")
+    campo = lambda nome: desvio.get(nome) or '-'
+    traduzido = lambda nome: get_campo_traduzido(desvio, nome)
+    status = traduzido('status')
+    importancia = traduzido('importancia')
+
+    partes = [
+        f"<style>{CSS_DETALHE}</style>",
+        linha(
+            card("ID do Desvio", f"#{desvio['numero_desvio_estudo']}"),
+            card("Status", status, "dv-sucesso" if desvio['status'] == 'Avaliado' else "dv-valor"),
+            card("Formulário", traduzido('formulario_status')),
+            card("Importância", importancia, "dv-erro" if importancia.lower() in ['major', 'maior'] else "dv-valor"),
+        ),
+        linha(
+            card("Identificação do Desvio", campo('identificacao_desvio')),
+            card("Centro", campo('centro')),
+            card("Data do ocorrido", formatar_data(desvio.get('data_ocorrido'))),
+        ),
+        linha(
+            card("Participante", campo('participante')),
+            card("Visita", campo('visita')),
+            card("Data de identificação", campo('data_identificacao_texto')),
+        ),
+        linha(
+            card("Categoria", campo('categoria')),
+            card("Subcategoria", campo('subcategoria')),
+            card("Código", campo('codigo')),
+        ),
+        linha(
+            card("Recorrência", traduzido('recorrencia')),
+            card("N° Desvio Ocorrência Prévia", campo('num_ocorrencia_previa')),
+            card("Escopo", traduzido('escopo')),
+        ),
+        linha(
+            card("Prazo de Escalonamento", formatar_data(desvio.get('prazo_escalonamento'))),
+            card("Data de escalonamento", formatar_data(desvio.get('data_escalonamento'))),
+            card("Atendeu os prazos de reporte?", traduzido('atendeu_prazos_report')),
+        ),
+        '<hr class="dv-hr">',
+        bloco("Descrição do desvio", 'descricao_desvio'),
+        bloco("Motivo", 'motivo'),
+        f'<div class="dv-grid dv-c2">{bloco("Causa Raiz", "causa_raiz")}{bloco("Ação Corretiva", "acao_corretiva")}</div>',
+        bloco("Ação Preventiva", 'acao_preventiva'),
+        '<hr class="dv-hr">',
+        bloco("Avaliação do Investigador Principal", 'avaliacao_investigador'),
+        linha(
+            card("Formulário Arquivado (ISF e TMF)?", traduzido('formulario_arquivado')),
+            card("Data de Submissão ao CEP", formatar_data(desvio.get('data_submissao_cep'))),
+            card("Data de finalização", formatar_data(desvio.get('data_finalizacao'))),
+        ),
+        bloco("Observação", 'observacao'),
+        card("Última Atualização", formatar_data(desvio.get('data_atualizacao'))),
+    ]
+    return f'<div class="dv-painel">{"".join(partes)}</div>'
 
-    with col21:
-        with st.container(border=True):
-            st.caption(t("Data de Submissão ao CEP"))
-            st.markdown(f"**{formatar_data(desvio.get('data_submissao_cep'))}**")
 
-    with col22:
-        with st.container(border=True):
-            st.caption(t("Data de finalização"))
-            st.markdown(f"**{formatar_data(desvio.get('data_finalizacao'))}**")
-
-    st.write("")
-
-    # === SEÇÃO 13: Observação ===
-    st.markdown(f"**{t('Observação')}**")
-    st.text_area(
-        t("Observação"),
-        value=desvio.get('observacao') or '-',
-        disabled=True,
-        height=100,
-        key=f"obs_readonly_{desvio_id}",
-        label_visibility="collapsed"
+def exibir_detalhes_desvio(desvio):
+    """Exibe os detalhes do desvio em formato somente leitura - TODOS os campos"""
+    lang = st.session_state.get("language", "pt")
+    st.markdown(
+        html_detalhes_desvio(desvio['id'], str(desvio['row_version']), lang, desvio),
+        unsafe_allow_html=True,
     )
 
-    st.write("")
 
-    # === SEÇÃO 14: Última Atualização ===
+def secao_resultados_busca(encontrados: pd.DataFrame):
+    """Resultados da busca textual, do mais relevante, com os termos destacados"""
     with st.container(border=True):
-        st.caption(t("Última Atualização"))
-        st.markdown(f"**{formatar_data(desvio.get('data_atualizacao'))}**")
+        if encontrados.empty:
+            st.info(t("Nenhum desvio contém esses termos."))
+            return
+
+        st.caption(f"{len(encontrados)} {t('desvio(s) encontrado(s)')}")
+        if int(encontrados["candidatos"].iloc[0]) >= LIMITE_CANDIDATOS:
+            st.caption(t("Muitos desvios contêm esses termos: a relevância foi calculada entre os mais recentes. Refine a busca para resultados melhores."))
+
+        itens = []
+        for row in encontrados.itertuples(index=False):
+            detalhes = " · ".join(
+                html.escape(str(valor))
+                for valor in (
+                    row.status_exibicao,
+                    f"{t('Participante')} {row.participante}" if row.participante else None,
+                    f"{t('Visita')} {row.visita}" if row.visita else None,
+                )
+                if valor
+            )
+            itens.append(
+                f"<li><b>#{row.numero_desvio_estudo}</b> · {detalhes}<br>"
+                f"<span style='font-size: 0.9em'>{html_trecho_busca(row.trecho)}</span></li>"
+            )
+        st.markdown(f"<ul>{''.join(itens)}</ul>", unsafe_allow_html=True)
 
 
+@medir_tela("lista_desvios_page")
 def lista_desvios_page():
     """Tela principal de listagem e avaliação de desvios"""
     estudo_codigo = st.session_state.get("estudo_codigo", "")
@@ -1089,7 +3330,7 @@ def lista_desvios_page():
     st.divider()
 
     # Barra de controles
-    col_filtro, col_reload = st.columns([3, 1])
+    col_filtro, col_tamanho, col_reload = st.columns([3, 1, 1])
 
     with col_filtro:
         filtro_status = st.selectbox(
@@ -1099,9 +3340,18 @@ def lista_desvios_page():
             label_visibility="collapsed",
         )
 
+    with col_tamanho:
+        tamanho_pagina = st.selectbox(
+            t("Por página"),
+            TAMANHOS_PAGINA,
+            index=TAMANHOS_PAGINA.index(TAMANHO_PAGINA_PADRAO),
+            label_visibility="collapsed",
+            format_func=lambda n: f"{n} {t('por página')}" if n else t("Todos"),
+        )
+
     with col_reload:
         if st.button(f"🔄 {t('Atualizar')}", use_container_width=True):
-            limpar_cache()
+            invalidar_estudo(estudo_id)
             st.rerun()
 
     # Mapear filtro traduzido para valor do banco
@@ -1114,11 +3364,48 @@ def lista_desvios_page():
     }
     filtro_db = filtro_map.get(filtro_status, "Pendentes")
 
+    # Busca textual nos campos narrativos (descrição, motivo, causa raiz, ações, observação)
+    termo = " ".join(st.text_input(
+        t("Buscar nos textos dos desvios"),
+        key="busca_desvios",
+        placeholder=t("ex.: ECG não realizado na visita 4"),
+        label_visibility="collapsed",
+    ).split())
+    if termo:
+        try:
+            encontrados = buscar_desvios(estudo_id, termo, versao_estudo(estudo_id), st.session_state.get("language", "pt"))
+        except Exception as e:
+            st.error(f"{t('Erro na busca')}: {e}")
+        else:
+            secao_resultados_busca(encontrados)
+
+    # Posição na paginação (volta à primeira página ao trocar estudo, filtro ou tamanho)
+    chave_lista = (estudo_id, filtro_db, tamanho_pagina)
+    pagina = st.session_state.get("pagina_desvios")
+    if not pagina or pagina["chave"] != chave_lista:
+        pagina = {"chave": chave_lista, "cursor": None, "direcao": "proxima", "numero": 1}
+        st.session_state["pagina_desvios"] = pagina
+
     # Carregar desvios com spinner
     with st.spinner(t("Carregando desvios...")):
-        desvios = carregar_desvios_do_estudo(estudo_id, filtro_db)
+        versao = versao_estudo(estudo_id)
+        try:
+            resultado = carregar_pagina_desvios(
+                estudo_id, filtro_db, tamanho_pagina, pagina["cursor"], pagina["direcao"], versao,
+                st.session_state.get("language", "pt"),
+            )
+            total = contar_desvios(estudo_id, filtro_db, versao, st.session_state.get("language", "pt"))
+        except Exception as e:
+            st.error(f"{t('Erro ao carregar os desvios')}: {e}")
+            return
+    desvios = resultado["desvios"]
+
+    if desvios.empty and pagina["cursor"] is not None:
+        # A página ficou vazia (ex.: desvios avaliados): volta para o início
+        st.session_state.pop("pagina_desvios", None)
+        st.rerun()
 
-    if not desvios:
+    if desvios.empty:
         st.divider()
         if filtro_db == "Pendentes":
             st.success(t("Nenhum desvio pendente de avaliação!"))
@@ -1127,31 +3414,24 @@ def lista_desvios_page():
         return
 
     # Contador de resultados
-    st.caption(f"{len(desvios)} {t('desvio(s) encontrado(s)')}")
-
-    # Tabela de desvios
-    df_display = pd.DataFrame(desvios)
-
-    # Usar colunas traduzidas (_en) baseado no idioma
-    lang = st.session_state.get("language", "pt")
-    col_status = "status_en" if lang == "en" and "status_en" in df_display.columns else "status"
-    col_importancia = "importancia_en" if lang == "en" and "importancia_en" in df_display.columns else "importancia"
+    st.caption(f"{max(total, len(desvios))} {t('desvio(s) encontrado(s)')}")
 
+    # Tabela de desvios (status e importância já vêm no idioma da sessão)
     colunas_tabela = [
         "numero_desvio_estudo",
-        col_status,
+        "status_exibicao",
         "participante",
         "centro",
         "visita",
-        col_importancia,
+        "importancia",
         "descricao_desvio",
     ]
 
-    df_tabela = df_display[colunas_tabela].copy()
+    df_tabela = desvios[colunas_tabela].copy()
     df_tabela.columns = ["ID", t("Status"), t("Participante"), t("Centro"), t("Visita"), t("Importância"), t("Descrição")]
 
     df_tabela[t("Descrição")] = df_tabela[t("Descrição")].apply(
-        lambda x: (x[:60] + "...") if x and len(x) > 60 else x
+        lambda x: (x[:60] + "...") if isinstance(x, str) and len(x) > 60 else x
     )
 
     st.dataframe(
@@ -1160,20 +3440,86 @@ def lista_desvios_page():
         hide_index=True,
     )
 
+    with st.expander(f"⬇️ {t('Exportar estudo')}"):
+        st.caption(t("Todos os desvios do estudo (com a avaliação do gerente médico) e o histórico de alterações, no idioma selecionado."))
+        formatos = [f for f in FORMATOS_EXPORTACAO if f != "parquet" or parquet_disponivel()]
+        formato = st.radio(
+            t("Formato"), formatos, format_func={"csv": "CSV", "parquet": "Parquet"}.get,
+            horizontal=True, key="formato_exportacao",
+        )
+        if len(formatos) < len(FORMATOS_EXPORTACAO):
+            st.caption(t("Parquet requer o pacote pyarrow no servidor."))
+        lang = st.session_state.get("language", "pt")
+        st.download_button(
+            f"⬇️ {t('Baixar')}",
+            data=functools.partial(gerar_exportacao_estudo, estudo_id, formato, lang),
+            file_name=f"{estudo_codigo or estudo_id}_{formato}_{lang}_{datetime.now():%Y%m%d}.zip",
+            mime="application/zip",
+            on_click="ignore",
+            key="btn_exportar_estudo",
+        )
+
+    # Navegação entre páginas
+    if tamanho_pagina:
+        total_paginas = max(1, -(-total // tamanho_pagina))
+        col_anterior, col_pagina, col_proxima = st.columns([1, 3, 1])
+
+        with col_anterior:
+            if st.button(f"◀ {t('Anterior')}", disabled=not resultado["tem_anterior"], use_container_width=True):
+                primeiro = desvios.iloc[0]
+                if pagina["numero"] <= 2:
+                    pagina.update(cursor=None, direcao="proxima", numero=1)
+                else:
+                    pagina.update(
+                        cursor=cursor_pagina(primeiro),
+                        direcao="anterior",
+                        numero=pagina["numero"] - 1,
+                    )
+                st.rerun()
+
+        with col_pagina:
+            st.caption(f"{t('Página')} {pagina['numero']} {t('de')} {max(total_paginas, pagina['numero'])}")
+
+        with col_proxima:
+            if st.button(f"{t('Próxima')} ▶", disabled=not resultado["tem_proxima"], use_container_width=True):
+                ultimo = desvios.iloc[-1]
+                pagina.update(
+                    cursor=cursor_pagina(ultimo),
+                    direcao="proxima",
+                    numero=pagina["numero"] + 1,
+                )
+                st.rerun()
+
     st.markdown(" ")
 
     # Seção de avaliação (usando fragment para não re-renderizar a página toda)
-    secao_avaliacao(desvios, estudo_id)
+    modo = st.radio(
+        t("Modo de avaliação"),
+        [t("Um desvio"), t("Em lote")],
+        horizontal=True,
+        label_visibility="collapsed",
+        key="modo_avaliacao",
+    )
+    if modo == t("Em lote"):
+        secao_avaliacao_lote(desvios, estudo_id)
+    else:
+        secao_avaliacao(desvios, estudo_id)
 
 
 @st.fragment
-def secao_avaliacao(desvios: list, estudo_id: int):
+@medir_tela("secao_avaliacao")
+def secao_avaliacao(desvios: pd.DataFrame, estudo_id: int):
     """Fragment para seleção e avaliação de desvio - não re-renderiza a página toda"""
 
     st.subheader(t("Selecione um desvio para avaliar"))
 
-    # Seletor de desvio
-    opcoes_desvio = {f"{d['numero_desvio_estudo']}": d for d in desvios}
+    # Seletor de desvio: número exibido -> (id, row_version)
+    opcoes_desvio = {
+        f"{numero}": (int(desvio_id), row_version)
+        for numero, desvio_id, row_version in zip(
+            desvios["numero_desvio_estudo"], desvios["id"], desvios["row_version"]
+        )
+    }
 
     desvio_selecionado_key = st.selectbox(
         t("Selecione o desvio:"),
@@ -1188,7 +3534,17 @@ def secao_avaliacao(desvios: list, estudo_id: int):
         st.info(t("Selecione um desvio na lista acima para visualizar os detalhes e realizar a avaliação."))
         return
 
-    desvio = opcoes_desvio[desvio_selecionado_key]
+    desvio_id, row_version = opcoes_desvio[desvio_selecionado_key]
+
+    # Registro completo só do desvio selecionado
+    try:
+        desvio = carregar_detalhe_desvio(desvio_id, row_version, st.session_state.get("language", "pt"))
+    except Exception as e:
+        st.error(f"{t('Erro ao carregar o desvio')}: {e}")
+        return
+    if not desvio:
+        st.warning(t("Este desvio não está mais disponível. Clique em 'Atualizar' para recarregar a lista."))
+        return
 
     st.divider()
 
@@ -1245,6 +3601,91 @@ def secao_avaliacao(desvios: list, estudo_id: int):
                             st.error(f"{t('Erro ao salvar')}: {mensagem}")
 
 
+@st.fragment
+@medir_tela("secao_avaliacao_lote")
+def secao_avaliacao_lote(desvios: pd.DataFrame, estudo_id: int):
+    """Fragment para avaliar vários desvios pendentes da página de uma vez"""
+
+    st.subheader(t("Avaliação em lote"))
+    st.caption(t("Selecione os desvios pendentes e informe a avaliação de cada um ou uma avaliação comum."))
+
+    # Resultado do último lote (guardado antes do rerun)
+    ultimo = st.session_state.pop("resultado_lote", None)
+    if ultimo:
+        if ultimo["salvos"]:
+            st.success(f"{len(ultimo['salvos'])} {t('avaliação(ões) salva(s) com sucesso!')}")
+        if ultimo["conflitos"]:
+            aviso = t("Modificados por outra pessoa e não salvos (clique em 'Atualizar')")
+            st.warning(f"{aviso}: " + ", ".join(f"#{n}" for n in ultimo["conflitos"]))
+
+    pendentes = desvios[desvios["status"] != "Avaliado"]
+    if pendentes.empty:
+        st.info(t("Nenhum desvio pendente nesta página."))
+        return
+
+    versoes = dict(zip(pendentes["id"].astype(int), pendentes["row_version"]))
+    numeros = dict(zip(pendentes["id"].astype(int), pendentes["numero_desvio_estudo"]))
+
+    tabela = pd.DataFrame(
+        {
+            t("Selecionar"): False,
+            "ID": pendentes["numero_desvio_estudo"].values,
+            t("Status"): pendentes["status_exibicao"].values,
+            t("Importância"): pendentes["importancia"].values,
+            t("Descrição"): pendentes["descricao_desvio"].apply(
+                lambda x: (x[:60] + "...") if isinstance(x, str) and len(x) > 60 else x
+            ).values,
+            t("Avaliação individual (opcional)"): "",
+        },
+        index=pendentes["id"].astype(int).values,
+    )
+
+    editado = st.data_editor(
+        tabela,
+        hide_index=True,
+        use_container_width=True,
+        disabled=["ID", t("Status"), t("Importância"), t("Descrição")],
+        key=f"editor_lote_{estudo_id}",
+    )
+
+    avaliacao_comum = st.text_area(
+        t("Avaliação comum (usada nos selecionados sem avaliação individual)"),
+        height=120,
+        key=f"avaliacao_lote_comum_{estudo_id}",
+    )
+
+    if st.button(t("Salvar avaliações selecionadas"), type="primary", key="btn_salvar_lote"):
+        selecionados = editado[editado[t("Selecionar")]]
+        if selecionados.empty:
+            st.warning(t("Selecione ao menos um desvio."))
+            return
+
+        itens, sem_avaliacao = [], []
+        for desvio_id, linha in selecionados.iterrows():
+            texto = (linha[t("Avaliação individual (opcional)")] or "").strip() or avaliacao_comum.strip()
+            if not texto:
+                sem_avaliacao.append(numeros[desvio_id])
+                continue
+            itens.append({"id": desvio_id, "row_version": versoes[desvio_id], "avaliacao": texto})
+
+        if sem_avaliacao:
+            st.warning(f"{t('Desvios selecionados sem avaliação')}: " + ", ".join(f"#{n}" for n in sem_avaliacao))
+            return
+
+        with st.spinner(t("Salvando avaliação...")):
+            resultado = salvar_avaliacoes_em_lote(itens, estudo_id)
+
+        if resultado["erro"]:
+            st.error(f"{t('Erro ao salvar')}: {resultado['erro']}")
+            return
+
+        st.session_state["resultado_lote"] = {
+            "salvos": resultado["salvos"],
+            "conflitos": [numeros[i] for i in resultado["conflitos"]],
+        }
+        st.rerun()
+
+
 # =========================
 # Barra Lateral
 # =========================
@@ -1293,14 +3734,12 @@ def render_sidebar():
             if st.button(f"🔀 {t('Trocar Estudo')}"):
                 for k in ["estudo_id", "estudo_codigo", "estudo_nome"]:
                     st.session_state.pop(k, None)
-                limpar_cache()
                 st.rerun()
 
         st.markdown("---")
 
         if st.button(f"🚪 {t('Sair')}"):
-            # Limpa cache e sessão (mantém idioma)
-            limpar_cache()
+            # Limpa a sessão (mantém idioma); o cache é compartilhado e invalidado por escrita
             lang = st.session_state.get("language", "pt")
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
@@ -1336,6 +3775,11 @@ def main():
         </style>
     """, unsafe_allow_html=True)
 
+    # Escuta alterações feitas por outros processos para manter o cache válido
+    # e publica as métricas do processo (uma vez por processo)
+    iniciar_ouvinte_alteracoes()
+    iniciar_exportador_metricas()
+
     # Inicializa flag de autenticação
     if "is_authenticated" not in st.session_state:
         st.session_state["is_authenticated"] = False
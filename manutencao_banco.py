@@ -0,0 +1,764 @@
+"""
+Manutenção do Banco do Portal do Gerente Médico
+Comandos administrativos para as estruturas auxiliares do portal.
+
+Uso (na pasta do portal, para usar o mesmo .streamlit/secrets.toml):
+    python manutencao_banco.py migracoes status
+    python manutencao_banco.py migracoes aplicar
+    python manutencao_banco.py planos verificar [--estudo ID] [--email EMAIL]
+    python manutencao_banco.py contadores verificar [--estudo ID]
+    python manutencao_banco.py contadores reconstruir [--estudo ID]
+    python manutencao_banco.py log particoes [--meses 3]
+    python manutencao_banco.py log arquivar --antes AAAA-MM [--pasta DIR]
+    python manutencao_banco.py log consultar [AAAA-MM ...] [--desvio ID] [--estudo ID]
+    python manutencao_banco.py log restaurar AAAA-MM [...]
+    python manutencao_banco.py exportar --estudo ID [--formato csv|parquet] [--idioma pt|en] [--saida ARQUIVO.zip]
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import re
+from datetime import datetime, timezone
+import sys
+from pathlib import Path
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from externos import (
+    SQL_CONTAGEM_DO_ESTUDO,
+    SQL_EMAILS_MONITORES,
+    SQL_ESTUDOS_DO_GERENTE,
+    SQL_LOGIN_GERENTE,
+    SQL_MARCA_DAGUA_DESVIOS,
+    SQL_METRICAS_GERENTE,
+    FORMATOS_EXPORTACAO,
+    exportar_estudo,
+    get_connection,
+    get_pool,
+    montar_consulta_busca,
+    montar_consulta_snapshot,
+)
+
+
+# =========================
+# Migrações
+# =========================
+
+PASTA_MIGRACOES = Path(__file__).resolve().parent / "sql"
+MARCADOR_SEM_TRANSACAO = "-- migracao: sem-transacao"
+LOCK_MIGRACOES = 7_310_001  # pg_advisory_lock: uma execução de 'migracoes aplicar' por vez
+
+
+def listar_migracoes() -> list:
+    """
+    Arquivos sql/NNN_descricao.sql em ordem de versão: [(versao, nome, caminho)].
+    Os arquivos devem ser idempotentes (IF NOT EXISTS, CREATE OR REPLACE...):
+    bancos que receberam as migrações antigas via psql as executam de novo
+    na primeira vez que o comando é usado.
+    """
+    migracoes = {}
+    for caminho in sorted(PASTA_MIGRACOES.glob("*.sql")):
+        m = re.match(r"^(\d+)_.+\.sql$", caminho.name)
+        if not m:
+            continue
+        versao = int(m.group(1))
+        if versao in migracoes:
+            raise ValueError(f"Versão de migração duplicada: {caminho.name} e {migracoes[versao][1]}")
+        migracoes[versao] = (versao, caminho.name, caminho)
+    return [migracoes[v] for v in sorted(migracoes)]
+
+
+def _conectar_migracoes():
+    """Conexão própria (fora do pool do portal) para as migrações"""
+    return psycopg2.connect(**get_pool().parametros)
+
+
+def garantir_tabela_migracoes(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migracoes (
+                versao      INTEGER     PRIMARY KEY,
+                nome        TEXT        NOT NULL,
+                checksum    TEXT        NOT NULL,
+                aplicada_em TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+    conn.commit()
+
+
+def _migracoes_aplicadas(conn) -> dict:
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute("SELECT versao, nome, checksum, aplicada_em FROM schema_migracoes")
+        aplicadas = {row["versao"]: row for row in cursor.fetchall()}
+    conn.commit()
+    return aplicadas
+
+
+def _checksum(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _comandos(texto: str) -> list:
+    """
+    Separa um arquivo sem transação em comandos (um ';' no fim da linha encerra
+    o comando). Esses arquivos só devem ter comandos simples, sem blocos $$.
+    """
+    comandos, atual = [], []
+    for linha in texto.splitlines():
+        if linha.strip().startswith("--"):
+            continue
+        atual.append(linha)
+        if linha.rstrip().endswith(";"):
+            comando = "\n".join(atual).strip()
+            if comando != ";":
+                comandos.append(comando)
+            atual = []
+    if "\n".join(atual).strip():
+        comandos.append("\n".join(atual).strip())
+    return comandos
+
+
+def _remover_indices_invalidos(conn, texto: str):
+    """
+    Um CREATE INDEX CONCURRENTLY interrompido deixa o índice INVALID, e o
+    IF NOT EXISTS da nova tentativa o manteria assim. Remove os índices
+    inválidos criados pelo arquivo antes de executá-lo de novo.
+    """
+    nomes = re.findall(
+        r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)",
+        texto,
+        flags=re.IGNORECASE,
+    )
+    if not nomes:
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid AND c.relname = ANY(%s)
+            """,
+            (nomes,),
+        )
+        for (nome,) in cursor.fetchall():
+            print(f"  removendo índice inválido {nome}")
+            cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(nome)))
+
+
+def aplicar_migracao(conn, versao: int, nome: str, caminho: Path):
+    """
+    Executa um arquivo de migração e o registra em schema_migracoes.
+    Por padrão tudo roda em uma transação; arquivos marcados com
+    '-- migracao: sem-transacao' (CREATE INDEX CONCURRENTLY) rodam comando a
+    comando em autocommit e só são registrados se todos os comandos passarem.
+    """
+    texto = caminho.read_text(encoding="utf-8")
+    registro = (
+        """
+        INSERT INTO schema_migracoes (versao, nome, checksum)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (versao) DO UPDATE
+        SET nome = EXCLUDED.nome, checksum = EXCLUDED.checksum, aplicada_em = NOW()
+        """,
+        (versao, nome, _checksum(texto)),
+    )
+
+    if not texto.lstrip().startswith(MARCADOR_SEM_TRANSACAO):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(texto)
+                cursor.execute(*registro)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return
+
+    conn.autocommit = True
+    try:
+        _remover_indices_invalidos(conn, texto)
+        with conn.cursor() as cursor:
+            for comando in _comandos(texto):
+                cursor.execute(comando)
+            cursor.execute(*registro)
+    finally:
+        conn.autocommit = False
+
+
+def comando_migracoes(args) -> int:
+    migracoes = listar_migracoes()
+    conn = _conectar_migracoes()
+    try:
+        garantir_tabela_migracoes(conn)
+
+        if args.acao == "status":
+            aplicadas = _migracoes_aplicadas(conn)
+            for versao, nome, caminho in migracoes:
+                aplicada = aplicadas.get(versao)
+                if aplicada is None:
+                    situacao = "pendente"
+                elif aplicada["checksum"] != _checksum(caminho.read_text(encoding="utf-8")):
+                    situacao = f"aplicada em {aplicada['aplicada_em']:%Y-%m-%d %H:%M} (arquivo alterado depois)"
+                else:
+                    situacao = f"aplicada em {aplicada['aplicada_em']:%Y-%m-%d %H:%M}"
+                print(f"  {nome}: {situacao}")
+            pendentes = [v for v, _, _ in migracoes if v not in aplicadas]
+            return 1 if pendentes else 0
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (LOCK_MIGRACOES,))
+        conn.commit()
+
+        aplicadas = _migracoes_aplicadas(conn)
+        pendentes = [m for m in migracoes if m[0] not in aplicadas]
+        if not pendentes:
+            print("Banco atualizado: nenhuma migração pendente.")
+            return 0
+
+        for versao, nome, caminho in pendentes:
+            print(f"Aplicando {nome}...")
+            try:
+                aplicar_migracao(conn, versao, nome, caminho)
+            except Exception as e:
+                print(f"Falha em {nome}: {e}")
+                return 1
+        print(f"{len(pendentes)} migração(ões) aplicada(s).")
+        return 0
+    finally:
+        conn.close()
+
+
+# =========================
+# Planos das Consultas Críticas
+# =========================
+
+def consultas_criticas(estudo_id: int, email: str, gerente_id: int) -> list:
+    """[(descricao, query, params)] das consultas mais frequentes do portal, como o portal as executa"""
+    consultas = [
+        ("login do gerente (fora do diretório)", SQL_LOGIN_GERENTE, (email,)),
+        ("estudos do gerente", SQL_ESTUDOS_DO_GERENTE, (gerente_id,)),
+        ("métricas do gerente", SQL_METRICAS_GERENTE, (gerente_id,)),
+        ("monitores do estudo", SQL_EMAILS_MONITORES, (estudo_id,)),
+    ]
+    # Filtros e páginas da lista são recortados em memória deste snapshot
+    consultas.append(("snapshot dos desvios do estudo", *montar_consulta_snapshot(estudo_id)))
+    consultas.append(("snapshot dos desvios do estudo (en)", *montar_consulta_snapshot(estudo_id, "en")))
+    consultas.append(("marca d'água do snapshot", SQL_MARCA_DAGUA_DESVIOS, {"estudo_id": estudo_id}))
+    consultas.append(("atualização incremental do snapshot", *montar_consulta_snapshot(estudo_id, "pt", datetime.now(timezone.utc))))
+    consultas.append(("conferência com desvios_contagem", SQL_CONTAGEM_DO_ESTUDO, (estudo_id,)))
+    consultas.append(("busca textual nos desvios", *montar_consulta_busca(estudo_id, "visita")))
+    return consultas
+
+
+def _varreduras_completas(no: dict) -> list:
+    """Tabelas lidas inteiras no plano: Seq Scan ou Index Scan sem condição de índice"""
+    encontradas = []
+    tipo = no.get("Node Type")
+    if tipo == "Seq Scan":
+        encontradas.append(f"Seq Scan em {no.get('Relation Name')}")
+    elif tipo in ("Index Scan", "Index Only Scan") and "Index Cond" not in no:
+        encontradas.append(f"{tipo} completo em {no.get('Relation Name')} ({no.get('Index Name')})")
+    for filho in no.get("Plans", []):
+        encontradas.extend(_varreduras_completas(filho))
+    return encontradas
+
+
+def verificar_planos(estudo_id: int = None, email: str = None) -> list:
+    """
+    Gera o plano de cada consulta crítica com enable_seqscan desligado.
+    Assim o resultado não depende do tamanho das tabelas: um Seq Scan que
+    sobra significa que nenhum índice atende aquele predicado.
+    Retorna [(descricao, [varreduras completas])] das consultas com problema.
+    """
+    with get_connection() as conn, conn.cursor() as cursor:
+        if estudo_id is None:
+            cursor.execute("SELECT MIN(estudo_id) FROM estudo_gerente_medico")
+            estudo_id = cursor.fetchone()[0] or 0
+        if email is None:
+            cursor.execute("SELECT MIN(email) FROM gerentes_medicos")
+            email = cursor.fetchone()[0] or ""
+        cursor.execute("SELECT MIN(id) FROM gerentes_medicos WHERE LOWER(email) = LOWER(%s)", (email,))
+        gerente_id = cursor.fetchone()[0] or 0
+
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        problemas = []
+        for descricao, query, params in consultas_criticas(estudo_id, email, gerente_id):
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plano = cursor.fetchone()[0]
+            if isinstance(plano, str):
+                plano = json.loads(plano)
+            varreduras = _varreduras_completas(plano[0]["Plan"])
+            if varreduras:
+                problemas.append((descricao, varreduras))
+        conn.rollback()
+        return problemas
+
+
+def comando_planos(args) -> int:
+    problemas = verificar_planos(args.estudo, args.email)
+    if not problemas:
+        print("Todas as consultas críticas usam índices.")
+        return 0
+
+    print(f"{len(problemas)} consulta(s) sem índice adequado:")
+    for descricao, varreduras in problemas:
+        print(f"  {descricao}: {'; '.join(varreduras)}")
+    print("Execute 'python manutencao_banco.py migracoes aplicar' para criar os índices.")
+    return 1
+
+
+# =========================
+# Contagem de Desvios por Estudo
+# =========================
+
+def verificar_contadores(estudo_id: int = None) -> list:
+    """
+    Compara desvios_contagem com a contagem real em desvios.
+    Retorna as divergências (lista vazia = contadores corretos). As duas
+    leituras usam o mesmo snapshot, então escritas concorrentes não geram
+    falsos positivos.
+    """
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cursor.execute(
+            """
+            WITH real AS (
+                SELECT estudo_id, status, COUNT(*) AS total
+                FROM desvios
+                WHERE deleted_at IS NULL
+                  AND status IS NOT NULL
+                  AND estudo_id IS NOT NULL
+                  AND (%(estudo_id)s::int IS NULL OR estudo_id = %(estudo_id)s)
+                GROUP BY estudo_id, status
+            ),
+            resumo AS (
+                SELECT estudo_id, status, total
+                FROM desvios_contagem
+                WHERE total <> 0
+                  AND (%(estudo_id)s::int IS NULL OR estudo_id = %(estudo_id)s)
+            )
+            SELECT
+                COALESCE(r.estudo_id, s.estudo_id) AS estudo_id,
+                COALESCE(r.status, s.status) AS status,
+                COALESCE(r.total, 0) AS total_real,
+                COALESCE(s.total, 0) AS total_contador
+            FROM real r
+            FULL JOIN resumo s ON s.estudo_id = r.estudo_id AND s.status = r.status
+            WHERE COALESCE(r.total, 0) <> COALESCE(s.total, 0)
+            ORDER BY 1, 2
+            """,
+            {"estudo_id": estudo_id},
+        )
+        return cursor.fetchall()
+
+
+def reconstruir_contadores(estudo_id: int = None):
+    """Recalcula desvios_contagem a partir de desvios (bloqueia escritas em desvios durante a operação)"""
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT desvios_contagem_reconstruir(%s)", (estudo_id,))
+        conn.commit()
+
+
+def comando_contadores(args) -> int:
+    if args.acao == "reconstruir":
+        reconstruir_contadores(args.estudo)
+        print("Contadores reconstruídos.")
+        return 0
+
+    divergencias = verificar_contadores(args.estudo)
+    if not divergencias:
+        print("Contadores conferem com a tabela desvios.")
+        return 0
+
+    print(f"{len(divergencias)} divergência(s) encontrada(s):")
+    for d in divergencias:
+        print(f"  estudo {d['estudo_id']} / {d['status']}: real={d['total_real']} contador={d['total_contador']}")
+    print("Execute 'python manutencao_banco.py contadores reconstruir' para corrigir.")
+    return 1
+
+
+# =========================
+# Histórico de Alterações (desvios_log particionada)
+# =========================
+
+PASTA_ARQUIVO_LOG = Path(__file__).resolve().parent / "arquivo_log"
+PREFIXO_PARTICAO = "desvios_log_"
+LOCK_TIMEOUT_DETACH = "5s"  # o DETACH bloqueia desvios_log: desiste em vez de enfileirar o portal
+
+
+def _mes(texto: str) -> datetime:
+    """'AAAA-MM' ou 'AAAAMM' -> 1º dia do mês (UTC)"""
+    m = re.match(r"^(\d{4})-?(\d{2})$", texto.strip())
+    if not m:
+        raise ValueError(f"Mês inválido: {texto!r} (use AAAA-MM)")
+    return datetime(int(m.group(1)), int(m.group(2)), 1, tzinfo=timezone.utc)
+
+
+def _mes_seguinte(mes: datetime) -> datetime:
+    return mes.replace(year=mes.year + mes.month // 12, month=mes.month % 12 + 1)
+
+
+def _nome_particao(mes: datetime) -> str:
+    return f"{PREFIXO_PARTICAO}{mes:%Y%m}"
+
+
+def garantir_particoes(meses: int = 3) -> list:
+    """Cria as partições do mês corrente e dos próximos `meses`; devolve as criadas"""
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT desvios_log_garantir_particoes(%s)", (meses,))
+        criadas = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+    return criadas
+
+
+def listar_particoes() -> list:
+    """Partições anexadas a desvios_log: [{nome, inicio, fim, linhas_estimadas}] em ordem"""
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname AS nome,
+                   pg_get_expr(c.relpartbound, c.oid) AS limites,
+                   GREATEST(c.reltuples, 0)::bigint AS linhas_estimadas
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'desvios_log'::regclass
+            ORDER BY c.relname
+            """
+        )
+        particoes = cursor.fetchall()
+        conn.commit()
+
+    for p in particoes:
+        p["inicio"] = p["fim"] = None
+        m = re.match(r"^desvios_log_(\d{6})$", p["nome"])
+        if m:
+            p["inicio"] = _mes(m.group(1))
+            p["fim"] = _mes_seguinte(p["inicio"])
+    return particoes
+
+
+def linhas_sem_particao() -> list:
+    """Meses com linhas na partição padrão (criação atrasada ou mês já arquivado)"""
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT to_char(date_trunc('month', data_alteracao AT TIME ZONE 'UTC'), 'YYYY-MM'), COUNT(*)
+            FROM desvios_log_padrao
+            GROUP BY 1
+            ORDER BY 1 NULLS FIRST
+            """
+        )
+        meses = cursor.fetchall()
+        conn.commit()
+    return meses
+
+
+def acomodar_linhas_sem_particao(pasta: Path) -> list:
+    """
+    Cria as partições dos meses que têm linhas na partição padrão, exceto os
+    meses arquivados em `pasta` (esses voltam com restaurar_particao, que leva
+    junto as linhas atrasadas). Devolve as partições criadas.
+    """
+    arquivados = {m["particao"] for m in listar_arquivados(pasta)}
+    meses = [_mes(mes) for mes, _ in linhas_sem_particao() if mes]
+    criadas = []
+    with get_connection() as conn, conn.cursor() as cursor:
+        for mes in meses:
+            if _nome_particao(mes) in arquivados:
+                continue
+            cursor.execute("SELECT desvios_log_criar_particao(%s)", (mes.date(),))
+            nome = cursor.fetchone()[0]
+            if nome:
+                criadas.append(nome)
+        conn.commit()
+    return criadas
+
+
+def _caminhos_arquivo(pasta: Path, nome: str) -> tuple:
+    return pasta / f"{nome}.csv.gz", pasta / f"{nome}.json"
+
+
+def _contar_linhas_csv(caminho: Path) -> int:
+    with gzip.open(caminho, "rt", encoding="utf-8", newline="") as arquivo:
+        return sum(1 for _ in csv.reader(arquivo)) - 1  # sem o cabeçalho
+
+
+def _sha256_arquivo(caminho: Path) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def arquivar_particao(particao: dict, pasta: Path) -> int:
+    """
+    Exporta uma partição para <pasta>/<nome>.csv.gz (+ manifesto .json com
+    intervalo, colunas, linhas e sha256), confere o arquivo e só então faz
+    DETACH + DROP, tudo na mesma transação: se algo falhar a partição continua
+    no banco e os arquivos parciais são removidos. Devolve as linhas arquivadas.
+    """
+    nome = particao["nome"]
+    caminho_csv, caminho_manifesto = _caminhos_arquivo(pasta, nome)
+    if caminho_csv.exists() or caminho_manifesto.exists():
+        raise RuntimeError(f"{caminho_csv.name} já existe em {pasta}; restaure ou mova o arquivo antes")
+
+    pasta.mkdir(parents=True, exist_ok=True)
+    with get_connection() as conn, conn.cursor() as cursor:
+        try:
+            # SHARE bloqueia gravações atrasadas no mês enquanto ele é exportado
+            cursor.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(sql.Identifier(nome)))
+            cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(nome)))
+            linhas = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 "
+                "AND NOT attisdropped ORDER BY attnum",
+                (nome,),
+            )
+            colunas = [row[0] for row in cursor.fetchall()]
+
+            with gzip.open(caminho_csv, "wb") as arquivo:
+                cursor.copy_expert(
+                    sql.SQL("COPY (SELECT * FROM {} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)")
+                    .format(sql.Identifier(nome))
+                    .as_string(conn),
+                    arquivo,
+                )
+            exportadas = _contar_linhas_csv(caminho_csv)
+            if exportadas != linhas:
+                raise RuntimeError(f"{nome}: {exportadas} linha(s) no arquivo, {linhas} na partição")
+
+            caminho_manifesto.write_text(
+                json.dumps(
+                    {
+                        "particao": nome,
+                        "inicio": particao["inicio"].isoformat(),
+                        "fim": particao["fim"].isoformat(),
+                        "colunas": colunas,
+                        "linhas": linhas,
+                        "sha256": _sha256_arquivo(caminho_csv),
+                        "arquivado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    },
+                    ensure_ascii=False,
+                    indent=2,
+                ),
+                encoding="utf-8",
+            )
+
+            cursor.execute("SET LOCAL lock_timeout = %s", (LOCK_TIMEOUT_DETACH,))
+            cursor.execute(sql.SQL("ALTER TABLE desvios_log DETACH PARTITION {}").format(sql.Identifier(nome)))
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(nome)))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            caminho_csv.unlink(missing_ok=True)
+            caminho_manifesto.unlink(missing_ok=True)
+            raise
+    return linhas
+
+
+def _ler_manifesto(pasta: Path, nome: str) -> dict:
+    caminho_csv, caminho_manifesto = _caminhos_arquivo(pasta, nome)
+    if not caminho_manifesto.exists() or not caminho_csv.exists():
+        raise FileNotFoundError(f"{nome} não está arquivado em {pasta}")
+    manifesto = json.loads(caminho_manifesto.read_text(encoding="utf-8"))
+    if _sha256_arquivo(caminho_csv) != manifesto["sha256"]:
+        raise RuntimeError(f"{caminho_csv.name} não confere com o sha256 do manifesto")
+    return manifesto
+
+
+def listar_arquivados(pasta: Path) -> list:
+    """Manifestos dos meses arquivados em `pasta`, do mais antigo ao mais novo"""
+    return [
+        json.loads(caminho.read_text(encoding="utf-8"))
+        for caminho in sorted(pasta.glob(f"{PREFIXO_PARTICAO}*.json"))
+    ]
+
+
+def consultar_arquivados(pasta: Path, desvio_id: int = None, estudo_id: int = None, meses: list = None):
+    """
+    Lê os meses arquivados sem tocar no banco e devolve (gerador) as linhas do
+    histórico como dicts de texto, filtradas por desvio e/ou estudo.
+    """
+    for manifesto in listar_arquivados(pasta):
+        if meses and manifesto["particao"] not in meses:
+            continue
+        caminho_csv, _ = _caminhos_arquivo(pasta, manifesto["particao"])
+        with gzip.open(caminho_csv, "rt", encoding="utf-8", newline="") as arquivo:
+            for linha in csv.DictReader(arquivo):
+                if desvio_id is not None and linha["desvio_id"] != str(desvio_id):
+                    continue
+                if estudo_id is not None and linha["estudo_id"] != str(estudo_id):
+                    continue
+                yield linha
+
+
+def restaurar_particao(mes: datetime, pasta: Path) -> int:
+    """
+    Recria a partição de um mês arquivado e recarrega o arquivo nela (as linhas
+    voltam com os ids originais). Os arquivos ficam na pasta; arquivar o mês de
+    novo exige removê-los antes. Devolve as linhas restauradas.
+    """
+    nome = _nome_particao(mes)
+    manifesto = _ler_manifesto(pasta, nome)
+    caminho_csv, _ = _caminhos_arquivo(pasta, nome)
+
+    with get_connection() as conn, conn.cursor() as cursor:
+        try:
+            # Partição nova: as linhas que ela já tiver são gravações atrasadas,
+            # movidas da partição padrão. Partição existente com linhas: o mês
+            # já foi restaurado.
+            cursor.execute("SELECT desvios_log_criar_particao(%s)", (mes.date(),))
+            criada = cursor.fetchone()[0] is not None
+            cursor.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(sql.Identifier(nome)))
+            if not criada and cursor.fetchone()[0]:
+                raise RuntimeError(f"{nome} já tem linhas no banco; restaurar duplicaria o histórico")
+
+            with gzip.open(caminho_csv, "rb") as arquivo:
+                cursor.copy_expert(
+                    sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, HEADER)")
+                    .format(sql.Identifier(nome), sql.SQL(", ").join(map(sql.Identifier, manifesto["colunas"])))
+                    .as_string(conn),
+                    arquivo,
+                )
+            restauradas = cursor.rowcount
+            if restauradas != manifesto["linhas"]:
+                raise RuntimeError(f"{nome}: {restauradas} linha(s) lidas, manifesto indica {manifesto['linhas']}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return restauradas
+
+
+def comando_log(args) -> int:
+    pasta = Path(args.pasta)
+
+    if args.acao == "particoes":
+        criadas = garantir_particoes(args.meses) + acomodar_linhas_sem_particao(pasta)
+        print(f"{len(criadas)} partição(ões) criada(s){': ' + ', '.join(criadas) if criadas else '.'}")
+        for p in listar_particoes():
+            print(f"  {p['nome']:<22} {p['limites']}  ~{p['linhas_estimadas']} linha(s)")
+        pendentes = linhas_sem_particao()
+        if pendentes:
+            print("Linhas na partição padrão (sem data ou de meses arquivados):")
+            for mes, total in pendentes:
+                print(f"  {mes or 'sem data'}: {total}")
+            print("Os meses arquivados recebem essas linhas com 'log restaurar AAAA-MM'.")
+        return 0
+
+    if args.acao == "arquivar":
+        if not args.antes:
+            print("Informe --antes AAAA-MM (meses anteriores a ele são arquivados).")
+            return 2
+        corte = _mes(args.antes)
+        if corte > datetime.now(timezone.utc):
+            print("--antes não pode ser um mês futuro.")
+            return 2
+        alvo = [p for p in listar_particoes() if p["fim"] is not None and p["fim"] <= corte]
+        if not alvo:
+            print("Nenhuma partição anterior ao corte.")
+            return 0
+        for p in alvo:
+            linhas = arquivar_particao(p, pasta)
+            print(f"  {p['nome']}: {linhas} linha(s) arquivada(s) em {pasta}")
+        return 0
+
+    if args.acao == "restaurar":
+        if not args.meses_arquivados:
+            print("Informe os meses a restaurar (AAAA-MM).")
+            return 2
+        for texto in args.meses_arquivados:
+            mes = _mes(texto)
+            linhas = restaurar_particao(mes, pasta)
+            print(f"  {_nome_particao(mes)}: {linhas} linha(s) restaurada(s)")
+        return 0
+
+    # consultar
+    if args.desvio is None and args.estudo is None:
+        arquivados = listar_arquivados(pasta)
+        if not arquivados:
+            print(f"Nenhum mês arquivado em {pasta}.")
+        for m in arquivados:
+            print(f"  {m['particao']}: {m['linhas']} linha(s), arquivado em {m['arquivado_em']}")
+        return 0
+    meses = [_nome_particao(_mes(t)) for t in args.meses_arquivados] or None
+    escritor = csv.writer(sys.stdout)
+    total = 0
+    for linha in consultar_arquivados(pasta, args.desvio, args.estudo, meses):
+        if total == 0:
+            escritor.writerow(linha.keys())
+        escritor.writerow(linha.values())
+        total += 1
+    print(f"{total} linha(s) encontrada(s) no arquivo.", file=sys.stderr)
+    return 0
+
+
+# =========================
+# Exportação de Estudo
+# =========================
+
+def comando_exportar(args) -> int:
+    saida = Path(args.saida or f"estudo_{args.estudo}_{args.formato}_{args.idioma}_{datetime.now():%Y%m%d_%H%M%S}.zip")
+    try:
+        linhas = exportar_estudo(saida, args.estudo, args.formato, args.idioma)
+    except BaseException:
+        saida.unlink(missing_ok=True)
+        raise
+    for nome, total in linhas.items():
+        print(f"  {nome}.{args.formato}: {total} linha(s)")
+    print(f"Exportação gravada em {saida} ({saida.stat().st_size / 1024 / 1024:.1f} MB).")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Manutenção do banco do portal do gerente médico")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    p_migracoes = subparsers.add_parser("migracoes", help="migrações versionadas da pasta sql/")
+    p_migracoes.add_argument("acao", choices=["status", "aplicar"])
+    p_migracoes.set_defaults(executar=comando_migracoes)
+
+    p_planos = subparsers.add_parser("planos", help="confere se as consultas críticas usam índices")
+    p_planos.add_argument("acao", choices=["verificar"])
+    p_planos.add_argument("--estudo", type=int, help="estudo usado nos parâmetros das consultas")
+    p_planos.add_argument("--email", help="email de gerente usado nos parâmetros das consultas")
+    p_planos.set_defaults(executar=comando_planos)
+
+    p_contadores = subparsers.add_parser("contadores", help="contagem de desvios por estudo e status")
+    p_contadores.add_argument("acao", choices=["verificar", "reconstruir"])
+    p_contadores.add_argument("--estudo", type=int, help="restringe a um estudo")
+    p_contadores.set_defaults(executar=comando_contadores)
+
+    p_log = subparsers.add_parser("log", help="partições e arquivamento do histórico desvios_log")
+    p_log.add_argument("acao", choices=["particoes", "arquivar", "consultar", "restaurar"])
+    p_log.add_argument("meses_arquivados", nargs="*", metavar="AAAA-MM",
+                       help="meses a restaurar (restaurar) ou a ler (consultar)")
+    p_log.add_argument("--meses", type=int, default=3, help="partições futuras a garantir (particoes)")
+    p_log.add_argument("--antes", help="arquiva os meses anteriores a AAAA-MM (arquivar)")
+    p_log.add_argument("--desvio", type=int, help="filtra o histórico arquivado por desvio (consultar)")
+    p_log.add_argument("--estudo", type=int, help="filtra o histórico arquivado por estudo (consultar)")
+    p_log.add_argument("--pasta", default=str(PASTA_ARQUIVO_LOG), help="pasta dos arquivos .csv.gz")
+    p_log.set_defaults(executar=comando_log)
+
+    p_exportar = subparsers.add_parser("exportar", help="exporta desvios e histórico de um estudo (ZIP)")
+    p_exportar.add_argument("--estudo", type=int, required=True)
+    p_exportar.add_argument("--formato", choices=FORMATOS_EXPORTACAO, default="csv")
+    p_exportar.add_argument("--idioma", choices=["pt", "en"], default="pt", help="idioma dos campos traduzidos")
+    p_exportar.add_argument("--saida", help="arquivo .zip de destino")
+    p_exportar.set_defaults(executar=comando_exportar)
+
+    args = parser.parse_args()
+    return args.executar(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+-- Outbox de notificações do portal do gerente médico.
+-- As linhas são gravadas na mesma transação do UPDATE em desvios
+-- (salvar_avaliacao) e consumidas pelo worker_notificacoes.py.
+
+CREATE TABLE IF NOT EXISTS notificacoes_outbox (
+    id             BIGSERIAL PRIMARY KEY,
+    tipo           TEXT        NOT NULL,
+    estudo_id      INTEGER     NOT NULL,
+    desvio_id      INTEGER,
+    payload        JSONB       NOT NULL,
+    status         TEXT        NOT NULL DEFAULT 'pendente',  -- pendente | enviado | falhou
+    tentativas     INTEGER     NOT NULL DEFAULT 0,
+    disponivel_em  TIMESTAMPTZ NOT NULL DEFAULT NOW(),       -- próxima tentativa / fim do lease
+    ultimo_erro    TEXT,
+    criado_em      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    enviado_em     TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS ix_notificacoes_outbox_pendentes
+    ON notificacoes_outbox (disponivel_em, id)
+    WHERE status = 'pendente';
@@ -0,0 +1,84 @@
+-- Contagem de desvios por estudo e status, mantida por trigger.
+-- A tela de seleção de estudos lê poucas linhas por estudo daqui em vez de
+-- agrupar todo o histórico de desvios. Só entram desvios ativos
+-- (deleted_at IS NULL) com status preenchido, como no COUNT original.
+-- Conferência/reconstrução: python manutencao_banco.py contadores verificar|reconstruir
+-- Aplicar com: python manutencao_banco.py migracoes aplicar (ou psql -1 -f ...).
+
+CREATE TABLE IF NOT EXISTS desvios_contagem (
+    estudo_id  INTEGER NOT NULL,
+    status     TEXT    NOT NULL,
+    total      BIGINT  NOT NULL DEFAULT 0,
+    PRIMARY KEY (estudo_id, status)
+);
+
+CREATE OR REPLACE FUNCTION desvios_contagem_ajustar(p_estudo_id INTEGER, p_status TEXT, p_delta INTEGER)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF p_estudo_id IS NULL OR p_status IS NULL OR p_delta = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO desvios_contagem (estudo_id, status, total)
+    VALUES (p_estudo_id, p_status, p_delta)
+    ON CONFLICT (estudo_id, status)
+    DO UPDATE SET total = desvios_contagem.total + EXCLUDED.total;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION desvios_contagem_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.estudo_id IS NOT DISTINCT FROM NEW.estudo_id
+       AND OLD.status IS NOT DISTINCT FROM NEW.status
+       AND (OLD.deleted_at IS NULL) = (NEW.deleted_at IS NULL) THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.deleted_at IS NULL THEN
+        PERFORM desvios_contagem_ajustar(OLD.estudo_id, OLD.status, -1);
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.deleted_at IS NULL THEN
+        PERFORM desvios_contagem_ajustar(NEW.estudo_id, NEW.status, 1);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+-- Reconstrói a contagem a partir de desvios (todos os estudos ou apenas um).
+-- O lock SHARE bloqueia escritas em desvios durante a reconstrução.
+CREATE OR REPLACE FUNCTION desvios_contagem_reconstruir(p_estudo_id INTEGER DEFAULT NULL)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    LOCK TABLE desvios IN SHARE MODE;
+
+    DELETE FROM desvios_contagem
+    WHERE p_estudo_id IS NULL OR estudo_id = p_estudo_id;
+
+    INSERT INTO desvios_contagem (estudo_id, status, total)
+    SELECT estudo_id, status, COUNT(*)
+    FROM desvios
+    WHERE deleted_at IS NULL
+      AND status IS NOT NULL
+      AND estudo_id IS NOT NULL
+      AND (p_estudo_id IS NULL OR estudo_id = p_estudo_id)
+    GROUP BY estudo_id, status;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_desvios_contagem ON desvios;
+CREATE TRIGGER trg_desvios_contagem
+    AFTER INSERT OR DELETE OR UPDATE OF estudo_id, status, deleted_at ON desvios
+    FOR EACH ROW EXECUTE FUNCTION desvios_contagem_trigger();
+
+-- Carga inicial (na mesma transação do trigger, sob lock, para não perder escritas)
+SELECT desvios_contagem_reconstruir();
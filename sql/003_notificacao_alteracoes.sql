@@ -0,0 +1,35 @@
+-- Publica o id do estudo no canal 'desvios_alterados' a cada escrita em
+-- desvios e desvios_log, venha ela deste portal ou do portal interno.
+-- Cada processo do portal escuta o canal (OuvinteAlteracoes em externos.py)
+-- e descarta do cache apenas as consultas daquele estudo.
+-- O PostgreSQL entrega as notificações no COMMIT e junta payloads repetidos
+-- da mesma transação, então um lote de alterações gera um aviso por estudo.
+-- Aplicar com: python manutencao_banco.py migracoes aplicar (ou psql -1 -f ...).
+
+CREATE OR REPLACE FUNCTION notificar_alteracao_estudo()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.estudo_id IS NOT NULL THEN
+        PERFORM pg_notify('desvios_alterados', NEW.estudo_id::text);
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.estudo_id IS NOT NULL
+       AND (TG_OP = 'DELETE' OR OLD.estudo_id IS DISTINCT FROM NEW.estudo_id) THEN
+        PERFORM pg_notify('desvios_alterados', OLD.estudo_id::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_desvios_notificar ON desvios;
+CREATE TRIGGER trg_desvios_notificar
+    AFTER INSERT OR UPDATE OR DELETE ON desvios
+    FOR EACH ROW EXECUTE FUNCTION notificar_alteracao_estudo();
+
+DROP TRIGGER IF EXISTS trg_desvios_log_notificar ON desvios_log;
+CREATE TRIGGER trg_desvios_log_notificar
+    AFTER INSERT OR UPDATE OR DELETE ON desvios_log
+    FOR EACH ROW EXECUTE FUNCTION notificar_alteracao_estudo();
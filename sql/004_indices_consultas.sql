@@ -0,0 +1,35 @@
+-- migracao: sem-transacao
+-- Índices para os caminhos de acesso mais frequentes do portal.
+-- CREATE INDEX CONCURRENTLY não bloqueia escritas, mas não roda dentro de
+-- uma transação: aplicar com 'python manutencao_banco.py migracoes aplicar'
+-- (ou psql sem -1). Se a criação for interrompida o índice fica INVALID;
+-- 'migracoes aplicar' o remove e recria na execução seguinte.
+-- Conferência dos planos: python manutencao_banco.py planos verificar
+
+-- Login e telas de estudos: WHERE LOWER(gm.email) = LOWER(%s)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_gerentes_medicos_email_lower
+    ON gerentes_medicos (LOWER(email));
+
+-- Estudos do gerente (join gerentes_medicos -> estudo_gerente_medico)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_estudo_gerente_medico_gerente
+    ON estudo_gerente_medico (gerente_medico_id, estudo_id);
+
+-- Lista de desvios (filtro "Todos" e "Todos" sem paginação):
+-- WHERE estudo_id = %s AND deleted_at IS NULL ORDER BY numero_desvio_estudo DESC, id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_desvios_estudo_numero
+    ON desvios (estudo_id, numero_desvio_estudo DESC, id DESC)
+    WHERE deleted_at IS NULL;
+
+-- Lista de desvios, filtro padrão "Pendentes" (AND status != 'Avaliado')
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_desvios_estudo_pendentes
+    ON desvios (estudo_id, numero_desvio_estudo DESC, id DESC)
+    WHERE deleted_at IS NULL AND status != 'Avaliado';
+
+-- Lista de desvios filtrada por um status específico (AND status = %s)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_desvios_estudo_status_numero
+    ON desvios (estudo_id, status, numero_desvio_estudo DESC, id DESC)
+    WHERE deleted_at IS NULL;
+
+-- Destinatários das notificações: WHERE estudo_id = %s
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_estudo_monitores_estudo
+    ON estudo_monitores (estudo_id);
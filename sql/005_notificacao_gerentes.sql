@@ -0,0 +1,42 @@
+-- Publica o id do gerente no canal 'gerentes_alterados' quando o cadastro
+-- dele (gerentes_medicos) ou suas alocações (estudo_gerente_medico) mudam.
+-- O diretório de gerentes em memória (DiretorioGerentes em externos.py)
+-- recarrega apenas aquele gerente e descarta a lista de estudos dele.
+-- Aplicar com: python manutencao_banco.py migracoes aplicar (ou psql -1 -f ...).
+
+CREATE OR REPLACE FUNCTION notificar_alteracao_gerente()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    novo_id INTEGER;
+    antigo_id INTEGER;
+BEGIN
+    IF TG_TABLE_NAME = 'gerentes_medicos' THEN
+        IF TG_OP <> 'DELETE' THEN novo_id := NEW.id; END IF;
+        IF TG_OP <> 'INSERT' THEN antigo_id := OLD.id; END IF;
+    ELSE
+        IF TG_OP <> 'DELETE' THEN novo_id := NEW.gerente_medico_id; END IF;
+        IF TG_OP <> 'INSERT' THEN antigo_id := OLD.gerente_medico_id; END IF;
+    END IF;
+
+    IF novo_id IS NOT NULL THEN
+        PERFORM pg_notify('gerentes_alterados', novo_id::text);
+    END IF;
+    IF antigo_id IS NOT NULL AND antigo_id IS DISTINCT FROM novo_id THEN
+        PERFORM pg_notify('gerentes_alterados', antigo_id::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_gerentes_medicos_notificar ON gerentes_medicos;
+CREATE TRIGGER trg_gerentes_medicos_notificar
+    AFTER INSERT OR UPDATE OR DELETE ON gerentes_medicos
+    FOR EACH ROW EXECUTE FUNCTION notificar_alteracao_gerente();
+
+DROP TRIGGER IF EXISTS trg_estudo_gerente_medico_notificar ON estudo_gerente_medico;
+CREATE TRIGGER trg_estudo_gerente_medico_notificar
+    AFTER INSERT OR UPDATE OR DELETE ON estudo_gerente_medico
+    FOR EACH ROW EXECUTE FUNCTION notificar_alteracao_gerente();
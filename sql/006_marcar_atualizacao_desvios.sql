@@ -0,0 +1,28 @@
+-- Atualização incremental da lista de desvios (carregar_snapshot_desvios em
+-- externos.py): o portal guarda, por estudo, a maior data_atualizacao /
+-- deleted_at já lida e depois busca só as linhas alteradas desde então.
+-- Para isso toda escrita precisa mover data_atualizacao: o trigger abaixo
+-- preenche NOW() quando quem escreve não informa um valor novo (portal
+-- interno, correções manuais). Exclusões físicas e trocas de estudo são
+-- detectadas pelo portal comparando o resultado com desvios_contagem.
+-- Índices da consulta incremental: 007_indices_delta_desvios.sql.
+-- Aplicar com: python manutencao_banco.py migracoes aplicar (ou psql -1 -f ...).
+
+CREATE OR REPLACE FUNCTION desvios_marcar_atualizacao()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        NEW.data_atualizacao := COALESCE(NEW.data_atualizacao, NOW());
+    ELSIF NEW.data_atualizacao IS NOT DISTINCT FROM OLD.data_atualizacao THEN
+        NEW.data_atualizacao := NOW();
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_desvios_marcar_atualizacao ON desvios;
+CREATE TRIGGER trg_desvios_marcar_atualizacao
+    BEFORE INSERT OR UPDATE ON desvios
+    FOR EACH ROW EXECUTE FUNCTION desvios_marcar_atualizacao();
@@ -0,0 +1,12 @@
+-- migracao: sem-transacao
+-- Índices da atualização incremental da lista de desvios (ver 006).
+-- CREATE INDEX CONCURRENTLY: aplicar com 'python manutencao_banco.py migracoes aplicar'.
+
+-- Linhas alteradas desde a marca d'água: WHERE estudo_id = %s AND data_atualizacao >= %s
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_desvios_estudo_atualizacao
+    ON desvios (estudo_id, data_atualizacao);
+
+-- Exclusões lógicas desde a marca d'água: OR deleted_at >= %s
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_desvios_estudo_excluidos
+    ON desvios (estudo_id, deleted_at)
+    WHERE deleted_at IS NOT NULL;
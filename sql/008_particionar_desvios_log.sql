@@ -0,0 +1,147 @@
+-- Particiona desvios_log por mês de data_alteracao (PARTITION BY RANGE).
+-- O histórico de auditoria não pode ser apagado, então a tabela só cresce:
+-- com partições mensais, inserções e consultas por período tocam só os meses
+-- envolvidos, o vacuum trabalha em tabelas pequenas e os meses antigos podem
+-- ser arquivados em arquivos compactados e removidos do banco
+-- ('python manutencao_banco.py log arquivar').
+--
+-- Partições: desvios_log_AAAAMM cobre [1º dia do mês, 1º dia do mês seguinte)
+-- em UTC. desvios_log_padrao (DEFAULT) recebe o que não tiver partição (datas
+-- nulas, meses futuros não criados, meses já arquivados), então nenhuma
+-- gravação falha se a criação antecipada atrasar. Criar os próximos meses
+-- (agendar mensalmente, ex.: cron):
+--     python manutencao_banco.py log particoes [--meses 3]
+--
+-- A conversão copia as linhas existentes para a nova tabela dentro da
+-- transação da migração (desvios_log fica bloqueada durante a cópia). O id
+-- continua vindo da mesma sequência; a unicidade de id deixa de ser uma
+-- PRIMARY KEY (em tabela particionada a chave teria de incluir data_alteracao).
+-- Views ou chaves estrangeiras que apontem para desvios_log impedem o DROP da
+-- tabela antiga e abortam a migração sem alterar nada.
+-- Aplicar com: python manutencao_banco.py migracoes aplicar (ou psql -1 -f ...).
+
+CREATE OR REPLACE FUNCTION desvios_log_criar_particao(p_mes DATE)
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_mes    DATE        := date_trunc('month', p_mes)::date;
+    v_inicio TIMESTAMPTZ := v_mes::timestamp AT TIME ZONE 'UTC';
+    v_fim    TIMESTAMPTZ := (v_mes + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+    v_nome   TEXT        := 'desvios_log_' || to_char(v_mes, 'YYYYMM');
+BEGIN
+    IF to_regclass(v_nome) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE desvios_log INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        v_nome
+    );
+
+    -- Linhas do mês que caíram na partição padrão (mês criado com atraso ou
+    -- restaurado depois de arquivado) passam para a nova partição; senão o
+    -- ATTACH falharia.
+    IF to_regclass('desvios_log_padrao') IS NOT NULL THEN
+        EXECUTE format(
+            'WITH movidas AS (
+                 DELETE FROM desvios_log_padrao
+                 WHERE data_alteracao >= %L AND data_alteracao < %L
+                 RETURNING *
+             )
+             INSERT INTO %I SELECT * FROM movidas',
+            v_inicio, v_fim, v_nome
+        );
+    END IF;
+
+    EXECUTE format(
+        'ALTER TABLE desvios_log ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_nome, v_inicio, v_fim
+    );
+    RETURN v_nome;
+END;
+$$;
+
+-- Garante as partições do mês corrente e dos p_meses seguintes; devolve as criadas.
+CREATE OR REPLACE FUNCTION desvios_log_garantir_particoes(p_meses INTEGER DEFAULT 3)
+RETURNS SETOF TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_atual DATE := date_trunc('month', NOW() AT TIME ZONE 'UTC')::date;
+    v_nome  TEXT;
+BEGIN
+    FOR i IN 0..GREATEST(p_meses, 0) LOOP
+        v_nome := desvios_log_criar_particao((v_atual + make_interval(months => i))::date);
+        IF v_nome IS NOT NULL THEN
+            RETURN NEXT v_nome;
+        END IF;
+    END LOOP;
+END;
+$$;
+
+DO $$
+DECLARE
+    v_mes       DATE;
+    v_ultimo    DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '3 months')::date;
+    v_sequencia TEXT;
+    v_grant     RECORD;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'desvios_log'::regclass) = 'p' THEN
+        RETURN;  -- já particionada
+    END IF;
+
+    ALTER TABLE desvios_log RENAME TO desvios_log_legado;
+
+    CREATE TABLE desvios_log (
+        LIKE desvios_log_legado INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMMENTS
+    ) PARTITION BY RANGE (data_alteracao);
+
+    CREATE TABLE desvios_log_padrao PARTITION OF desvios_log DEFAULT;
+
+    -- Uma partição por mês desde a linha mais antiga, para a cópia já cair no
+    -- lugar certo (sem passar pela partição padrão).
+    SELECT date_trunc('month', MIN(data_alteracao) AT TIME ZONE 'UTC')::date
+      INTO v_mes
+      FROM desvios_log_legado;
+    v_mes := LEAST(COALESCE(v_mes, v_ultimo), v_ultimo);
+    WHILE v_mes <= v_ultimo LOOP
+        PERFORM desvios_log_criar_particao(v_mes);
+        v_mes := (v_mes + INTERVAL '1 month')::date;
+    END LOOP;
+
+    INSERT INTO desvios_log SELECT * FROM desvios_log_legado;
+
+    -- A sequência do SERIAL pertence à coluna antiga e seria apagada com ela.
+    v_sequencia := pg_get_serial_sequence('desvios_log_legado', 'id');
+    IF v_sequencia IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY desvios_log.id', v_sequencia);
+    END IF;
+
+    FOR v_grant IN
+        SELECT grantee, privilege_type
+        FROM information_schema.role_table_grants
+        WHERE table_schema = current_schema() AND table_name = 'desvios_log_legado'
+          AND grantee <> current_user
+    LOOP
+        EXECUTE format(
+            'GRANT %s ON desvios_log TO %s',
+            v_grant.privilege_type,
+            CASE WHEN v_grant.grantee = 'PUBLIC' THEN 'PUBLIC' ELSE quote_ident(v_grant.grantee) END
+        );
+    END LOOP;
+
+    DROP TABLE desvios_log_legado;
+END;
+$$;
+
+-- Histórico de um desvio (e do estudo) por período; criado em cada partição.
+CREATE INDEX IF NOT EXISTS ix_desvios_log_desvio ON desvios_log (desvio_id, data_alteracao);
+CREATE INDEX IF NOT EXISTS ix_desvios_log_estudo ON desvios_log (estudo_id, data_alteracao);
+CREATE INDEX IF NOT EXISTS ix_desvios_log_id ON desvios_log (id);
+
+-- Recria o gatilho da 003 na tabela nova (vale para todas as partições).
+DROP TRIGGER IF EXISTS trg_desvios_log_notificar ON desvios_log;
+CREATE TRIGGER trg_desvios_log_notificar
+    AFTER INSERT OR UPDATE OR DELETE ON desvios_log
+    FOR EACH ROW EXECUTE FUNCTION notificar_alteracao_estudo();
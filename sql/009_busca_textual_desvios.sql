@@ -0,0 +1,28 @@
+-- Busca textual nos campos narrativos dos desvios (buscar_desvios em externos.py).
+-- Os textos não são traduzidos e cada estudo escreve no seu idioma, então há
+-- um vetor por configuração (portuguese e english) e a busca consulta os dois.
+-- Pesos: descrição (A), motivo e causa raiz (B), ações corretiva e preventiva
+-- (C), observação (D).
+--
+-- Colunas geradas (STORED): o PostgreSQL recalcula os vetores em toda escrita,
+-- venha ela deste portal ou do portal interno. O ADD COLUMN reescreve a tabela
+-- desvios com bloqueio exclusivo (segundos em algumas centenas de milhares de
+-- linhas); a reescrita não dispara os gatilhos, então não move
+-- data_atualizacao nem gera avisos. Escritas em desvios precisam listar as
+-- colunas (INSERT ... SELECT * de outra tabela falharia).
+-- Índices GIN: 010_indices_busca_desvios.sql.
+-- Aplicar com: python manutencao_banco.py migracoes aplicar (ou psql -1 -f ...).
+
+ALTER TABLE desvios
+    ADD COLUMN IF NOT EXISTS busca_pt tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('portuguese'::regconfig, COALESCE(descricao_desvio, '')), 'A')
+        || setweight(to_tsvector('portuguese'::regconfig, COALESCE(motivo, '') || ' ' || COALESCE(causa_raiz, '')), 'B')
+        || setweight(to_tsvector('portuguese'::regconfig, COALESCE(acao_corretiva, '') || ' ' || COALESCE(acao_preventiva, '')), 'C')
+        || setweight(to_tsvector('portuguese'::regconfig, COALESCE(observacao, '')), 'D')
+    ) STORED,
+    ADD COLUMN IF NOT EXISTS busca_en tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english'::regconfig, COALESCE(descricao_desvio, '')), 'A')
+        || setweight(to_tsvector('english'::regconfig, COALESCE(motivo, '') || ' ' || COALESCE(causa_raiz, '')), 'B')
+        || setweight(to_tsvector('english'::regconfig, COALESCE(acao_corretiva, '') || ' ' || COALESCE(acao_preventiva, '')), 'C')
+        || setweight(to_tsvector('english'::regconfig, COALESCE(observacao, '')), 'D')
+    ) STORED;
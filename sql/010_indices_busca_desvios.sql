@@ -0,0 +1,10 @@
+-- migracao: sem-transacao
+-- Índices GIN da busca textual (colunas de 009_busca_textual_desvios.sql).
+-- CREATE INDEX CONCURRENTLY: aplicar com 'python manutencao_banco.py migracoes aplicar'.
+
+-- WHERE busca_pt @@ websearch_to_tsquery('portuguese', %s) OR busca_en @@ ... (BitmapOr)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_desvios_busca_pt
+    ON desvios USING GIN (busca_pt);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_desvios_busca_en
+    ON desvios USING GIN (busca_en);
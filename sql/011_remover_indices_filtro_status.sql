@@ -0,0 +1,15 @@
+-- migracao: sem-transacao
+-- Remove os índices parciais da 004 para os filtros de status da lista de
+-- desvios. Desde que a lista passou a ser recortada em memória do snapshot
+-- do estudo (montar_consulta_snapshot: WHERE estudo_id = %s AND deleted_at IS
+-- NULL ORDER BY numero_desvio_estudo DESC, id DESC, atendida por
+-- ix_desvios_estudo_numero), nenhuma consulta usa esses predicados, e os
+-- dois índices só encareciam as gravações em desvios.
+-- DROP INDEX CONCURRENTLY não bloqueia leituras nem escritas: aplicar com
+-- 'python manutencao_banco.py migracoes aplicar' (ou psql sem -1).
+
+-- Filtro "Pendentes" (AND status != 'Avaliado')
+DROP INDEX CONCURRENTLY IF EXISTS ix_desvios_estudo_pendentes;
+
+-- Filtro por um status específico (AND status = %s)
+DROP INDEX CONCURRENTLY IF EXISTS ix_desvios_estudo_status_numero;
@@ -0,0 +1,9 @@
+"""
+Testes das partes do portal que não dependem do PostgreSQL nem de uma sessão
+do Streamlit: rodar com 'python -m pytest' na raiz do repositório.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
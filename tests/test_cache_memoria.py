@@ -0,0 +1,98 @@
+"""CacheMemoria: LRU única entre funções, max_entries, orçamento de memória e TTL"""
+
+import sys
+
+import externos
+from externos import CacheMemoria, tamanho_em_bytes
+
+VALOR = "x" * 1000
+
+
+def tamanho(chave=1, valor=VALOR):
+    """Bytes contabilizados por uma entrada (valor + chave), como em CacheMemoria.guardar"""
+    return tamanho_em_bytes(valor) + sys.getsizeof(chave)
+
+
+def chaves(cache, funcao):
+    return sorted(k for f, k in cache._entradas if f == funcao)
+
+
+def test_guarda_e_obtem():
+    cache = CacheMemoria(10 * tamanho())
+
+    assert cache.obter("f", 1) == (False, None)
+    cache.guardar("f", 1, VALOR)
+
+    assert cache.obter("f", 1) == (True, VALOR)
+    assert cache.relatorio()["funcoes"] == {"f": {"entradas": 1, "bytes": tamanho()}}
+
+
+def test_orcamento_despeja_a_menos_usada_de_qualquer_funcao():
+    cache = CacheMemoria(3 * tamanho())
+    cache.guardar("a", 1, VALOR)
+    cache.guardar("b", 2, VALOR)
+    cache.guardar("a", 3, VALOR)
+    cache.obter("a", 1)  # "b"/2 passa a ser a menos usada
+
+    cache.guardar("c", 4, VALOR)
+
+    assert cache.obter("b", 2) == (False, None)
+    assert chaves(cache, "a") == [1, 3] and chaves(cache, "c") == [4]
+    assert cache.total_bytes == 3 * tamanho() <= cache.orcamento_bytes
+
+
+def test_max_entries_despeja_so_da_propria_funcao():
+    cache = CacheMemoria(100 * tamanho())
+    cache.guardar("outra", 0, VALOR)
+    for chave in (1, 2, 3):
+        cache.guardar("f", chave, VALOR, max_entries=2)
+
+    assert chaves(cache, "f") == [2, 3]
+    assert chaves(cache, "outra") == [0]
+    assert cache.relatorio()["funcoes"]["f"]["entradas"] == 2
+
+
+def test_regravar_a_mesma_chave_nao_duplica_o_tamanho():
+    cache = CacheMemoria(10 * tamanho())
+    cache.guardar("f", 1, VALOR)
+    cache.guardar("f", 1, "y" * 1000)
+
+    assert cache.obter("f", 1) == (True, "y" * 1000)
+    assert cache.total_bytes == tamanho(valor="y" * 1000)
+
+
+def test_entrada_maior_que_o_orcamento_nao_e_guardada():
+    cache = CacheMemoria(3 * tamanho())
+    cache.guardar("f", 1, VALOR)
+    cache.guardar("f", 2, VALOR)
+
+    cache.guardar("f", 3, "x" * (4 * len(VALOR)))
+
+    # Não entra e não despeja as que já estavam
+    assert cache.obter("f", 3) == (False, None)
+    assert chaves(cache, "f") == [1, 2]
+
+
+def test_entrada_expirada(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(externos.time, "monotonic", lambda: agora[0])
+    cache = CacheMemoria(10 * tamanho())
+    cache.guardar("f", 1, VALOR, ttl=60)
+
+    agora[0] += 59
+    assert cache.obter("f", 1) == (True, VALOR)
+    agora[0] += 2
+    assert cache.obter("f", 1) == (False, None)
+    assert cache.total_bytes == 0
+
+
+def test_limpar_uma_funcao():
+    cache = CacheMemoria(10 * tamanho())
+    cache.guardar("a", 1, VALOR)
+    cache.guardar("b", 1, VALOR)
+
+    cache.limpar("a")
+
+    assert chaves(cache, "a") == [] and chaves(cache, "b") == [1]
+    assert cache.total_bytes == tamanho()
+
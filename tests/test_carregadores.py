@@ -0,0 +1,83 @@
+"""Erros de banco nos carregadores com cache: se propagam e não ficam guardados"""
+
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+import externos
+from externos import CacheMemoria
+
+
+class CursorFalso:
+    def __init__(self, linhas):
+        self._linhas = linhas
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return self._linhas
+
+    def fetchone(self):
+        return self._linhas[0] if self._linhas else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    """banco.linhas: resultado das consultas; banco.fora_do_ar: get_connection falha"""
+    estado = type("Banco", (), {"linhas": [], "fora_do_ar": False})()
+
+    class ConexaoFalsa:
+        def cursor(self, *args, **kwargs):
+            return CursorFalso(estado.linhas)
+
+    @contextmanager
+    def conexao(leitura=False):
+        if estado.fora_do_ar:
+            raise psycopg2.OperationalError("servidor fora do ar")
+        yield ConexaoFalsa()
+
+    monkeypatch.setattr(externos, "get_connection", conexao)
+    cache = CacheMemoria(10 * 1024 * 1024)
+    monkeypatch.setattr(externos, "get_cache_memoria", lambda: cache)
+    return estado
+
+
+ESTUDOS = [{"id": 7, "codigo": "E7", "nome": "Estudo", "pendentes": 2}]
+METRICAS = {"total_estudos": 1, "total_pendentes": 2, "estudos_com_pendencia": 1}
+DETALHE = {"id": 3, "status": "Novo", "row_version": "100"}
+
+
+@pytest.mark.parametrize("carregar, argumentos, linhas, esperado", [
+    (externos.carregar_estudos_do_gerente, (1, 0), ESTUDOS, ESTUDOS),
+    (externos.carregar_metricas_gerente, (1, 0), [METRICAS], METRICAS),
+    (externos.carregar_detalhe_desvio, (3, "100"), [DETALHE], DETALHE),
+])
+def test_falha_se_propaga_e_nao_fica_no_cache(banco, carregar, argumentos, linhas, esperado):
+    banco.fora_do_ar = True
+    with pytest.raises(psycopg2.OperationalError):
+        carregar(*argumentos)
+
+    # Na próxima chamada, com o banco de volta, a consulta é refeita
+    banco.fora_do_ar = False
+    banco.linhas = linhas
+    assert carregar(*argumentos) == esperado
+
+
+def test_falha_do_snapshot_nao_vira_lista_vazia(banco, monkeypatch):
+    def fora_do_ar(*args, **kwargs):
+        raise psycopg2.OperationalError("réplica fora do ar")
+
+    monkeypatch.setattr(externos, "carregar_snapshot_completo", fora_do_ar)
+
+    # Uma lista vazia apareceria na tela como "nenhum desvio pendente"
+    with pytest.raises(psycopg2.OperationalError):
+        externos.carregar_pagina_desvios(5, "Pendentes")
+    assert externos.get_cache_memoria().obter("carregar_snapshot_desvios", (5, "pt")) == (False, None)
@@ -0,0 +1,98 @@
+"""Paginação por chave (numero_desvio_estudo, id) da lista de desvios, recortada do snapshot"""
+
+import pandas as pd
+import pytest
+
+import externos
+from externos import carregar_pagina_desvios, cursor_pagina
+
+
+def snapshot(numeros, status=None):
+    """Snapshot na ordem de _ordenar_snapshot; o id é a posição + 1"""
+    desvios = pd.DataFrame({
+        "id": range(1, len(numeros) + 1),
+        "numero_desvio_estudo": numeros,
+        "status": status or ["Novo"] * len(numeros),
+    })
+    return externos._ordenar_snapshot(desvios)
+
+
+@pytest.fixture
+def usar_snapshot(monkeypatch):
+    def usar(desvios):
+        monkeypatch.setattr(externos, "carregar_snapshot_desvios", lambda *args, **kwargs: desvios)
+    return usar
+
+
+def percorrer(estudo_id, filtro, tamanho):
+    """Todas as páginas, da primeira à última, seguindo o cursor da última linha"""
+    paginas, cursor = [], None
+    while True:
+        resultado = carregar_pagina_desvios(estudo_id, filtro, tamanho, cursor)
+        paginas.append(resultado)
+        if not resultado["tem_proxima"]:
+            return paginas
+        cursor = cursor_pagina(resultado["desvios"].iloc[-1])
+
+
+def test_paginas_seguem_a_ordem_do_snapshot(usar_snapshot):
+    desvios = snapshot(list(range(1, 24)))
+    usar_snapshot(desvios)
+
+    paginas = percorrer(1, "Todos", 5)
+
+    assert [len(p["desvios"]) for p in paginas] == [5, 5, 5, 5, 3]
+    ids = [i for p in paginas for i in p["desvios"]["id"]]
+    assert ids == list(desvios["id"])
+    assert not paginas[0]["tem_anterior"] and paginas[-1]["tem_anterior"]
+
+
+def test_pagina_anterior_volta_para_as_mesmas_linhas(usar_snapshot):
+    usar_snapshot(snapshot(list(range(1, 24))))
+    paginas = percorrer(1, "Todos", 5)
+
+    for anterior, atual in zip(paginas, paginas[1:]):
+        voltou = carregar_pagina_desvios(1, "Todos", 5, cursor_pagina(atual["desvios"].iloc[0]), "anterior")
+        assert list(voltou["desvios"]["id"]) == list(anterior["desvios"]["id"])
+        assert voltou["tem_proxima"]
+
+
+def test_numeros_repetidos_desempatam_pelo_id(usar_snapshot):
+    usar_snapshot(snapshot([7, 7, 7, 7, 5, 5, 3]))
+
+    paginas = percorrer(1, "Todos", 3)
+
+    ids = [i for p in paginas for i in p["desvios"]["id"]]
+    assert ids == [4, 3, 2, 1, 6, 5, 7]
+
+
+def test_filtro_pendentes_e_tamanho_zero(usar_snapshot):
+    usar_snapshot(snapshot([1, 2, 3, 4], status=["Novo", "Avaliado", "Modificado", "Avaliado"]))
+
+    resultado = carregar_pagina_desvios(1, "Pendentes", 0)
+
+    assert list(resultado["desvios"]["numero_desvio_estudo"]) == [3, 1]
+    assert not resultado["tem_anterior"] and not resultado["tem_proxima"]
+
+
+def test_cursor_de_numero_nulo():
+    linha = pd.Series({"id": 9, "numero_desvio_estudo": float("nan")})
+
+    assert cursor_pagina(linha) == (externos.NUMERO_SEM_VALOR, 9)
+    assert cursor_pagina(pd.Series({"id": 3, "numero_desvio_estudo": 12.0})) == (12, 3)
+
+
+def test_numeros_nulos_nas_duas_direcoes(usar_snapshot):
+    numeros = [None, 5, None, 4, 3, None, 2, 1, None]
+    desvios = snapshot(numeros)
+    usar_snapshot(desvios)
+    # Como no ORDER BY ... DESC do PostgreSQL, os NULLs vêm primeiro
+    assert desvios["numero_desvio_estudo"].iloc[:4].isna().all()
+
+    paginas = percorrer(1, "Todos", 2)
+
+    ids = [i for p in paginas for i in p["desvios"]["id"]]
+    assert ids == list(desvios["id"])
+    for anterior, atual in zip(paginas, paginas[1:]):
+        voltou = carregar_pagina_desvios(1, "Todos", 2, cursor_pagina(atual["desvios"].iloc[0]), "anterior")
+        assert list(voltou["desvios"]["id"]) == list(anterior["desvios"]["id"])
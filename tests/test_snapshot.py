@@ -0,0 +1,181 @@
+"""Atualização incremental do snapshot da lista de desvios (atualizar_snapshot e _juntar_compactos)"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+import externos
+from externos import _juntar_compactos, atualizar_snapshot, compactar_desvios
+
+Coluna = namedtuple("Coluna", "name")
+
+COLUNAS = [
+    "id", "numero_desvio_estudo", "status", "status_exibicao", "participante",
+    "centro", "visita", "importancia", "descricao_desvio", "row_version",
+]
+MARCA = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def desvio(i, status="Novo", versao="100", centro="Centro 1"):
+    return {
+        "id": i, "numero_desvio_estudo": i, "status": status, "status_exibicao": status,
+        "participante": f"P-{i}", "centro": centro, "visita": "V1", "importancia": "Maior",
+        "descricao_desvio": f"desvio {i}", "row_version": versao,
+    }
+
+
+def alteracao(i, status="Novo", versao="100", atualizado=MARCA, excluido=None, centro="Centro 1"):
+    return (*desvio(i, status, versao, centro).values(), atualizado, excluido)
+
+
+def snapshot_de(*desvios):
+    tabela = externos._ordenar_snapshot(pd.DataFrame(list(desvios), columns=COLUNAS))
+    return {"desvios": compactar_desvios(tabela), "marca_dagua": MARCA}
+
+
+class CursorFalso:
+    """Responde à consulta incremental e depois à de desvios_contagem"""
+
+    def __init__(self, alteradas, contagem):
+        self._respostas = [
+            (alteradas, COLUNAS + ["data_atualizacao", "deleted_at"]),
+            (list(contagem.items()), ["status", "total"]),
+        ]
+        self.consultas = []
+        self.description = None
+        self._linhas = []
+
+    def execute(self, query, params=None):
+        self.consultas.append((query, params))
+        self._linhas, colunas = self._respostas[len(self.consultas) - 1]
+        self.description = [Coluna(c) for c in colunas]
+
+    def fetchall(self):
+        return self._linhas
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    """banco(alteradas, contagem) faz get_connection devolver um cursor com essas respostas"""
+    def preparar(alteradas, contagem):
+        cursor = CursorFalso(alteradas, contagem)
+
+        class ConexaoFalsa:
+            def cursor(self, *args, **kwargs):
+                return cursor
+
+        @contextmanager
+        def conexao(leitura=False):
+            assert leitura, "a atualização incremental é uma leitura"
+            yield ConexaoFalsa()
+
+        monkeypatch.setattr(externos, "get_connection", conexao)
+        return cursor
+    return preparar
+
+
+def test_consulta_desde_a_marca_com_sobreposicao(banco):
+    cursor = banco([], {"Novo": 2})
+
+    novo = atualizar_snapshot(snapshot_de(desvio(1), desvio(2)), 5)
+
+    assert list(novo["desvios"]["id"]) == [2, 1]
+    assert novo["marca_dagua"] == MARCA
+    assert cursor.consultas[0][1][1:] == [MARCA - externos.SOBREPOSICAO_DELTA] * 2
+
+
+def test_linha_relida_na_mesma_versao_e_ignorada(banco):
+    anterior = snapshot_de(desvio(1), desvio(2))
+    banco([alteracao(2, status="Avaliado", versao="100")], {"Novo": 2})
+
+    novo = atualizar_snapshot(anterior, 5)
+
+    # Mesma versão (xmin): a linha da sobreposição não substitui a do snapshot
+    assert novo["desvios"] is anterior["desvios"]
+    assert set(novo["desvios"]["status"]) == {"Novo"}
+
+
+def test_linha_alterada_substitui_a_anterior_e_avanca_a_marca(banco):
+    depois = MARCA + timedelta(minutes=1)
+    banco([alteracao(2, status="Avaliado", versao="200", atualizado=depois)], {"Novo": 1, "Avaliado": 1})
+
+    novo = atualizar_snapshot(snapshot_de(desvio(1), desvio(2)), 5)
+
+    linha = novo["desvios"].set_index("id").loc[2]
+    assert (linha["status"], linha["row_version"]) == ("Avaliado", "200")
+    assert len(novo["desvios"]) == 2
+    assert novo["marca_dagua"] == depois
+
+
+def test_linha_excluida_sai_do_snapshot(banco):
+    excluido = MARCA + timedelta(minutes=2)
+    banco([alteracao(1, excluido=excluido)], {"Novo": 2})
+
+    novo = atualizar_snapshot(snapshot_de(desvio(1), desvio(2), desvio(3)), 5)
+
+    assert list(novo["desvios"]["id"]) == [3, 2]
+    assert novo["marca_dagua"] == excluido
+
+
+def test_exclusao_de_linha_desconhecida_nao_altera_o_snapshot(banco):
+    banco([alteracao(9, excluido=MARCA)], {"Novo": 1})
+    anterior = snapshot_de(desvio(1))
+
+    novo = atualizar_snapshot(anterior, 5)
+
+    assert list(novo["desvios"]["id"]) == [1]
+
+
+def test_linha_nova_entra_na_ordem(banco):
+    banco([alteracao(3, versao="300", centro="Centro 9")], {"Novo": 3})
+
+    novo = atualizar_snapshot(snapshot_de(desvio(1), desvio(2)), 5)
+
+    assert list(novo["desvios"]["id"]) == [3, 2, 1]
+    assert isinstance(novo["desvios"]["centro"].dtype, pd.CategoricalDtype)
+
+
+def test_contagem_divergente_pede_recarga_completa(banco):
+    # Ex.: exclusão física, que a consulta incremental não enxerga
+    banco([], {"Novo": 1})
+
+    assert atualizar_snapshot(snapshot_de(desvio(1), desvio(2)), 5) is None
+
+
+def test_sem_marca_dagua_pede_recarga_completa(banco):
+    cursor = banco([], {})
+
+    assert atualizar_snapshot({"desvios": pd.DataFrame(), "marca_dagua": None}, 5) is None
+    assert cursor.consultas == []
+
+
+def test_juntar_compactos_preserva_categorias():
+    compacto = compactar_desvios(pd.DataFrame([desvio(1), desvio(2, status="Avaliado")], columns=COLUNAS))
+    linhas = pd.DataFrame([desvio(3, status="Modificado", centro="Centro 7"), desvio(4)], columns=COLUNAS)
+
+    junto = _juntar_compactos(compacto, linhas)
+
+    assert list(junto["id"]) == [1, 2, 3, 4]
+    for coluna in externos.COLUNAS_CATEGORICAS:
+        assert isinstance(junto[coluna].dtype, pd.CategoricalDtype), coluna
+    assert set(junto["status"].cat.categories) == {"Novo", "Avaliado", "Modificado"}
+    assert list(junto["centro"]) == ["Centro 1", "Centro 1", "Centro 7", "Centro 1"]
+    # O snapshot guardado no cache não é alterado
+    assert set(compacto["status"].cat.categories) == {"Novo", "Avaliado"}
+
+
+def test_juntar_compactos_com_um_lado_vazio():
+    compacto = compactar_desvios(pd.DataFrame([desvio(1)], columns=COLUNAS))
+    vazio = pd.DataFrame(columns=COLUNAS)
+
+    assert _juntar_compactos(compacto, vazio) is compacto
+    assert list(_juntar_compactos(vazio, compacto)["id"]) == [1]
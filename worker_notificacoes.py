@@ -0,0 +1,380 @@
+"""
+Worker de Notificações do Portal do Gerente Médico
+Consome o outbox (tabela notificacoes_outbox) e envia os emails aos monitores.
+
+As notificações são gravadas pelo portal na mesma transação da avaliação, então
+nada se perde se o portal ou o worker caírem: uma notificação reservada e não
+confirmada volta para a fila quando o lease expira (entrega "pelo menos uma vez").
+
+Modos de envio:
+    imediato  um email por avaliação (ou lote do portal) assim que sai do outbox
+    resumo    as avaliações de cada estudo esperam `janela_resumo` segundos,
+              contados da mais antiga, e cada monitor recebe uma única mensagem
+              com todas elas; avaliações de desvios Major continuam imediatas
+
+Uso (na pasta do portal, para usar o mesmo .streamlit/secrets.toml):
+    python worker_notificacoes.py              # roda continuamente
+    python worker_notificacoes.py --uma-vez    # esvazia a fila e termina
+    python worker_notificacoes.py --modo resumo --janela-resumo 900
+
+Configuração opcional na seção [notificacoes] do secrets.toml:
+    concorrencia, lote, max_tentativas, backoff_base, backoff_max, lease, intervalo,
+    modo, janela_resumo,
+    porta_metricas (latência SMTP e mensagens enviadas/evitadas em
+    http://127.0.0.1:porta/metrics; 0 desliga)
+"""
+
+import argparse
+import logging
+from collections import defaultdict
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from psycopg2.extras import RealDictCursor
+
+from externos import (
+    NOTIFICACAO_AVALIACAO,
+    NOTIFICACAO_AVALIACAO_LOTE,
+    enviar_email_avaliacao,
+    enviar_email_avaliacoes_lote,
+    enviar_resumo_avaliacoes,
+    exportar_metricas,
+    get_connection,
+    get_metricas,
+)
+
+log = logging.getLogger("worker_notificacoes")
+
+CONFIG_PADRAO = {
+    "concorrencia": 4,       # envios SMTP simultâneos
+    "lote": 20,              # notificações reservadas por ciclo
+    "max_tentativas": 8,     # depois disso a notificação fica com status 'falhou'
+    "backoff_base": 30,      # segundos até a 1ª nova tentativa (dobra a cada falha)
+    "backoff_max": 3600,     # teto do backoff, em segundos
+    "lease": 300,            # segundos que uma notificação fica reservada para este worker
+    "intervalo": 5,          # segundos entre consultas quando a fila está vazia
+    "modo": "imediato",      # imediato | resumo
+    "janela_resumo": 900,    # segundos que as avaliações de um estudo esperam pelo resumo
+    "porta_metricas": 9465,  # métricas Prometheus do worker (0 desliga)
+}
+
+
+def carregar_config(args) -> dict:
+    """Combina os padrões, a seção [notificacoes] do secrets.toml e os argumentos da linha de comando"""
+    config = dict(CONFIG_PADRAO)
+    try:
+        config.update({k: v for k, v in st.secrets.get("notificacoes", {}).items() if k in config})
+    except FileNotFoundError:
+        pass
+    for chave in config:
+        valor = getattr(args, chave, None)
+        if valor is not None:
+            config[chave] = valor
+    return config
+
+
+def calcular_backoff(tentativas: int, base: float, maximo: float) -> float:
+    """Backoff exponencial com jitter: base * 2^(tentativas-1), limitado a `maximo`"""
+    atraso = min(maximo, base * (2 ** max(tentativas - 1, 0)))
+    return atraso * random.uniform(0.5, 1.0)
+
+
+# =========================
+# Acesso ao Outbox
+# =========================
+
+# Tipos agrupados no modo resumo; os demais (e os prioritários) seguem imediatos
+TIPOS_RESUMO = [NOTIFICACAO_AVALIACAO, NOTIFICACAO_AVALIACAO_LOTE]
+
+SQL_RESUMIVEL = """
+    (tipo = ANY(%(tipos_resumo)s) AND (payload->>'prioritaria')::boolean IS NOT TRUE)
+"""
+
+
+def reservar_lote(tamanho: int, lease: float, excluir_resumiveis: bool = False) -> list:
+    """
+    Reserva até `tamanho` notificações prontas para envio.
+    SKIP LOCKED permite vários workers em paralelo sem reservar a mesma linha;
+    o lease (disponivel_em no futuro) devolve a linha à fila se o worker cair.
+    No modo resumo (`excluir_resumiveis`) deixa para reservar_resumos as
+    avaliações que podem esperar.
+    """
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(
+            """
+            UPDATE notificacoes_outbox o
+            SET
+                tentativas = o.tentativas + 1,
+                disponivel_em = NOW() + make_interval(secs => %(lease)s)
+            WHERE o.id IN (
+                SELECT id
+                FROM notificacoes_outbox
+                WHERE status = 'pendente'
+                  AND disponivel_em <= NOW()
+                  AND NOT (%(excluir)s AND """ + SQL_RESUMIVEL + """)
+                ORDER BY disponivel_em, id
+                LIMIT %(tamanho)s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.tipo, o.estudo_id, o.desvio_id, o.payload, o.tentativas
+            """,
+            {"lease": lease, "tamanho": tamanho, "excluir": excluir_resumiveis, "tipos_resumo": TIPOS_RESUMO},
+        )
+        lote = cursor.fetchall()
+        conn.commit()
+        return lote
+
+
+def reservar_resumos(estudos: int, lease: float, janela: float) -> list:
+    """
+    Reserva as avaliações resumíveis de até `estudos` estudos cuja avaliação
+    pendente mais antiga já esperou `janela` segundos. Todas as linhas
+    prontas de cada estudo vêm juntas para virar um único resumo.
+    """
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(
+            """
+            UPDATE notificacoes_outbox o
+            SET
+                tentativas = o.tentativas + 1,
+                disponivel_em = NOW() + make_interval(secs => %(lease)s)
+            WHERE o.id IN (
+                SELECT id
+                FROM notificacoes_outbox
+                WHERE status = 'pendente'
+                  AND disponivel_em <= NOW()
+                  AND """ + SQL_RESUMIVEL + """
+                  AND estudo_id IN (
+                      SELECT estudo_id
+                      FROM notificacoes_outbox
+                      WHERE status = 'pendente'
+                        AND disponivel_em <= NOW()
+                        AND """ + SQL_RESUMIVEL + """
+                      GROUP BY estudo_id
+                      HAVING MIN(criado_em) <= NOW() - make_interval(secs => %(janela)s)
+                      ORDER BY MIN(criado_em)
+                      LIMIT %(estudos)s
+                  )
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.tipo, o.estudo_id, o.desvio_id, o.payload, o.tentativas
+            """,
+            {"lease": lease, "janela": janela, "estudos": estudos, "tipos_resumo": TIPOS_RESUMO},
+        )
+        lote = cursor.fetchall()
+        conn.commit()
+        return lote
+
+
+def marcar_enviada(notificacao_id: int):
+    marcar_enviadas([notificacao_id])
+
+
+def marcar_enviadas(ids: list):
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE notificacoes_outbox
+            SET status = 'enviado', enviado_em = NOW(), ultimo_erro = NULL
+            WHERE id = ANY(%s)
+            """,
+            (list(ids),),
+        )
+        conn.commit()
+
+
+def marcar_falha(notificacao: dict, erro: Exception, config: dict):
+    """Agenda nova tentativa com backoff ou desiste após `max_tentativas`"""
+    tentativas = notificacao["tentativas"]
+    desistir = tentativas >= config["max_tentativas"]
+    atraso = 0 if desistir else calcular_backoff(tentativas, config["backoff_base"], config["backoff_max"])
+
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE notificacoes_outbox
+            SET
+                status = %s,
+                ultimo_erro = %s,
+                disponivel_em = NOW() + make_interval(secs => %s)
+            WHERE id = %s
+            """,
+            ("falhou" if desistir else "pendente", str(erro)[:2000], atraso, notificacao["id"]),
+        )
+        conn.commit()
+
+    if desistir:
+        log.error("Notificação %s descartada após %s tentativas: %s", notificacao["id"], tentativas, erro)
+    else:
+        log.warning(
+            "Notificação %s falhou (tentativa %s), nova tentativa em %.0fs: %s",
+            notificacao["id"], tentativas, atraso, erro,
+        )
+
+
+# =========================
+# Envio
+# =========================
+
+def registrar_envio(modo: str, avaliacoes: int, mensagens: int, linha_base: int):
+    """Contadores de mensagens enviadas x um email por avaliação e destinatário"""
+    metricas = get_metricas()
+    rotulos = {"modo": modo}
+    metricas.incrementar("portal_notificacoes_avaliacoes_total", rotulos, avaliacoes)
+    metricas.incrementar("portal_notificacoes_mensagens_total", rotulos, mensagens)
+    metricas.incrementar("portal_notificacoes_mensagens_evitadas_total", rotulos, linha_base - mensagens)
+
+
+def enviar_avaliacao(notificacao: dict):
+    payload = notificacao["payload"]
+    destinatarios = enviar_email_avaliacao(
+        estudo_id=payload["estudo_id"],
+        estudo_codigo=payload.get("estudo_codigo", ""),
+        estudo_nome=payload.get("estudo_nome", ""),
+        numero_desvio=payload.get("numero_desvio", 0),
+        avaliacao=payload.get("avaliacao", ""),
+        gerente_nome=payload.get("gerente_nome", ""),
+        gerente_email=payload.get("gerente_email", ""),
+    )
+    registrar_envio("imediato", 1, destinatarios, destinatarios)
+
+
+def enviar_avaliacao_lote(notificacao: dict):
+    payload = notificacao["payload"]
+    avaliacoes = payload.get("avaliacoes", [])
+    destinatarios = enviar_email_avaliacoes_lote(
+        estudo_id=payload["estudo_id"],
+        estudo_codigo=payload.get("estudo_codigo", ""),
+        estudo_nome=payload.get("estudo_nome", ""),
+        avaliacoes=avaliacoes,
+        gerente_nome=payload.get("gerente_nome", ""),
+        gerente_email=payload.get("gerente_email", ""),
+    )
+    registrar_envio("imediato", len(avaliacoes), destinatarios, destinatarios * len(avaliacoes))
+
+
+def avaliacoes_da_notificacao(notificacao: dict) -> list:
+    """Avaliações de uma notificação (individual ou de lote), cada uma com o seu gerente"""
+    payload = notificacao["payload"]
+    gerente = {"gerente_nome": payload.get("gerente_nome", ""), "gerente_email": payload.get("gerente_email", "")}
+    if notificacao["tipo"] == NOTIFICACAO_AVALIACAO_LOTE:
+        return [{**a, **gerente} for a in payload.get("avaliacoes", [])]
+    return [{
+        "numero_desvio": payload.get("numero_desvio", 0),
+        "avaliacao": payload.get("avaliacao", ""),
+        "importancia": payload.get("importancia"),
+        **gerente,
+    }]
+
+
+def processar_resumo(notificacoes: list, config: dict) -> int:
+    """Envia um resumo com as notificações de um estudo; retorna quantas foram confirmadas"""
+    try:
+        payload = notificacoes[-1]["payload"]
+        avaliacoes = [a for n in notificacoes for a in avaliacoes_da_notificacao(n)]
+        avaliacoes.sort(key=lambda a: a.get("numero_desvio") or 0)
+        envio = enviar_resumo_avaliacoes(
+            estudo_id=notificacoes[0]["estudo_id"],
+            estudo_codigo=payload.get("estudo_codigo", ""),
+            estudo_nome=payload.get("estudo_nome", ""),
+            avaliacoes=avaliacoes,
+        )
+    except Exception as e:
+        for notificacao in notificacoes:
+            marcar_falha(notificacao, e, config)
+        return 0
+
+    marcar_enviadas([n["id"] for n in notificacoes])
+    registrar_envio("resumo", len(avaliacoes), envio["mensagens"], envio["linha_base"])
+    return len(notificacoes)
+
+
+ENVIOS_POR_TIPO = {
+    NOTIFICACAO_AVALIACAO: enviar_avaliacao,
+    NOTIFICACAO_AVALIACAO_LOTE: enviar_avaliacao_lote,
+}
+
+
+def processar(notificacao: dict, config: dict) -> bool:
+    """Envia uma notificação e registra o resultado no outbox"""
+    try:
+        envio = ENVIOS_POR_TIPO.get(notificacao["tipo"])
+        if envio is None:
+            raise ValueError(f"Tipo de notificação desconhecido: {notificacao['tipo']}")
+        envio(notificacao)
+    except Exception as e:
+        marcar_falha(notificacao, e, config)
+        return False
+
+    marcar_enviada(notificacao["id"])
+    return True
+
+
+def drenar(config: dict, executor: ThreadPoolExecutor, parar: threading.Event = None) -> int:
+    """Processa lotes até a fila ficar vazia; retorna quantas notificações foram enviadas"""
+    resumo = config["modo"] == "resumo"
+    enviadas = 0
+    while not (parar and parar.is_set()):
+        lote = reservar_lote(config["lote"], config["lease"], excluir_resumiveis=resumo)
+        if not lote:
+            break
+        resultados = executor.map(lambda n: processar(n, config), lote)
+        enviadas += sum(1 for ok in resultados if ok)
+
+    # Modo resumo: uma tarefa por estudo com a janela vencida
+    while resumo and not (parar and parar.is_set()):
+        lote = reservar_resumos(config["lote"], config["lease"], config["janela_resumo"])
+        if not lote:
+            break
+        por_estudo = defaultdict(list)
+        for notificacao in lote:
+            por_estudo[notificacao["estudo_id"]].append(notificacao)
+        enviadas += sum(executor.map(lambda ns: processar_resumo(ns, config), por_estudo.values()))
+    return enviadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Envia as notificações pendentes do outbox do portal")
+    parser.add_argument("--uma-vez", action="store_true", help="esvazia a fila uma vez e termina")
+    parser.add_argument("--concorrencia", type=int, help="envios SMTP simultâneos")
+    parser.add_argument("--lote", type=int, help="notificações reservadas por ciclo")
+    parser.add_argument("--max-tentativas", dest="max_tentativas", type=int)
+    parser.add_argument("--intervalo", type=float, help="segundos entre consultas com a fila vazia")
+    parser.add_argument("--modo", choices=["imediato", "resumo"], help="um email por avaliação ou resumo por estudo")
+    parser.add_argument("--janela-resumo", dest="janela_resumo", type=float, help="segundos de espera do resumo")
+    parser.add_argument("--porta-metricas", dest="porta_metricas", type=int, help="porta das métricas (0 desliga)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    config = carregar_config(args)
+
+    exportar_metricas(porta=config["porta_metricas"])
+
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+
+    log.info(
+        "Worker iniciado (concorrência=%s, lote=%s, modo=%s)",
+        config["concorrencia"], config["lote"], config["modo"],
+    )
+    with ThreadPoolExecutor(max_workers=config["concorrencia"], thread_name_prefix="envio") as executor:
+        while not parar.is_set():
+            try:
+                enviadas = drenar(config, executor, parar)
+                if enviadas:
+                    log.info("%s notificação(ões) enviada(s)", enviadas)
+            except Exception as e:
+                log.exception("Erro ao processar o outbox: %s", e)
+            if args.uma_vez:
+                break
+            parar.wait(config["intervalo"])
+
+    log.info("Worker encerrado")
+
+
+if __name__ == "__main__":
+    main()